@@ -3,9 +3,13 @@ Mongo DB connection helper
 """
 import json
 import logging
+import threading
+from contextlib import contextmanager
 
 from bson import json_util
 from pymongo import MongoClient
+from helpers import metrics
+from helpers import tracing
 from helpers.environment import Environment
 
 
@@ -13,6 +17,11 @@ class MongoDbAccessor(object):
     """
     Base class for MongoDB accessors
     """
+    # The MongoClient of each URI, shared by all accessors.  A MongoClient is thread-safe and has its own connection
+    # pool, so creating one per accessor only adds the cost of discovering the servers again.
+    _clients = dict()
+    _clients_lock = threading.Lock()
+
     def __init__(self, collection_name, logger=logging.getLogger(__name__)):
         env = Environment()
         uri = env.mongodb_uri
@@ -21,7 +30,7 @@ class MongoDbAccessor(object):
         self.logger = logger
 
         self.logger.info("Connecting to {} database on Mongo".format(db_name))
-        self.mongo_client = MongoClient(uri)
+        self.mongo_client = self._get_client(uri)
         self.database = self.mongo_client[db_name]
         self.collection = self.database[collection_name]
 
@@ -35,7 +44,8 @@ class MongoDbAccessor(object):
         Returns items from the collection using a query and a projection.
         """
         self.logger.debug('Retrieving {cn} documents from database'.format(cn=self.collection_name))
-        return [self.mongo_to_python(doc) for doc in self.collection.find(query, projection)]
+        with self._operation('find'):
+            return [self.mongo_to_python(doc) for doc in self.collection.find(query, projection)]
         # return [json.loads(json_util.dumps(doc)) for doc in self.collection.find(query, projection)]
 
     def find_one(self, query, projection):
@@ -43,7 +53,8 @@ class MongoDbAccessor(object):
         Returns one element found by filter
         """
         self.logger.debug('Retrieving one {cn} document from database'.format(cn=self.collection_name))
-        return self.mongo_to_python(self.collection.find_one(query, projection))
+        with self._operation('find_one'):
+            return self.mongo_to_python(self.collection.find_one(query, projection))
         # return json.loads(json_util.dumps(self.collection.find_one(query, projection)))
 
     def count(self, query):
@@ -52,7 +63,8 @@ class MongoDbAccessor(object):
         """
         self.logger.debug('Counting {cn} documents in database with query {qry}'
                           .format(cn=self.collection_name, qry=str(query)))
-        return self.collection.count(query)
+        with self._operation('count'):
+            return self.collection.count(query)
 
     def aggregate(self, pipeline):
         """
@@ -60,8 +72,9 @@ class MongoDbAccessor(object):
         """
         self.logger.debug('Retrieving {cn} document aggregation from database with pipeline {pl}'
                           .format(cn=self.collection_name, pl=str(pipeline)))
-        cursor = self.collection.aggregate(pipeline)
-        return [self.mongo_to_python(doc) for doc in cursor]
+        with self._operation('aggregate'):
+            cursor = self.collection.aggregate(pipeline)
+            return [self.mongo_to_python(doc) for doc in cursor]
         # return self.collection.aggregate(pipeline)
 
     def update_one(self, query, update):
@@ -72,7 +85,8 @@ class MongoDbAccessor(object):
         :return: an instance of UpdateResult
         """
         self.logger.debug('Updating one {cn} document in database'.format(cn=self.collection_name))
-        return self.collection.update_one(query, update)
+        with self._operation('update_one'):
+            return self.collection.update_one(query, update)
 
     def update_many(self, query, update):
         """
@@ -82,7 +96,59 @@ class MongoDbAccessor(object):
         :return: an instance of UpdateResult
         """
         self.logger.debug('Updating multiple {cn} documents in database'.format(cn=self.collection_name))
-        return self.collection.update_many(query, update)
+        with self._operation('update_many'):
+            return self.collection.update_many(query, update)
+
+    def bulk_write(self, requests, ordered=False):
+        """
+        Sends many write operations to the database in as few round trips as possible.
+        :param requests: a list of pymongo write operations (UpdateOne, InsertOne, etc.)
+        :param ordered: if False, the operations may be applied in any order and a failed operation does not
+                        prevent the remaining operations from being applied
+        :return: an instance of BulkWriteResult
+        :raises BulkWriteError if any of the operations failed
+        """
+        self.logger.debug('Bulk writing {cnt} {cn} operations to database'
+                          .format(cnt=len(requests), cn=self.collection_name))
+        with self._operation('bulk_write'):
+            return self.collection.bulk_write(requests, ordered=ordered)
+
+    @contextmanager
+    def _operation(self, operation):
+        """
+        Context manager that records the time spent in its block as a call of the operation, in a metric and in a
+        tracing span.
+        :param operation: the name of the collection method
+        """
+        with tracing.start_span('mongodb.' + operation, {'db.system': 'mongodb',
+                                                         'db.name': self.db_name,
+                                                         'db.mongodb.collection': self.collection_name,
+                                                         'db.operation': operation}):
+            with metrics.histogram('mongodb_operation_duration_seconds', 'Latency of MongoDB operations',
+                                   {'collection': self.collection_name, 'operation': operation}).time():
+                yield
+
+    @classmethod
+    def _get_client(cls, uri):
+        """
+        Returns the shared MongoClient of the URI, creating it if needed.  The client is created with connect=False,
+        so it does not connect to the database until the first operation; creating it does not block start-up.
+        :param uri: the URI of the MongoDB database
+        :return: the MongoClient
+        """
+        with cls._clients_lock:
+            if uri not in cls._clients:
+                cls._clients[uri] = MongoClient(uri, connect=False)
+            return cls._clients[uri]
+
+    @classmethod
+    def _drop_clients(cls):
+        """
+        Not intended for production code.  Only to be used for unit testing to ensure a new MongoClient is created
+        for each test case.
+        """
+        with cls._clients_lock:
+            cls._clients.clear()
 
     @staticmethod
     def mongo_to_python(doc):
@@ -2,24 +2,53 @@
 Patient Accessor
 """
 
+import codecs
+import json
 import logging
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from helpers import metrics
+from helpers import tracing
 from helpers.environment import Environment
 # from oauthlib.oauth2 import LegacyApplicationClient
 # from requests_oauthlib import OAuth2Session
-# from threading import Lock
+
 
 class PatientAccessor(object):
     """
     The Patient data accessor
     """
-    def __init__(self):
+    # Responses with these status codes are considered transient and the request is retried.
+    RETRY_STATUS_CODES = (500, 502, 503, 504)
+    NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+    # Size of the pieces in which streamed response bodies are read and decoded
+    STREAM_CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, pool_size=None):
+        """
+        :param pool_size: the maximum number of connections kept open to the Patient API; defaults to the
+                          refresher_concurrency configuration setting so that every refresher thread can have one.
+        """
+        env = Environment()
         self.logger = logging.getLogger(__name__)
-        self.url = "{}/{}".format(Environment().patient_api_url, 'by_treatment_arm')
+        self.url = "{}/{}".format(env.patient_api_url, 'by_treatment_arm')
+        self.timeout = (env.patient_api_connect_timeout, env.patient_api_read_timeout)
+        self.max_retries = env.patient_api_max_retries
+        self.backoff_factor = env.patient_api_backoff_factor
+
+        # A single session is shared by all requests so that connections are pooled and kept alive.
+        pool_size = pool_size or env.refresher_concurrency
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.request_timer = metrics.timer('patient_api_request_seconds', 'Latency of Patient API GET requests')
+        self.retry_counter = metrics.counter('patient_api_retries_total', 'Patient API GET requests retried')
         self.logger.debug("Connecting to Patient API at {}".format(self.url))
-        # self.lock = Lock()
         # self.client = LegacyApplicationClient(client_id='')
         # self.oauth = OAuth2Session(client=self.client)
         # self.token = self.oauth.fetch_token(token_url="https://ncimatch.auth0.com/oauth/ro",
@@ -41,31 +70,194 @@ class PatientAccessor(object):
         headers = {"Authorization": authorization_token} if authorization_token else {}
 
         self.logger.debug('Retrieving Patients from {}'.format(trtmt_id_url))
-        # self.logger.debug('Token: {}'.format(str(self.token)))
-        # self.logger.debug('Token: {}'.format(headers.get('Authorization', None)))
-        # self.lock.acquire()
+        response = self._get(trtmt_id_url, headers)
+        result = response.json()
+
+        self.logger.debug('status_code: {}'.format(response.status_code))
+        self._check_status(response, result)
+
+        return result
+
+    def iter_patients_by_treatment_arm_id(self, trtmt_id, authorization_token=None):
+        """
+        Same as get_patients_by_treatment_arm_id except that the response is streamed:  each patient is decoded and
+        handed off as it arrives, so the patients of the arm are never all in memory at the same time.
+        :param trtmt_id: a string containing the TreatmentArm ID
+        :return: generator of patient JSON documents
+        """
+        trtmt_id_url = "{}/{}".format(self.url, trtmt_id)
+        headers = {"Authorization": authorization_token} if authorization_token else {}
+
+        self.logger.debug('Streaming Patients from {}'.format(trtmt_id_url))
+        response = self._get(trtmt_id_url, headers, stream=True)
         try:
-            # oauth = OAuth2Session(client=self.client, token=self.token, scope=self.scope)
-            #
-            # response = oauth.get(trtmt_id_url)
-            response = requests.get(trtmt_id_url, headers=headers)
+            if response.status_code != 200:
+                self._check_status(response, response.json())
+            for patient in self._iter_response_patients(response):
+                yield patient
+        finally:
+            response.close()
 
-        except Exception as e:
-            err_msg = "GET {url} resulted in exception: {exc}".format(url=self.url, exc=str(e))
-            raise Exception(err_msg)
-        # finally:
-        #     self.lock.release()
+    def iter_patients_by_treatment_arm_ids(self, trtmt_ids, authorization_token=None):
+        """
+        Gets patient data for the patients associated (currently or formerly) with any of the given TreatmentIds
+        in a single request.  The Patient API is asked to stream the patients as newline-delimited JSON so that
+        each one can be handed off as soon as it arrives; a plain JSON array is accepted as well.
+        Within each TreatmentId, the patients are in the same order as get_patients_by_treatment_arm_id returns them.
+        :param trtmt_ids: a list of strings containing the TreatmentArm IDs
+        :return: generator of (TreatmentArm ID, patient JSON document) tuples
+        """
+        trtmt_ids = list(trtmt_ids)
+        params = {'treatmentArmIds': ','.join(trtmt_ids)}
+        headers = {'Accept': self.NDJSON_CONTENT_TYPE}
+        if authorization_token:
+            headers['Authorization'] = authorization_token
 
-        result = response.json()
+        self.logger.debug('Retrieving Patients for {cnt} treatment arms from {url}'
+                          .format(cnt=len(trtmt_ids), url=self.url))
+        response = self._get(self.url, headers, params=params, stream=True)
+        try:
+            if response.status_code != 200:
+                self._check_status(response, response.json())
 
-        self.logger.debug('status_code: {}'.format(response.status_code))
+            requested_ids = set(trtmt_ids)
+            for patient in self._iter_response_patients(response):
+                trtmt_id = self.get_treatment_arm_id(patient)
+                if trtmt_id in requested_ids:
+                    yield trtmt_id, patient
+                else:
+                    self.logger.warning("Patient {psn} returned for unrequested treatment arm '{ta}'; ignored"
+                                        .format(psn=patient.get('patientSequenceNumber'), ta=trtmt_id))
+        finally:
+            response.close()
+
+    def get_patients_by_treatment_arm_ids(self, trtmt_ids, authorization_token=None):
+        """
+        Gets patient data for the patients associated with any of the given TreatmentIds in a single request
+        (see iter_patients_by_treatment_arm_ids) grouped by TreatmentArm ID.
+        :param trtmt_ids: a list of strings containing the TreatmentArm IDs
+        :return: dict of arrays of patient JSON documents keyed by TreatmentArm ID; every ID in trtmt_ids is included
+        """
+        trtmt_ids = list(trtmt_ids)
+        patients_by_arm = dict([(trtmt_id, []) for trtmt_id in trtmt_ids])
+        for trtmt_id, patient in self.iter_patients_by_treatment_arm_ids(trtmt_ids, authorization_token):
+            patients_by_arm[trtmt_id].append(patient)
+        return patients_by_arm
+
+    def _iter_response_patients(self, response):
+        """
+        Decodes the patients in the body of a streamed response as they arrive, whether the body is
+        newline-delimited JSON or a JSON array.
+        :param response: a successful response to a request sent with stream=True
+        :return: generator of patient JSON documents
+        """
+        if self.NDJSON_CONTENT_TYPE in response.headers.get('Content-Type', ''):
+            return (json.loads(line) for line in response.iter_lines() if line)
+        decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')()
+        return self.iter_json_array(decoder.decode(chunk) for chunk in response.iter_content(self.STREAM_CHUNK_SIZE))
+
+    @staticmethod
+    def iter_json_array(chunks):
+        """
+        Incrementally decodes a JSON array of objects that arrives in pieces, yielding each element as soon as
+        it is complete.
+        :param chunks: iterable of strings that, concatenated, make up the JSON array
+        :return: generator of the decoded elements of the array
+        """
+        decoder = json.JSONDecoder()
+        buffer = ''
+        started = False
+        for chunk in chunks:
+            buffer += chunk
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != '[':
+                        raise Exception("Expected a JSON array but found '{}'".format(buffer[pos:pos + 20]))
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    element, pos = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    break  # the element is not complete yet
+                yield element
+            buffer = buffer[pos:]
+        raise Exception("Incomplete JSON array: {}".format(buffer[:100] if buffer else 'empty response'))
+
+    @staticmethod
+    def get_treatment_arm_id(patient):
+        """
+        :param patient: a patient JSON document as returned by the Patient API
+        :return: the ID of the treatment arm of the patient's assignment, or None if it has none
+        """
+        treatment_arm = patient.get('treatmentArm') or patient.get('patientAssignments', {}).get('treatmentArm')
+        return treatment_arm.get('treatmentArmId') if treatment_arm else None
+
+    def _check_status(self, response, result):
+        """
+        Raises an exception describing the error if response is not successful.
+        :param response: the response from the Patient API
+        :param result: the decoded JSON body of response
+        """
         if response.status_code != 200:
             desc = result['description'] if 'description' in result else str(result)
             err_msg = "{url} returned {code}: {description}".format(url=self.url, code=response.status_code,
                                                                     description=desc)
             raise Exception(err_msg)
 
-        return result
+    def _get(self, url, headers, params=None, stream=False):
+        """
+        Sends a GET request to url on the pooled session.  Connection errors, timeouts, and responses with one of
+        the RETRY_STATUS_CODES are retried up to self.max_retries times with exponential backoff.
+        :param url: the URL to get
+        :param headers: the request headers
+        :param params: the query string parameters, if any
+        :param stream: if True, the response body is not read until it is accessed
+        :return: the response to the last attempt
+        """
+        attempt = 0
+        while True:
+            response = None
+            start = time.perf_counter()
+            with tracing.start_span('PatientAccessor.get', {'http.method': 'GET', 'http.url': url,
+                                                             'retry': attempt}) as span:
+                try:
+                    response = self.session.get(url, headers=headers, params=params, stream=stream,
+                                                timeout=self.timeout)
+                    span.set_attribute('http.status_code', response.status_code)
+                    failure = response.status_code if response.status_code in self.RETRY_STATUS_CODES else None
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    span.record_exception(e)
+                    failure = e
+                except Exception as e:
+                    raise Exception("GET {url} resulted in exception: {exc}".format(url=self.url, exc=str(e)))
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.request_timer.observe(elapsed)
+
+            if failure is None or attempt >= self.max_retries:
+                break
+
+            if response is not None:
+                response.close()  # returns the connection to the pool
+            attempt += 1
+            self.retry_counter.inc()
+            delay = self.backoff_factor * (2 ** (attempt - 1))
+            self.logger.warning("GET {url} failed after {secs:.2f} seconds ({fail}); retry {n}/{max} in {delay} "
+                                "seconds".format(url=url, secs=elapsed, fail=str(failure), n=attempt,
+                                                 max=self.max_retries, delay=delay))
+            time.sleep(delay)
+
+        if response is None:
+            raise Exception("GET {url} resulted in exception: {exc}".format(url=self.url, exc=str(failure)))
+        return response
 
     # class PatientAccessor(MongoDbAccessor):
     #     """
@@ -0,0 +1,39 @@
+import logging
+import time
+
+from pymongo.errors import DuplicateKeyError
+
+from accessors.mongo_db_accessor import MongoDbAccessor
+
+
+class RefreshScheduleAccessor(MongoDbAccessor):
+    """
+    The accessor of the schedule of the periodic full refreshes of the summary reports, which is shared by all of
+    the message managers so that only one of them runs each full refresh.
+    """
+    FULL_REFRESH_ID = 'summaryReportFullRefresh'
+
+    def __init__(self):
+        MongoDbAccessor.__init__(self, 'refreshSchedule', logging.getLogger(__name__))
+
+    def claim_full_refresh(self, interval):
+        """
+        Claims the next full refresh if none has started in the last interval seconds.  The claim is a single
+        conditional update, so when several message managers try at the same time, only one of them succeeds.
+        :param interval: the seconds between full refreshes
+        :return: a tuple of True if the full refresh was claimed (and so is to be run by the caller) or False if it was
+                 not, and the time, as seconds since the epoch, that the last full refresh started (None if unknown)
+        """
+        now = time.time()
+        query = {'_id': self.FULL_REFRESH_ID, '$or': [{'lastStarted': None}, {'lastStarted': {'$lte': now - interval}}]}
+        try:
+            with self._operation('update_one'):
+                result = self.collection.update_one(query, {'$set': {'lastStarted': now}}, upsert=True)
+            if result.modified_count or result.upserted_id is not None:
+                self.logger.info("Claimed the full refresh of the summary reports")
+                return True, now
+        except DuplicateKeyError:
+            pass  # another message manager has claimed it (or the schedule document was created meanwhile)
+
+        schedule = self.find_one({'_id': self.FULL_REFRESH_ID}, {'lastStarted': 1})
+        return False, schedule.get('lastStarted') if schedule else None
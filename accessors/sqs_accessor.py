@@ -2,6 +2,8 @@
 Implements the SqsAccessor class, a wrapper around the Amazon Simple Queue Service (SQS):
 https://boto3.readthedocs.io/en/latest/reference/services/sqs.html
 """
+import threading
+
 import boto3
 
 from helpers.environment import Environment
@@ -9,23 +11,122 @@ from helpers.environment import Environment
 # REGION = Environment().region
 
 class SqsAccessor(object):
+    # The most messages that SQS receives or deletes in a single call, and the longest it waits for one to arrive.
+    MAX_BATCH_SIZE = 10
+    MAX_WAIT_TIME = 20
+
     def __init__(self, queue_name):
-        self.sqs_client = boto3.client('sqs', region_name=Environment().region)
+        """
+        The SQS client and the queue are not created until they are first used, so that creating the accessor does
+        not wait on SQS.
+        :param queue_name: the name of the queue, which is created if it does not exist
+        """
         self.queue_name = queue_name
-        response = self.sqs_client.create_queue(QueueName=queue_name)
-        self.queue_url = response['QueueUrl']
+        self._sqs_client = None
+        self._queue_url = None
+        self._lock = threading.RLock()
+
+    @property
+    def sqs_client(self):
+        with self._lock:
+            if self._sqs_client is None:
+                env = Environment()
+                # sqs_endpoint_url is only set to use a local stand-in for SQS, such as ElasticMQ, during development.
+                self._sqs_client = boto3.client('sqs', region_name=env.region,
+                                                endpoint_url=env.sqs_endpoint_url or None)
+            return self._sqs_client
+
+    @sqs_client.setter
+    def sqs_client(self, sqs_client):
+        self._sqs_client = sqs_client
+
+    @property
+    def queue_url(self):
+        with self._lock:
+            if self._queue_url is None:
+                self._queue_url = self.sqs_client.create_queue(QueueName=self.queue_name)['QueueUrl']
+            return self._queue_url
 
-    def receive_message(self, attribute_names=None, max_message_cnt=1):
+    @queue_url.setter
+    def queue_url(self, queue_url):
+        self._queue_url = queue_url
+
+    def receive_message(self, attribute_names=None, max_message_cnt=1, wait_time=0, visibility_timeout=None):
+        """
+        :param attribute_names: names of the message attributes to return with the messages
+        :param max_message_cnt: the most messages to return (1 to MAX_BATCH_SIZE)
+        :param wait_time: seconds (0 to MAX_WAIT_TIME) to wait for a message if none is available (long polling)
+        :param visibility_timeout: seconds that the messages are hidden from other receives; if None, the queue's
+                                   default visibility timeout
+        :return: the response dict returned from SQS; the messages, if any, are in its 'Messages' item
+        """
         if attribute_names is None:
             attribute_names = []
+        kwargs = {'VisibilityTimeout': visibility_timeout} if visibility_timeout is not None else {}
         return self.sqs_client.receive_message(QueueUrl=self.queue_url,
                                                AttributeNames=attribute_names,
-                                               MaxNumberOfMessages=max_message_cnt)
+                                               MaxNumberOfMessages=max_message_cnt,
+                                               WaitTimeSeconds=wait_time,
+                                               **kwargs)
+
+    def receive_messages(self, attribute_names=None, max_message_cnt=MAX_BATCH_SIZE, wait_time=MAX_WAIT_TIME,
+                         visibility_timeout=None):
+        """
+        Receives a batch of messages with long polling:  returns as soon as there are messages, or after waiting
+        wait_time seconds for some to arrive.
+        :param attribute_names: names of the message attributes to return with the messages
+        :param max_message_cnt: the most messages to return; limited to MAX_BATCH_SIZE
+        :param wait_time: the most seconds to wait for a message; limited to MAX_WAIT_TIME
+        :param visibility_timeout: seconds that the messages are hidden from other receives; if None, the queue's
+                                   default visibility timeout
+        :return: a list of the messages received, which is empty if there were none
+        """
+        response = self.receive_message(attribute_names,
+                                        max(1, min(int(max_message_cnt), self.MAX_BATCH_SIZE)),
+                                        max(0, min(int(wait_time), self.MAX_WAIT_TIME)),
+                                        visibility_timeout)
+        return response.get('Messages', [])
 
     def delete_message(self, message):
         self.sqs_client.delete_message(QueueUrl=self.queue_url,
                                        ReceiptHandle=message['ReceiptHandle'])
 
+    def delete_messages(self, messages):
+        """
+        Deletes the given messages from the queue with as few delete_message_batch calls as possible.
+        :param messages: a list of the messages to delete, as returned by receive_messages
+        :return: a list of (message, reason) tuples for the messages that could not be deleted
+        """
+        return self._call_in_batches(self.sqs_client.delete_message_batch, messages, dict())
+
+    def change_visibility(self, messages, visibility_timeout):
+        """
+        Hides the given messages from other receives for visibility_timeout seconds from now, with as few
+        change_message_visibility_batch calls as possible.  A visibility_timeout of 0 makes them visible right away.
+        :param messages: a list of the messages, as returned by receive_messages
+        :param visibility_timeout: seconds that the messages are to be hidden
+        :return: a list of (message, reason) tuples for the messages whose visibility could not be changed
+        """
+        return self._call_in_batches(self.sqs_client.change_message_visibility_batch, messages,
+                                     {'VisibilityTimeout': int(visibility_timeout)})
+
+    def _call_in_batches(self, batch_operation, messages, entry_params):
+        """
+        Calls one of the SQS batch operations for every MAX_BATCH_SIZE of the given messages.
+        :param batch_operation: the sqs_client method
+        :param messages: a list of the messages
+        :param entry_params: dict of parameters added to the entry of each message
+        :return: a list of (message, reason) tuples for the messages that failed
+        """
+        failures = []
+        for start in range(0, len(messages), self.MAX_BATCH_SIZE):
+            batch = messages[start:start + self.MAX_BATCH_SIZE]
+            entries = [dict(entry_params, Id=str(i), ReceiptHandle=msg['ReceiptHandle']) for i, msg in enumerate(batch)]
+            response = batch_operation(QueueUrl=self.queue_url, Entries=entries)
+            failures.extend([(batch[int(failed['Id'])], failed.get('Message', failed.get('Code')))
+                             for failed in response.get('Failed', [])])
+        return failures
+
     def send_message(self, message_body):
         return self.sqs_client.send_message(QueueUrl=self.queue_url,
                                             MessageBody=message_body)
@@ -1,5 +1,7 @@
 import logging
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
 from accessors.mongo_db_accessor import MongoDbAccessor
 
@@ -28,7 +30,8 @@ class TreatmentArmsAccessor(MongoDbAccessor):
     SUMMARY_REPORT_REFRESH_PROJECTION = {'treatmentArmId': 1,
                                         'version': 1,
                                         'treatmentArmStatus': 1,
-                                        'stateToken': 1}
+                                        'stateToken': 1,
+                                        'summaryReportFingerprint': 1}
 
     IDENTIFIER_MATCH_STEP = {
         'singleNucleotideVariants': {"variantReport.singleNucleotideVariants": {"$ne": []}},
@@ -88,21 +91,83 @@ class TreatmentArmsAccessor(MongoDbAccessor):
             {"$project": cls.IDENTIFIER_PROJECT_STEP[variant_type]},
         ]
 
-    def get_arms_for_summary_report_refresh(self):
+    def get_arms_for_summary_report_refresh(self, treatment_arm_ids=None):
+        """
+        Gets the active arms whose summary reports are to be refreshed.
+        :param treatment_arm_ids: if given, only the active arms with these TreatmentArm IDs are returned
+        :return: list of treatment arm documents with the fields in SUMMARY_REPORT_REFRESH_PROJECTION
+        """
         self.logger.debug('Retrieving TreatmentArms from database for Summary Report Refresh')
-        return [ta for ta in self.find(self.SUMMARY_REPORT_REFRESH_QUERY,
-                                       self.SUMMARY_REPORT_REFRESH_PROJECTION)]
+        query = self.SUMMARY_REPORT_REFRESH_QUERY
+        if treatment_arm_ids is not None:
+            query = dict(query, treatmentArmId={'$in': list(treatment_arm_ids)})
+        return [ta for ta in self.find(query, self.SUMMARY_REPORT_REFRESH_PROJECTION)]
+
+    def get_arm_ids_for_patients(self, patient_seq_nums):
+        """
+        Finds the active arms whose summary reports contain an assignment record for any of the given patients.
+        :param patient_seq_nums: a list of patient sequence numbers
+        :return: sorted list of TreatmentArm IDs
+        """
+        self.logger.debug('Retrieving TreatmentArms IDs from database for patients {}'.format(patient_seq_nums))
+        query = dict(self.SUMMARY_REPORT_REFRESH_QUERY,
+                     **{'summaryReport.assignmentRecords.patientSequenceNumber': {'$in': list(patient_seq_nums)}})
+        return sorted(set([ta['treatmentArmId'] for ta in self.find(query, {'treatmentArmId': 1, '_id': 0})]))
 
-    def update_summary_report(self, ta_id, sum_rpt_json):
+    def update_summary_report(self, ta_id, sum_rpt_json, fingerprint=None):
         """
         Updates a single summary report for the document identified by ta_id.
         :param ta_id:  the unique _id for the document in the collection
         :param sum_rpt_json:  the updated summary report
+        :param fingerprint:  the fingerprint of sum_rpt_json stored alongside it; if None, any stored fingerprint is
+                             removed, since it no longer matches the summary report
         :returns True/False indicating if it was successful updating the summary report (does NOT imply that it
                  changed any values as it is entirely valid for sum_rpt_json to be exactly the same as what is
                  already in the document)
         """
         ta_id_str = ta_id['$oid']
         self.logger.debug('Updating TreatmentArms with new Summary Report for {_id}'.format(_id=ta_id_str))
-        result = self.update_one({'_id': ObjectId(ta_id_str)}, {'$set': {'summaryReport': sum_rpt_json}})
+        result = self.update_one({'_id': ObjectId(ta_id_str)}, self._summary_report_update(sum_rpt_json, fingerprint))
         return result.matched_count == 1  # indicates that it matched an existing document, not that it modified it
+
+    def update_summary_reports(self, updates):
+        """
+        Updates many summary reports with a single unordered bulk write.
+        :param updates: a list of (ta_id, sum_rpt_json, fingerprint) tuples; see update_summary_report for a
+                        description of each
+        :returns a list of True/False values, one for each item in updates, indicating if it was successful updating
+                 that summary report (again, does NOT imply that it changed any values)
+        """
+        if not updates:
+            return []
+
+        self.logger.debug('Updating {cnt} TreatmentArms with new Summary Reports'.format(cnt=len(updates)))
+        object_ids = [ObjectId(ta_id['$oid']) for ta_id, _, _ in updates]
+        operations = [UpdateOne({'_id': object_id}, self._summary_report_update(sum_rpt_json, fingerprint))
+                      for object_id, (_, sum_rpt_json, fingerprint) in zip(object_ids, updates)]
+
+        try:
+            matched_count = self.bulk_write(operations, ordered=False).matched_count
+            failed_indices = set()
+        except BulkWriteError as exc:
+            details = exc.details
+            self.logger.error('Bulk update of Summary Reports had errors: {}'.format(str(details)))
+            if details.get('writeConcernErrors'):
+                return [False] * len(updates)  # cannot tell which, if any, of the updates were applied
+            matched_count = details.get('nMatched', 0)
+            failed_indices = set([err['index'] for err in details.get('writeErrors', [])])
+
+        results = [i not in failed_indices for i in range(len(updates))]
+        if matched_count < results.count(True):
+            # Some of the documents no longer exist; one more round trip identifies which ones.
+            candidate_ids = [object_ids[i] for i, ok in enumerate(results) if ok]
+            existing_ids = set([doc['_id']['$oid']
+                                for doc in self.find({'_id': {'$in': candidate_ids}}, {'_id': 1})])
+            results = [ok and str(object_ids[i]) in existing_ids for i, ok in enumerate(results)]
+        return results
+
+    @staticmethod
+    def _summary_report_update(sum_rpt_json, fingerprint):
+        if fingerprint is None:
+            return {'$set': {'summaryReport': sum_rpt_json}, '$unset': {'summaryReportFingerprint': ''}}
+        return {'$set': {'summaryReport': sum_rpt_json, 'summaryReportFingerprint': fingerprint}}
@@ -0,0 +1,281 @@
+"""
+Process-level read-through cache of the treatment arm documents returned for a TreatmentArm ID.
+
+Arm definitions rarely change; in practice only their summary reports do, when the Summary Report Refresher writes
+them.  So the documents of an arm are kept, for each query/projection shape, until one of these invalidates them:
+
+*  the Refresher writes the arm's summary report (in this process; the message manager runs alongside the API),
+*  the Refresher finds that the stateTokens of the arm's active versions have changed since it last saw them,
+*  the change-stream listener (arm_cache_change_stream setting; MongoDB replica sets only) sees the arm change, or
+*  the entry is older than arm_cache_ttl seconds, which bounds the staleness when none of the above applies.
+
+Changes that other services make to an arm are only seen by the first two when the Refresher next runs, so unless the
+change-stream listener is on, such changes may take up to arm_cache_ttl seconds to show.
+
+The least recently used entries are evicted once there are more than arm_cache_size of them.
+
+With the shared cache on (helpers/shared_cache.py), what one process loads is also put in the shared cache, where the
+other processes find it, and invalidating an arm in any process (for example, in the message manager after the
+Refresher writes) starts a new generation of the arm that makes every process's cached documents of it out of date.
+"""
+import json
+import logging
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from pymongo.errors import PyMongoError
+
+from accessors.treatment_arm_accessor import TreatmentArmsAccessor
+from helpers import metrics
+from helpers import shared_cache
+from helpers.environment import Environment
+
+SHARED_KEY_FMT = 'treatment_arm:{arm_id}:{generation}:{shape}'
+SHARED_GENERATION_KEY_FMT = 'treatment_arm_generation:{arm_id}'
+
+
+class TreatmentArmCache(object):
+    """
+    LRU cache of the results of loading the documents of a treatment arm, keyed by TreatmentArm ID and the shape of
+    the query and projection.  The results are kept pickled, so that every caller gets its own copy to modify.
+    """
+    # The cache of this process, created from the environment settings by instance()
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __init__(self, max_size, ttl):
+        """
+        :param max_size: the most entries kept; 0 turns caching off
+        :param ttl: the most seconds an entry is kept; 0 keeps entries until they are invalidated or evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.logger = logging.getLogger(__name__)
+        # (arm ID, shape) -> (time loaded, pickled result, shared generation), least recently used first
+        self._entries = OrderedDict()
+        self._generations = dict()     # arm ID -> number of times its entries have been invalidated
+        self._epoch = 0                # number of times the cache has been cleared
+        self._state_tokens = dict()    # arm ID -> the stateTokens of its active versions when last seen
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        """
+        :return: the TreatmentArmCache of this process, creating it if needed
+        """
+        with cls._instance_lock:
+            if cls._instance is None:
+                env = Environment()
+                cls._instance = cls(env.arm_cache_size, env.arm_cache_ttl)
+            return cls._instance
+
+    @classmethod
+    def _instance_to_invalidate(cls):
+        """
+        :return: the TreatmentArmCache of this process if it has one or if the shared cache is on (since the caches
+                 of the other processes may have to be invalidated); otherwise None
+        """
+        if cls._instance is None and shared_cache.enabled():
+            return cls.instance()
+        return cls._instance
+
+    @classmethod
+    def invalidate_arms(cls, arm_ids):
+        """
+        Invalidates the cached documents of the arms, if this process has a cache or the shared cache is on.
+        :param arm_ids: list of TreatmentArm IDs
+        """
+        cache = cls._instance_to_invalidate()
+        if cache is not None:
+            for arm_id in arm_ids:
+                cache.invalidate(arm_id)
+
+    @classmethod
+    def observe_state_tokens(cls, arms):
+        """
+        Invalidates the cached documents of the arms whose active versions' stateTokens differ from the last time
+        they were observed (or that have not been observed before), if this process has a cache or the shared cache
+        is on.
+        :param arms: list of active treatment arm documents with the treatmentArmId and stateToken fields
+        """
+        cache = cls._instance_to_invalidate()
+        if cache is None:
+            return
+
+        tokens_by_arm = dict()
+        for arm in arms:
+            tokens_by_arm.setdefault(arm['treatmentArmId'], []).append(str(arm.get('stateToken')))
+        for arm_id, tokens in tokens_by_arm.items():
+            tokens = sorted(tokens)
+            with cache._lock:
+                changed = cache._state_tokens.get(arm_id) != tokens
+                cache._state_tokens[arm_id] = tokens
+            if changed:
+                cache.invalidate(arm_id)
+
+    @classmethod
+    def _drop(cls):
+        """
+        Not intended for production code.  Only to be used for unit testing.
+        """
+        cls._instance = None
+
+    def get(self, arm_id, shape, loader):
+        """
+        :param arm_id: the TreatmentArm ID
+        :param shape: a hashable description of the query and projection that the loader uses
+        :param loader: a function without arguments that loads the documents from the database
+        :return: a copy of the cached result of the loader, or the result of calling it
+        """
+        if self.max_size <= 0:
+            return loader()
+
+        key = (arm_id, shape)
+        shared_generation = self._get_shared_generation(arm_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if (entry is not None and (self.ttl <= 0 or time.monotonic() - entry[0] < self.ttl) and
+                    entry[2] == shared_generation):
+                self._entries.move_to_end(key)
+            else:
+                entry = None
+            generation = (self._epoch, self._generations.get(arm_id, 0))
+        if entry is not None:
+            metrics.counter('treatment_arm_cache_hits_total', 'Treatment arm lookups served from the cache').inc()
+            return pickle.loads(entry[1])
+        metrics.counter('treatment_arm_cache_misses_total', 'Treatment arm lookups loaded from the database').inc()
+
+        loaded_at, result = self._load(arm_id, shape, shared_generation, loader)
+        pickled_result = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            # If the arm was invalidated while it was being loaded, what was loaded may already be out of date.
+            if (self._epoch, self._generations.get(arm_id, 0)) == generation:
+                self._entries[key] = (loaded_at, pickled_result, shared_generation)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    metrics.counter('treatment_arm_cache_evictions_total',
+                                    'Least recently used treatment arm cache entries evicted').inc()
+        return result
+
+    def _load(self, arm_id, shape, shared_generation, loader):
+        """
+        :return: a tuple of (time.monotonic() when the result was loaded from the database, the result), taken from
+                 the shared cache if another process has already loaded it
+        """
+        if shared_generation is None:
+            return time.monotonic(), loader()
+
+        shared_key = SHARED_KEY_FMT.format(arm_id=arm_id, generation=shared_generation, shape=json.dumps(shape))
+        shared_entry = shared_cache.get_value(shared_key)
+        if shared_entry is not None:
+            return time.monotonic() - max(0.0, time.time() - shared_entry['loaded']), shared_entry['result']
+
+        loaded_at, loaded_time = time.monotonic(), time.time()
+        result = loader()
+        shared_cache.set_value(shared_key, {'loaded': loaded_time, 'result': result}, self.ttl or None)
+        return loaded_at, result
+
+    @staticmethod
+    def _get_shared_generation(arm_id):
+        """
+        :return: the current generation of the arm in the shared cache, or None if the shared cache is off
+        """
+        if not shared_cache.enabled():
+            return None
+        generation = shared_cache.get_value(SHARED_GENERATION_KEY_FMT.format(arm_id=arm_id))
+        return generation if generation is not None else '0'
+
+    def invalidate(self, arm_id):
+        """
+        Removes the cached documents of the arm, in every process if the shared cache is on.
+        :param arm_id: the TreatmentArm ID
+        """
+        with self._lock:
+            self._generations[arm_id] = self._generations.get(arm_id, 0) + 1
+            for key in [key for key in self._entries if key[0] == arm_id]:
+                del self._entries[key]
+        if shared_cache.enabled():
+            shared_cache.set_value(SHARED_GENERATION_KEY_FMT.format(arm_id=arm_id), uuid.uuid4().hex)
+        metrics.counter('treatment_arm_cache_invalidations_total', 'Treatment arms invalidated in the cache').inc()
+        self.logger.debug("Cached documents of treatment arm {} invalidated".format(arm_id))
+
+    def clear(self):
+        """
+        Removes all of the cached documents.
+        """
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ArmChangeListener(object):
+    """
+    Invalidates the cached documents of the treatment arms that change in the database, as reported by a MongoDB
+    change stream on the treatmentArms collection.  (Change streams require a replica set.)  If the stream fails,
+    the cache is cleared, since changes may have been missed, and the stream is reopened after retry_interval seconds.
+    """
+    PIPELINE = [{'$project': {'operationType': 1, 'fullDocument.treatmentArmId': 1}}]
+
+    def __init__(self, cache, collection, retry_interval=30.0):
+        """
+        :param cache: the TreatmentArmCache
+        :param collection: the pymongo treatmentArms collection
+        :param retry_interval: seconds to wait before reopening the change stream after it fails
+        """
+        self.cache = cache
+        self.collection = collection
+        self.retry_interval = retry_interval
+        self.logger = logging.getLogger(__name__)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='arm-change-listener', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except PyMongoError as exc:
+                self.logger.error("Treatment arm change stream failed; retrying in {secs} seconds: {exc}"
+                                  .format(secs=self.retry_interval, exc=str(exc)))
+            self.cache.clear()
+            time.sleep(self.retry_interval)
+
+    def _listen(self):
+        with self.collection.watch(self.PIPELINE, full_document='updateLookup') as stream:
+            # Changes made before the stream opened were not seen.
+            self.cache.clear()
+            self.logger.info("Listening for changes to the treatment arms")
+            for change in stream:
+                self.handle_change(change)
+
+    def handle_change(self, change):
+        """
+        :param change: a change event of the change stream
+        """
+        arm_id = (change.get('fullDocument') or dict()).get('treatmentArmId')
+        if arm_id is not None:
+            self.cache.invalidate(arm_id)
+        else:
+            # A deleted document no longer says which arm it belonged to.
+            self.cache.clear()
+
+
+def start_change_listener(env):
+    """
+    Starts the ArmChangeListener of this process's cache if the arm_cache_change_stream setting is on.
+    :param env: the Settings of the environment
+    :return: the ArmChangeListener, or None
+    """
+    if not env.arm_cache_change_stream or env.arm_cache_size <= 0:
+        return None
+    return ArmChangeListener(TreatmentArmCache.instance(), TreatmentArmsAccessor().collection).start()
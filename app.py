@@ -9,19 +9,23 @@ import logging
 from flask import Flask
 from flask_cors import CORS
 from flask_restful import Api
-from tornado.httpserver import HTTPServer
-from tornado.ioloop import IOLoop
-from tornado.wsgi import WSGIContainer
 from threading import Thread
 
-from scripts.ta_message_manager.ta_message_manager import TreatmentArmMessageManager
+# The HTTP server (tornado) and the message manager (boto3 and the summary report refresher) are imported by the
+# functions that run them rather than here, so that importing this module, and so starting the API, is quick.
 
 from config import flask_config
+from accessors import treatment_arm_cache
 from config import log
+from helpers import profiling
+from helpers import shared_cache
+from helpers import tracing
 from helpers.environment import Environment
 from resources.amois import AmoisResource
 from resources.amois import IsAmoisResource
 from resources.healthcheck import HealthCheck
+from resources.metrics import instrument
+from resources.metrics import MetricsResource
 from resources.treatment_arm import TreatmentArms
 from resources.treatment_arm import TreatmentArmsById
 from resources.treatment_arm import TreatmentArmsOverview
@@ -41,7 +45,7 @@ def _initialize_error_handlers(application):
 APP = Flask(__name__)
 APP.config.from_object(flask_config.Configuration)
 _initialize_error_handlers(APP)
-API = Api(APP)
+API = Api(APP, decorators=[instrument])  # records the number and latency of the requests to each resource
 
 # Very important for development as this stands for Cross Origin Resource sharing. Essentially this is what allows for
 # the UI to be run on the same box as this middleware piece of code. Consider this code boiler plate.
@@ -68,11 +72,20 @@ API.add_resource(TreatmentArmsById, '/api/v1/treatment_arms/<string:arm_id>', en
 API.add_resource(TreatmentArmsOverview, '/api/v1/treatment_arms/dashboard/overview')
 API.add_resource(TreatmentArmsPTEN, '/api/v1/treatment_arms/pten')
 API.add_resource(Version, '/api/v1/treatment_arms/version', endpoint='get_version')
+API.add_resource(MetricsResource, '/api/v1/treatment_arms/metrics')
 
 
 def run_api_server():
+    from tornado.httpserver import HTTPServer
+    from tornado.ioloop import IOLoop
+    from tornado.wsgi import WSGIContainer
+
     log.log_config(Environment().logger_level)
     port = Environment().port
+    profiling.install(APP, Environment())
+    tracing.configure(Environment())
+    shared_cache.configure(Environment())
+    treatment_arm_cache.start_change_listener(Environment())
     logging.getLogger(__name__).debug("server starting on port :" + str(port))
     HTTP_SERVER = HTTPServer(WSGIContainer(APP))
     HTTP_SERVER.listen(port=port)
@@ -80,7 +93,11 @@ def run_api_server():
 
 
 def run_message_manager():
+    from scripts.ta_message_manager.ta_message_manager import TreatmentArmMessageManager
+
     log.log_config(Environment().logger_level)
+    tracing.configure(Environment())
+    shared_cache.configure(Environment())
     logging.getLogger(__name__).info("Starting the Treatment Arm API Message Queue")
     TreatmentArmMessageManager().run()
     logging.getLogger(__name__).info("Exiting the Treatment Arm API Message Queue")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Measures the aMOI matching engine (resources/amois.py) on synthetic rule sets and variant reports:  the
+construction of a VariantRulesMgr, find_amois on whole variant reports, is_amoi on single variants, and
+create_amois_annotation on the aMOIs of a variant.  The rules and reports are generated from a seed, so runs with the
+same options measure the same work and their JSON results can be compared between commits.
+
+    PYTHONPATH=. python3 benchmarks/bench_amois.py --rules 500,5000,20000 --reports 50 --json amois.json
+"""
+import copy
+import os
+import random
+import time
+
+from benchmarks import bench_helpers
+
+# VariantRulesMgr creates a TreatmentArmsAccessor, which needs the environment but does not connect to MongoDB.
+os.environ.setdefault('ENVIRONMENT', 'development')
+os.environ.setdefault('MONGODB_URI', 'mongodb://localhost:27017/match')
+
+from resources.amois import VariantRulesMgr, find_amois, create_amois_annotation  # noqa: E402
+
+# The share of the rules of each kind, keyed by the VariantRulesMgr constructor parameter that receives them
+RULE_MIX = [('snv_identifier_rules', 0.40),
+            ('indel_identifier_rules', 0.20),
+            ('cnv_identifier_rules', 0.15),
+            ('gene_fusion_identifier_rules', 0.15),
+            ('non_hotspot_rules', 0.10)]
+# The variant report field of each kind of identifier rule
+REPORT_FIELDS = {'snv_identifier_rules': 'singleNucleotideVariants',
+                 'indel_identifier_rules': 'indels',
+                 'cnv_identifier_rules': 'copyNumberVariants',
+                 'gene_fusion_identifier_rules': 'unifiedGeneFusions'}
+# The number of variants of each type in a generated variant report
+REPORT_MIX = {'singleNucleotideVariants': 0.45, 'indels': 0.25, 'copyNumberVariants': 0.15, 'unifiedGeneFusions': 0.15}
+STATUSES = ['OPEN', 'OPEN', 'REACTIVATED', 'SUSPENDED', 'CLOSED', 'READY', 'PENDING']
+FUNCTIONS = ['missense', 'nonsense', 'frameshiftDeletion', 'frameshiftInsertion', 'synonymous']
+CLASSES = ['Hotspot', 'Deleterious', 'Fusion', 'Amplification']
+RULES_PER_ARM_VERSION = 40
+GENE_CNT = 400
+
+
+def gene_name(i):
+    return 'GENE{}'.format(i)
+
+
+def identifier_name(i):
+    return 'COSM{}'.format(i)
+
+
+def protein_name(i):
+    return 'p.V{}E'.format(i)
+
+
+class RuleSetGenerator(object):
+    """
+    Generates the rules of a set of arms, each with several versions, the latest of which is the active one.
+    Identifiers and proteins are drawn from pools a few times larger than the number of rules, so that several arms
+    share some of them, as they do in production.
+    """
+    def __init__(self, rule_cnt, versions, seed):
+        self.rng = random.Random(seed)
+        self.rule_cnt = rule_cnt
+        self.versions = versions
+        self.identifier_pool = max(10, rule_cnt * 3)
+
+    def generate(self):
+        """
+        :return: a dict of the keyword arguments of the VariantRulesMgr constructor
+        """
+        rules = dict([(kind, []) for kind, _ in RULE_MIX])
+        arm_cnt = max(1, self.rule_cnt // (RULES_PER_ARM_VERSION * self.versions))
+        kinds = [kind for kind, _ in RULE_MIX]
+        weights = [share for _, share in RULE_MIX]
+        for i in range(self.rule_cnt):
+            arm = i % arm_cnt
+            version = (i // arm_cnt) % self.versions
+            kind = self.rng.choices(kinds, weights)[0]
+            rules[kind].append(self._create_rule(kind, arm, version))
+        return rules
+
+    def _create_rule(self, kind, arm, version):
+        latest = version == self.versions - 1
+        rule = {'treatmentArmId': 'EAY131-{}'.format(arm),
+                'version': '2016-{:02d}-01'.format(version + 1),
+                'dateArchived': None if latest else '2017-01-01',
+                'treatmentArmStatus': self.rng.choice(STATUSES),
+                'inclusion': self.rng.random() < 0.8}
+        if kind == 'non_hotspot_rules':
+            rule.update({'type': 'NonHotspot',
+                         'gene': gene_name(self.rng.randrange(GENE_CNT)),
+                         'exon': str(self.rng.randrange(1, 30)) if self.rng.random() < 0.5 else None,
+                         'function': self.rng.choice(FUNCTIONS) if self.rng.random() < 0.5 else None,
+                         'oncominevariantclass': self.rng.choice(CLASSES) if self.rng.random() < 0.3 else None})
+        else:
+            rule.update({'type': 'Hotspot', 'identifier': identifier_name(self.rng.randrange(self.identifier_pool))})
+            if self.rng.random() < 0.5:
+                rule['protein'] = protein_name(self.rng.randrange(self.identifier_pool))
+        return rule
+
+
+def create_variant_reports(rules, report_cnt, variant_cnt, match_rate, seed):
+    """
+    :param rules: the rules, as returned by RuleSetGenerator.generate
+    :param report_cnt: the number of variant reports
+    :param variant_cnt: the number of variants in each report
+    :param match_rate: the fraction of the variants that are given the identifier or protein of a rule
+    :param seed: the random seed
+    :return: a list of variant reports
+    """
+    rng = random.Random(seed)
+    rules_by_field = dict([(field, rules[kind]) for kind, field in REPORT_FIELDS.items()])
+    reports = []
+    for _ in range(report_cnt):
+        report = dict()
+        for field, share in REPORT_MIX.items():
+            report[field] = [create_variant(rng, rules_by_field[field], match_rate)
+                             for _ in range(max(1, int(round(variant_cnt * share))))]
+        reports.append(report)
+    return reports
+
+
+def create_variant(rng, rules, match_rate):
+    variant = {'identifier': identifier_name(rng.randrange(10 ** 7, 2 * 10 ** 7)),
+               'protein': protein_name(rng.randrange(10 ** 7, 2 * 10 ** 7)),
+               'gene': gene_name(rng.randrange(GENE_CNT)),
+               'exon': str(rng.randrange(1, 30)),
+               'function': rng.choice(FUNCTIONS),
+               'oncominevariantclass': rng.choice(CLASSES)}
+    if rules and rng.random() < match_rate:
+        rule = rng.choice(rules)
+        if 'protein' in rule and rng.random() < 0.5:
+            variant['protein'] = rule['protein']
+        else:
+            variant['identifier'] = rule['identifier']
+    return variant
+
+
+def time_each(func, items):
+    """
+    :param func: a function of one argument
+    :param items: the arguments
+    :return: a list of the durations in seconds of func called on each of the items
+    """
+    samples = []
+    for item in items:
+        start = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def with_throughput(samples, unit):
+    """
+    :param samples: a list of durations in seconds, one for each unit of work
+    :param unit: the name of the unit of work
+    :return: the summary of the samples with the throughput in units per second
+    """
+    stats = bench_helpers.summarize(samples)
+    stats[unit + '_per_sec'] = len(samples) / sum(samples) if sum(samples) else 0.0
+    return stats
+
+
+def run_scale(rule_cnt, args):
+    """
+    :param rule_cnt: the total number of rules
+    :param args: the parsed command line arguments
+    :return: dict of the results keyed by case name
+    """
+    rules = RuleSetGenerator(rule_cnt, args.versions, args.seed).generate()
+    reports = create_variant_reports(rules, args.reports, args.variants, args.match_rate, args.seed + 1)
+    results = dict()
+
+    # VariantRulesMgr modifies the rules it is given, so each call gets a fresh copy, made before it is timed.  The
+    # first, untimed, call warms up the imports and caches that are only paid for once.
+    VariantRulesMgr(**copy.deepcopy(rules))
+    results['construct'] = bench_helpers.summarize(time_each(lambda r: VariantRulesMgr(**r),
+                                                             [copy.deepcopy(rules) for _ in range(args.repeat)]))
+    var_rules_mgr = VariantRulesMgr(**copy.deepcopy(rules))
+
+    # find_amois adds the aMOIs to the reports, so each repetition gets fresh copies.
+    samples = []
+    for _ in range(args.repeat):
+        samples.extend(time_each(lambda vr: find_amois(vr, var_rules_mgr), copy.deepcopy(reports)))
+    results['find_amois'] = with_throughput(samples, 'reports')
+
+    variants = [(variant_type, variant) for report in reports for variant_type, variant_list in report.items()
+                for variant in variant_list]
+    samples = []
+    for _ in range(args.repeat):
+        samples.extend(time_each(lambda tv: var_rules_mgr.is_amoi(tv[1], tv[0]), variants))
+    results['is_amoi'] = with_throughput(samples, 'variants')
+
+    matched = copy.deepcopy(reports)
+    for vr in matched:
+        find_amois(vr, var_rules_mgr)
+    amois_lists = [amois for amois in (match_variant(var_rules_mgr, variant_type, variant)
+                                       for variant_type, variant in variants) if amois]
+    if amois_lists:
+        samples = []
+        for _ in range(args.repeat):
+            samples.extend(time_each(create_amois_annotation, amois_lists))
+        results['create_amois_annotation'] = with_throughput(samples, 'variants')
+        results['create_amois_annotation']['amois_per_variant'] = \
+            sum(len(amois) for amois in amois_lists) / float(len(amois_lists))
+
+    results['find_amois']['matched_variants'] = \
+        sum(1 for vr in matched for variant_list in vr.values() for v in variant_list if 'amois' in v)
+    results['find_amois']['variants'] = len(variants)
+    return results
+
+
+def match_variant(var_rules_mgr, variant_type, variant):
+    """
+    :return: the list of the rules that match the variant, as find_amois collects them
+    """
+    if variant_type == 'copyNumberVariants':
+        return (var_rules_mgr.get_matching_copy_number_variant_identifier_rules(variant) +
+                var_rules_mgr.get_matching_copy_number_variant_protein_rules(variant))
+    if variant_type == 'unifiedGeneFusions':
+        return (var_rules_mgr.get_matching_gene_fusions_identifier_rules(variant) +
+                var_rules_mgr.get_matching_gene_fusions_protein_rules(variant))
+    if variant_type == 'indels':
+        return (var_rules_mgr.get_matching_indel_identifier_rules(variant) +
+                var_rules_mgr.get_matching_indel_protein_rules(variant) +
+                var_rules_mgr.get_matching_nonhotspot_rules(variant))
+    return (var_rules_mgr.get_matching_single_nucleotide_variant_identifier_rules(variant) +
+            var_rules_mgr.get_matching_single_nucleotide_variant_protein_rules(variant) +
+            var_rules_mgr.get_matching_nonhotspot_rules(variant))
+
+
+def main():
+    parser = bench_helpers.create_arg_parser(__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--rules', default='500,5000,20000',
+                        help="comma-separated total numbers of rules; each is benchmarked separately")
+    parser.add_argument('--versions', type=int, default=3, help="versions of each arm (the latest is active)")
+    parser.add_argument('--reports', type=int, default=50, help="number of variant reports")
+    parser.add_argument('--variants', type=int, default=40, help="variants in each variant report")
+    parser.add_argument('--match-rate', type=float, default=0.2,
+                        help="fraction of the variants given the identifier or protein of a rule")
+    parser.add_argument('--seed', type=int, default=131, help="random seed of the generated rules and reports")
+    args = parser.parse_args()
+
+    results = dict()
+    for rule_cnt in [int(cnt) for cnt in args.rules.split(',')]:
+        for case, stats in run_scale(rule_cnt, args).items():
+            results['{}_rules/{}'.format(rule_cnt, case)] = stats
+
+    bench_helpers.report('amois',
+                         {'rules': args.rules, 'versions': args.versions, 'reports': args.reports,
+                          'variants': args.variants, 'match_rate': args.match_rate, 'seed': args.seed,
+                          'repeat': args.repeat},
+                         results, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
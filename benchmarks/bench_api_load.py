@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+Load test of the Treatment Arm API over HTTP.  Starts the API in this process against a local MongoDB (or, without
+--mongodb-uri, against mongomock if it is installed), seeded with generated treatment arms, and drives a weighted mix
+of requests to it from --concurrency client threads.  Reports the throughput, latency percentiles, and error rate of
+each endpoint.  With --url, drives an API that is already running instead.
+
+    PYTHONPATH=. python3 benchmarks/bench_api_load.py --arms 100 --concurrency 8 --duration 30 --json load.json
+    PYTHONPATH=. python3 benchmarks/bench_api_load.py --mongodb-uri mongodb://localhost:27017/match --server tornado
+
+The generated arms are only inserted into an empty treatmentArms collection; with --use-existing the arms already in
+the database are used instead.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import bench_helpers
+from benchmarks.bench_amois import RuleSetGenerator, RULES_PER_ARM_VERSION, create_variant_reports
+
+API_PATH = '/api/v1/treatment_arms'
+DEFAULT_MIX = 'list=25,by_id=35,overview=15,amois=15,is_amoi=10'
+# The variantReport field of the treatment arm documents that holds each kind of generated rule
+ARM_RULE_FIELDS = {'snv_identifier_rules': 'singleNucleotideVariants',
+                   'indel_identifier_rules': 'indels',
+                   'cnv_identifier_rules': 'copyNumberVariants',
+                   'gene_fusion_identifier_rules': 'geneFusions',
+                   'non_hotspot_rules': 'nonHotspotRules'}
+ARM_FIELDS = ['treatmentArmId', 'version', 'dateArchived', 'treatmentArmStatus', 'type']
+ARM_STATUSES = ['OPEN', 'OPEN', 'OPEN', 'SUSPENDED', 'CLOSED', 'PENDING']
+
+
+def create_treatment_arms(arm_cnt, versions, seed):
+    """
+    :param arm_cnt: the number of arms
+    :param versions: the number of versions of each arm; all but the latest are archived
+    :param seed: the random seed
+    :return: a tuple of (a list of treatment arm documents, the rules they contain as RuleSetGenerator.generate
+             returns them)
+    """
+    rules = RuleSetGenerator(arm_cnt * versions * RULES_PER_ARM_VERSION, versions, seed).generate()
+    rng = random.Random(seed)
+    arms = dict()
+    for kind, field in ARM_RULE_FIELDS.items():
+        for rule in rules[kind]:
+            key = (rule['treatmentArmId'], rule['version'])
+            if key not in arms:
+                arms[key] = {'treatmentArmId': rule['treatmentArmId'],
+                             'version': rule['version'],
+                             'name': 'Generated arm ' + rule['treatmentArmId'],
+                             'dateArchived': rule['dateArchived'],
+                             'treatmentArmStatus': rng.choice(ARM_STATUSES),
+                             'statusLog': {'1488461538329': 'PENDING', '1488461582089': 'OPEN'},
+                             'variantReport': dict([(f, []) for f in ARM_RULE_FIELDS.values()])}
+            arms[key]['variantReport'][field].append(dict([(k, v) for k, v in rule.items() if k not in ARM_FIELDS]))
+    return [arms[key] for key in sorted(arms)], rules
+
+
+def parse_mix(mix):
+    """
+    :param mix: comma-separated endpoint=weight pairs, such as 'list=3,by_id=1'
+    :return: a tuple of (list of endpoint names, list of weights)
+    """
+    pairs = [item.split('=') for item in mix.split(',') if item]
+    unknown = [name for name, _ in pairs if name not in ENDPOINTS]
+    if unknown:
+        raise Exception("Unknown endpoints in mix: {}; expected some of {}".format(", ".join(unknown),
+                                                                                    ", ".join(sorted(ENDPOINTS))))
+    return [name for name, _ in pairs], [float(weight) for _, weight in pairs]
+
+
+class Workload(object):
+    """
+    Creates the requests of each endpoint from the generated arms and variant reports.
+    """
+    def __init__(self, arm_ids, variant_reports):
+        self.arm_ids = arm_ids
+        self.variant_reports = variant_reports
+
+    def list(self, rng):
+        return 'GET', API_PATH, {'active': 'true'} if rng.random() < 0.5 else None
+
+    def by_id(self, rng):
+        return 'GET', '{}/{}'.format(API_PATH, rng.choice(self.arm_ids)), None
+
+    def overview(self, rng):
+        return 'GET', API_PATH + '/dashboard/overview', None
+
+    def amois(self, rng):
+        return 'PATCH', API_PATH + '/amois', rng.choice(self.variant_reports)
+
+    def is_amoi(self, rng):
+        variant_report = rng.choice(self.variant_reports)
+        variant_type = rng.choice(sorted(variant_report))
+        return 'PATCH', API_PATH + '/is_amoi', {'type': variant_type, 'variants': variant_report[variant_type]}
+
+
+ENDPOINTS = ['list', 'by_id', 'overview', 'amois', 'is_amoi']
+
+
+def send(session, base_url, workload, endpoint, headers, rng):
+    """
+    Sends one request to the endpoint.
+    :return: True if it succeeded
+    """
+    method, path, payload = getattr(workload, endpoint)(rng)
+    kwargs = {'params': payload} if method == 'GET' else {'json': payload}
+    try:
+        response = session.request(method, base_url + path, headers=headers, timeout=60, **kwargs)
+        response.content  # includes reading the body in the latency
+        return response.status_code < 400
+    except requests.exceptions.RequestException:
+        return False
+
+
+def warm_up(base_url, workload, endpoints, headers, seed):
+    """
+    Sends one request to each endpoint, so that the rules cache of the API is loaded before the load is measured.
+    """
+    rng = random.Random(seed)
+    with requests.Session() as session:
+        for endpoint in endpoints:
+            send(session, base_url, workload, endpoint, headers, rng)
+
+
+def run_client(base_url, workload, endpoints, weights, headers, deadline, seed):
+    """
+    Sends requests, one at a time, until the deadline.
+    :return: a list of (endpoint, seconds, succeeded) tuples
+    """
+    rng = random.Random(seed)
+    session = requests.Session()
+    samples = []
+    while time.perf_counter() < deadline:
+        endpoint = rng.choices(endpoints, weights)[0]
+        start = time.perf_counter()
+        succeeded = send(session, base_url, workload, endpoint, headers, rng)
+        samples.append((endpoint, time.perf_counter() - start, succeeded))
+    session.close()
+    return samples
+
+
+def run_load(base_url, workload, endpoints, weights, headers, concurrency, duration, seed):
+    """
+    :return: a tuple of (list of (endpoint, seconds, succeeded) tuples, seconds that the load ran)
+    """
+    start = time.perf_counter()
+    deadline = start + duration
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(run_client, base_url, workload, endpoints, weights, headers, deadline, seed + i)
+                   for i in range(concurrency)]
+        samples = [sample for future in futures for sample in future.result()]
+    return samples, time.perf_counter() - start
+
+
+def summarize_load(samples, elapsed):
+    """
+    :param samples: a list of (endpoint, seconds, succeeded) tuples
+    :param elapsed: the seconds that the load ran
+    :return: dict of the results of each endpoint and of all of them together
+    """
+    by_endpoint = defaultdict(list)
+    for endpoint, seconds, succeeded in samples:
+        by_endpoint[endpoint].append((seconds, succeeded))
+        by_endpoint['all'].append((seconds, succeeded))
+    results = dict()
+    for endpoint in [e for e in ENDPOINTS if e in by_endpoint] + ['all']:
+        endpoint_samples = by_endpoint[endpoint]
+        if not endpoint_samples:
+            continue
+        stats = bench_helpers.summarize([seconds for seconds, _ in endpoint_samples])
+        errors = sum(1 for _, succeeded in endpoint_samples if not succeeded)
+        stats['requests_per_sec'] = len(endpoint_samples) / elapsed
+        stats['errors'] = errors
+        stats['error_rate'] = errors / float(len(endpoint_samples))
+        results[endpoint] = stats
+    return results
+
+
+class LocalApi(object):
+    """
+    The API served from this process, on a free port of 127.0.0.1, by werkzeug's threaded server or by tornado (as
+    app.run_api_server serves it).
+    """
+    def __init__(self, server):
+        import app
+        from config import log
+        log.log_config('WARNING')  # app logs each request at DEBUG, which would be a large part of the latency
+        self.app = app.APP
+        self.server_name = server
+        self.port = None
+        self._stop = None
+        self._thread = None
+
+    def start(self):
+        started = threading.Event()
+        if self.server_name == 'tornado':
+            target = self._run_tornado(started)
+        else:
+            target = self._run_werkzeug(started)
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        started.wait(30)
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def stop(self):
+        if self._stop:
+            self._stop()
+        self._thread.join(10)
+
+    def _run_werkzeug(self, started):
+        from werkzeug.serving import make_server
+        server = make_server('127.0.0.1', 0, self.app, threaded=True)
+        self.port = server.server_port
+        self._stop = server.shutdown
+
+        def run():
+            started.set()
+            server.serve_forever()
+        return run
+
+    def _run_tornado(self, started):
+        from tornado.httpserver import HTTPServer
+        from tornado.ioloop import IOLoop
+        from tornado.netutil import bind_sockets
+        from tornado.wsgi import WSGIContainer
+        sockets = bind_sockets(0, '127.0.0.1')
+        self.port = sockets[0].getsockname()[1]
+
+        def run():
+            loop = IOLoop()
+            loop.make_current()
+            HTTPServer(WSGIContainer(self.app)).add_sockets(sockets)
+            self._stop = lambda: loop.add_callback(loop.stop)
+            started.set()
+            loop.start()
+        return run
+
+
+def prepare_local_api(args):
+    """
+    Sets up the environment of the API, seeds the database, and starts the API.
+    :return: a tuple of (the LocalApi, list of the arm IDs to request, the rules of the arms or None)
+    """
+    os.environ['UNITTEST'] = '1'  # resources.auth0_resource does not require authentication under unit tests
+    # The API's accessors share this client, so the arms seeded through it are visible to them, even with mongomock.
+    collection = bench_helpers.treatment_arms_collection(args.mongodb_uri)
+    rules = None
+    if args.use_existing:
+        arm_ids = sorted(collection.distinct('treatmentArmId'))
+    elif collection.count() == 0:
+        arms, rules = create_treatment_arms(args.arms, args.versions, args.seed)
+        collection.insert_many(arms)
+        arm_ids = sorted(set(arm['treatmentArmId'] for arm in arms))
+    else:
+        sys.exit("The treatmentArms collection is not empty; use --use-existing to load test with its arms")
+
+    api = LocalApi(args.server)
+    return api, arm_ids, rules
+
+
+def main():
+    parser = bench_helpers.create_arg_parser(__doc__.strip().split('\n\n')[0])
+    parser.set_defaults(repeat=1)
+    parser.add_argument('--url', help="base URL of a running API to load test instead of starting one")
+    parser.add_argument('--token', help="Authorization header to send (for an API that requires authentication)")
+    parser.add_argument('--mongodb-uri', help="MongoDB to start the API against; mongomock if not given")
+    parser.add_argument('--use-existing', action='store_true', help="use the arms already in the database")
+    parser.add_argument('--server', choices=['werkzeug', 'tornado'], default='werkzeug',
+                        help="HTTP server of the local API")
+    parser.add_argument('--arms', type=int, default=100, help="number of generated arms")
+    parser.add_argument('--versions', type=int, default=3, help="versions of each generated arm")
+    parser.add_argument('--concurrency', type=int, default=8, help="number of concurrent clients")
+    parser.add_argument('--duration', type=float, default=30.0, help="seconds of load in each repetition")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="endpoint=weight pairs; endpoints: " + ", ".join(ENDPOINTS))
+    parser.add_argument('--variants', type=int, default=40, help="variants in each variant report sent")
+    parser.add_argument('--seed', type=int, default=131, help="random seed of the arms and the requests")
+    args = parser.parse_args()
+
+    endpoints, weights = parse_mix(args.mix)
+    headers = {'Authorization': args.token} if args.token else dict()
+
+    api = None
+    if args.url:
+        base_url = args.url.rstrip('/')
+        arm_ids = [arm['treatmentArmId'] for arm in
+                   requests.get(base_url + API_PATH, params={'projection': 'treatmentArmId'}, headers=headers).json()]
+        rules = None
+    else:
+        api, arm_ids, rules = prepare_local_api(args)
+        base_url = api.start()
+    if rules is None:
+        # The arms were not generated here, so the variant reports only match rules by chance.
+        rules = RuleSetGenerator(args.arms * args.versions * RULES_PER_ARM_VERSION, args.versions, args.seed).generate()
+    workload = Workload(sorted(set(arm_ids)) or ['EAY131-0'],
+                        create_variant_reports(rules, 50, args.variants, 0.2, args.seed + 1))
+
+    try:
+        warm_up(base_url, workload, endpoints, headers, args.seed)
+        samples = []
+        elapsed = 0.0
+        for i in range(args.repeat):
+            round_samples, round_elapsed = run_load(base_url, workload, endpoints, weights, headers,
+                                                    args.concurrency, args.duration, args.seed + 1000 * (i + 1))
+            samples.extend(round_samples)
+            elapsed += round_elapsed
+    finally:
+        if api is not None:
+            api.stop()
+
+    bench_helpers.report('api_load',
+                         {'url': args.url or 'local ({})'.format(args.server), 'arms': len(set(arm_ids)),
+                          'concurrency': args.concurrency, 'duration': args.duration, 'mix': args.mix,
+                          'repeat': args.repeat, 'seed': args.seed},
+                         summarize_load(samples, elapsed), args.json_path)
+
+
+if __name__ == '__main__':
+    main()
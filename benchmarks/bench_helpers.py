@@ -0,0 +1,127 @@
+"""
+Helpers shared by the benchmark scripts in this directory:  timing and memory measurement, summary statistics,
+and reporting of the results as a table and, optionally, as a JSON file that can be compared between runs.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+
+def create_arg_parser(description):
+    """
+    :param description: the description of the benchmark script
+    :return: an argparse.ArgumentParser with the options common to all of the benchmarks
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed repetitions of each case")
+    parser.add_argument('--json', dest='json_path', help="also write the results to this JSON file")
+    return parser
+
+
+def treatment_arms_collection(mongodb_uri=None):
+    """
+    Sets the environment variables the accessors need and connects to the MongoDB of mongodb_uri, or, if it is None,
+    to mongomock (exiting if mongomock is not installed).  Must be called before any accessor is created.
+    :param mongodb_uri: the URI of the MongoDB, or None
+    :return: the treatmentArms collection, through the MongoClient that the accessors will share
+    """
+    os.environ['MONGODB_URI'] = mongodb_uri or 'mongodb://localhost:27017/match'
+    os.environ.setdefault('ENVIRONMENT', 'development')
+
+    import accessors.mongo_db_accessor
+    from helpers.environment import Environment
+    if not mongodb_uri:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("Either --mongodb-uri or the mongomock package is required")
+        accessors.mongo_db_accessor.MongoClient = mongomock.MongoClient
+
+    env = Environment()
+    return accessors.mongo_db_accessor.MongoDbAccessor._get_client(env.mongodb_uri)[env.db_name]['treatmentArms']
+
+
+def percentile(sorted_samples, pct):
+    """
+    :param sorted_samples: a non-empty list of numbers in ascending order
+    :param pct: the percentile (0-100)
+    :return: the pct-th percentile of the samples, interpolating between the closest two
+    """
+    pos = (len(sorted_samples) - 1) * pct / 100.0
+    lower = int(pos)
+    upper = min(lower + 1, len(sorted_samples) - 1)
+    return sorted_samples[lower] + (sorted_samples[upper] - sorted_samples[lower]) * (pos - lower)
+
+
+def summarize(samples):
+    """
+    :param samples: a non-empty list of durations in seconds
+    :return: a dict of the count, min, mean, p50, p95, p99, and max of the samples
+    """
+    ordered = sorted(samples)
+    return {'count': len(ordered),
+            'min': ordered[0],
+            'mean': sum(ordered) / len(ordered),
+            'p50': percentile(ordered, 50),
+            'p95': percentile(ordered, 95),
+            'p99': percentile(ordered, 99),
+            'max': ordered[-1]}
+
+
+def time_calls(func, repeat):
+    """
+    Calls func repeat times.
+    :param func: a function without arguments
+    :param repeat: the number of calls
+    :return: a list of the durations of the calls in seconds
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def measure_memory(func):
+    """
+    Measures the memory allocated by func that is still in use when it returns (that is, the size of what it
+    returns) and the peak while it was running.
+    :param func: a function without arguments
+    :return: a tuple of (the value returned by func, bytes still allocated, peak bytes allocated)
+    """
+    tracemalloc.start()
+    try:
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def report(name, parameters, results, json_path=None):
+    """
+    Prints the results of a benchmark and, if json_path is given, writes them to it.
+    :param name: the name of the benchmark
+    :param parameters: dict of the parameters the benchmark was run with
+    :param results: dict of the results keyed by case name; each is a dict of measurements
+    :param json_path: the path of the JSON file to write, or None
+    """
+    print("{name} ({params})".format(name=name, params=", ".join("{}={}".format(k, v)
+                                                                   for k, v in sorted(parameters.items()))))
+    for case, measurements in results.items():
+        print("  {case:<32} {values}".format(case=case, values="  ".join(
+            "{}={}".format(k, "{:.6g}".format(v) if isinstance(v, float) else v) for k, v in measurements.items())))
+
+    if json_path:
+        doc = {'benchmark': name,
+               'parameters': parameters,
+               'python': sys.version.split()[0],
+               'platform': platform.platform(),
+               'results': results}
+        with open(json_path, 'w') as json_file:
+            json.dump(doc, json_file, indent=2, sort_keys=True)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Measures a whole run of the Summary Report Refresher (Refresher.run) on a synthetic patient population:  --arms active
+arms, each with --patients-per-arm patients whose trigger histories are --triggers longer than the fixtures in
+scripts/tests/patient_data.py.  The patients are served by the Patient API stand-in of tests/stub_patient_api.py and
+the arms are inserted into the MongoDB of --mongodb-uri (or mongomock, if it is installed), then deleted again.
+
+Besides the wall time of each run, reports the time spent (summed over the Refresher's worker threads) in each phase:
+
+    fetch    retrieving and decoding the patients from the Patient API
+    compute  Refresher._create_assignment_record and SummaryReport.get_json
+    write    writing the summary reports to MongoDB
+
+    PYTHONPATH=. python3 benchmarks/bench_refresher.py --mongodb-uri mongodb://localhost:27017/match --arms 50
+"""
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from benchmarks import bench_helpers
+from benchmarks.bench_summary_report_records import create_patients
+from scripts.tests import patient_data as pd
+from tests.stub_patient_api import StubPatientApi
+
+ARM_ID_PREFIX = 'BENCH-'
+PHASES = ['fetch', 'compute', 'write']
+
+
+def arm_id(i):
+    return '{}{:04d}'.format(ARM_ID_PREFIX, i)
+
+
+def create_arms(arm_cnt):
+    """
+    :return: a list of the active treatment arm documents
+    """
+    return [{'treatmentArmId': arm_id(i),
+             'version': pd.PATIENT_TREATMENT_ARM['version'],
+             'name': 'Benchmark arm {}'.format(i),
+             'treatmentArmStatus': 'OPEN',
+             'dateArchived': None}
+            for i in range(arm_cnt)]
+
+
+def create_population(arm_cnt, patients_per_arm, extra_triggers):
+    """
+    :return: a list of patient JSON documents, patients_per_arm of them assigned to each of the arms of create_arms
+    """
+    template_id = pd.PATIENT_TREATMENT_ARM['treatmentArmId']
+    patients = create_patients(arm_cnt * patients_per_arm, extra_triggers)
+    for i, patient in enumerate(patients):
+        trtmt_id = arm_id(i % arm_cnt)
+        assignment = patient['patientAssignments']
+        assignment['treatmentArm'] = dict(pd.PATIENT_TREATMENT_ARM, treatmentArmId=trtmt_id)
+        # The assignment reason of the patient's arm is looked up by ID, so it has to follow the arm.
+        assignment['patientAssignmentLogic'] = [
+            dict(logic, treatmentArmId=trtmt_id) if logic['treatmentArmId'] == template_id else logic
+            for logic in assignment.get('patientAssignmentLogic', [])]
+    return patients
+
+
+class PhaseTimes(object):
+    """
+    Accumulates the time spent in each phase, from any thread.
+    """
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += 1
+
+    def timed(self, phase, func):
+        """
+        :return: func, adding the time of each call to phase
+        """
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(phase, time.perf_counter() - start)
+        return wrapper
+
+    def timed_iter(self, phase, func):
+        """
+        :return: func, which returns an iterator, adding the time taken to produce each of its items to phase (but not
+                 the time the caller spends on the items)
+        """
+        def wrapper(*args, **kwargs):
+            iterator = iter(func(*args, **kwargs))
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self.add(phase, time.perf_counter() - start)
+                yield item
+        return wrapper
+
+
+@contextmanager
+def instrumented(phase_times):
+    """
+    Times the phases of the Refresher with phase_times until the block exits.
+    """
+    from accessors.patient_accessor import PatientAccessor
+    from accessors.treatment_arm_accessor import TreatmentArmsAccessor
+    from scripts.summary_report_refresher.refresher import Refresher
+    from scripts.summary_report_refresher.summary_report import SummaryReport
+
+    originals = [(PatientAccessor, 'iter_patients_by_treatment_arm_id'),
+                 (PatientAccessor, 'iter_patients_by_treatment_arm_ids'),
+                 (Refresher, '_create_assignment_record'),
+                 (SummaryReport, 'get_json'),
+                 (TreatmentArmsAccessor, 'update_summary_reports')]
+    originals = [(owner, name, owner.__dict__[name]) for owner, name in originals]
+    PatientAccessor.iter_patients_by_treatment_arm_id = \
+        phase_times.timed_iter('fetch', PatientAccessor.iter_patients_by_treatment_arm_id)
+    PatientAccessor.iter_patients_by_treatment_arm_ids = \
+        phase_times.timed_iter('fetch', PatientAccessor.iter_patients_by_treatment_arm_ids)
+    Refresher._create_assignment_record = \
+        staticmethod(phase_times.timed('compute', Refresher._create_assignment_record))
+    SummaryReport.get_json = phase_times.timed('compute', SummaryReport.get_json)
+    TreatmentArmsAccessor.update_summary_reports = \
+        phase_times.timed('write', TreatmentArmsAccessor.update_summary_reports)
+    try:
+        yield phase_times
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+
+
+def run_refresh(arm_ids, args):
+    """
+    Runs the Refresher once on the arms.
+    :return: a tuple of (the seconds that Refresher.run took, the PhaseTimes of the run)
+    """
+    from scripts.summary_report_refresher.refresher import Refresher
+
+    with instrumented(PhaseTimes()) as phase_times:
+        refresher = Refresher(concurrency=args.concurrency, bulk_fetch=args.bulk_fetch, treatment_arm_ids=arm_ids)
+        start = time.perf_counter()
+        refresher.run()
+        elapsed = time.perf_counter() - start
+    return elapsed, phase_times
+
+
+def summarize_runs(runs, arm_cnt, patient_cnt):
+    """
+    :param runs: a list of (seconds, PhaseTimes) tuples, one for each run
+    :return: dict of the results of the whole runs and of each phase
+    """
+    walls = [elapsed for elapsed, _ in runs]
+    results = {'run': bench_helpers.summarize(walls)}
+    mean_wall = results['run']['mean']
+    results['run']['arms_per_sec'] = arm_cnt / mean_wall
+    results['run']['patients_per_sec'] = patient_cnt / mean_wall
+    for phase in PHASES:
+        stats = bench_helpers.summarize([phase_times.seconds[phase] for _, phase_times in runs])
+        stats['calls_per_run'] = sum(phase_times.calls[phase] for _, phase_times in runs) / len(runs)
+        # Greater than 1 when the Refresher's threads spend more than the run's wall time in the phase together
+        stats['share_of_wall'] = stats['mean'] / mean_wall
+        results[phase] = stats
+    return results
+
+
+def main():
+    parser = bench_helpers.create_arg_parser(__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--mongodb-uri', help="MongoDB to insert the arms into; mongomock if not given")
+    parser.add_argument('--arms', type=int, default=20, help="number of active arms")
+    parser.add_argument('--patients-per-arm', type=int, default=500, help="number of patients assigned to each arm")
+    parser.add_argument('--triggers', type=int, default=20, help="older triggers added to each patient")
+    parser.add_argument('--concurrency', type=int, default=4, help="refresher_concurrency of the Refresher")
+    parser.add_argument('--bulk-fetch', action='store_true', help="retrieve the patients of several arms at once")
+    parser.add_argument('--bulk-batch-size', type=int, default=25, help="patient_api_bulk_batch_size")
+    args = parser.parse_args()
+
+    patients = create_population(args.arms, args.patients_per_arm, args.triggers)
+    with StubPatientApi(patients) as patient_api:
+        os.environ['PATIENT_API_URL'] = patient_api.url
+        os.environ['PATIENT_API_BULK_BATCH_SIZE'] = str(args.bulk_batch_size)
+        collection = bench_helpers.treatment_arms_collection(args.mongodb_uri)
+
+        from config import log
+        from scripts.summary_report_refresher import refresher
+        log.log_config('WARNING')  # the Refresher logs each summary report it refreshes
+        # The stand-in Patient API does not check the token, so Auth0 is not asked for one.
+        refresher.create_authentication_token = lambda: 'bearer benchmark'
+
+        arms = create_arms(args.arms)
+        arm_ids = [arm['treatmentArmId'] for arm in arms]
+        if collection.find_one({'treatmentArmId': {'$in': arm_ids}}):
+            sys.exit("The treatmentArms collection already has arms with IDs starting with " + ARM_ID_PREFIX)
+        collection.insert_many(arms)
+        try:
+            runs = []
+            for _ in range(args.repeat):
+                # Otherwise the fingerprints of the previous run would make every summary report unchanged and
+                # nothing would be written.
+                collection.update_many({'treatmentArmId': {'$in': arm_ids}},
+                                       {'$unset': {'summaryReport': '', 'summaryReportFingerprint': ''}})
+                runs.append(run_refresh(arm_ids, args))
+            written = collection.count({'treatmentArmId': {'$in': arm_ids}, 'summaryReport': {'$exists': True}})
+        finally:
+            collection.delete_many({'treatmentArmId': {'$in': arm_ids}})
+
+    if written != len(arm_ids):
+        sys.exit("Only {}/{} summary reports were written".format(written, len(arm_ids)))
+
+    bench_helpers.report('refresher',
+                         {'arms': args.arms, 'patients_per_arm': args.patients_per_arm, 'triggers': args.triggers,
+                          'concurrency': args.concurrency, 'bulk_fetch': args.bulk_fetch,
+                          'bulk_batch_size': args.bulk_batch_size, 'repeat': args.repeat},
+                         summarize_runs(runs, len(arm_ids), len(patients)), args.json_path)
+
+
+if __name__ == '__main__':
+    main()
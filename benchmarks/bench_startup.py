@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Measures how long it takes a new Python process to import app (the Treatment Arm API) compared with one that only
+starts the interpreter, and fails if the import takes longer than the target.  With --importtime, also reports the
+modules that take the longest to import, from the output of python -X importtime.
+
+    PYTHONPATH=. python3 benchmarks/bench_startup.py --target-ms 1500 --importtime 15 --json startup.json
+"""
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import bench_helpers
+
+DEFAULT_TARGET_MS = 1500
+# Modules that the API does not need until it starts the HTTP server or the message manager.
+DEFERRED_MODULES = ['boto3', 'botocore', 'tornado', 'scripts.ta_message_manager.ta_message_manager']
+CHECK_DEFERRED_CODE = "import sys, app; print(','.join(m for m in {!r} if m in sys.modules))".format(DEFERRED_MODULES)
+
+
+def create_env():
+    """
+    :return: the environment of the child processes; app needs ENVIRONMENT and MONGODB_URI but does not connect
+    """
+    env = dict(os.environ)
+    env.setdefault('ENVIRONMENT', 'development')
+    env.setdefault('MONGODB_URI', 'mongodb://localhost:27017/match')
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    return env
+
+
+def run_python(args, env):
+    """
+    :param args: the arguments of the python interpreter
+    :param env: the environment of the process
+    :return: a tuple of (seconds the process took, its stdout, its stderr)
+    """
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable] + args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+    duration = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise Exception("{} failed:\n{}".format(' '.join(args), proc.stderr))
+    return duration, proc.stdout, proc.stderr
+
+
+def parse_importtime(stderr):
+    """
+    :param stderr: the stderr of python -X importtime, whose lines are 'import time: self | cumulative | name'
+    :return: a list of (module name, self microseconds, cumulative microseconds) tuples
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = [field.strip() for field in line[len('import time:'):].split('|')]
+        if len(fields) != 3 or not fields[0].isdigit():
+            continue  # the header line
+        modules.append((fields[2].strip(), int(fields[0]), int(fields[1])))
+    return modules
+
+
+def main():
+    parser = bench_helpers.create_arg_parser(__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--target-ms', type=float, default=DEFAULT_TARGET_MS,
+                        help="fail if the median time to import app, less the interpreter start-up, exceeds this")
+    parser.add_argument('--importtime', type=int, default=0, metavar='N',
+                        help="also report the N modules with the longest cumulative import time")
+    args = parser.parse_args()
+
+    env = create_env()
+    baseline = [run_python(['-c', 'pass'], env)[0] for _ in range(args.repeat)]
+    import_app = [run_python(['-c', 'import app'], env)[0] for _ in range(args.repeat)]
+    deferred_loaded = run_python(['-c', CHECK_DEFERRED_CODE], env)[1].strip()
+
+    results = {'interpreter': bench_helpers.summarize(baseline),
+               'import_app': bench_helpers.summarize(import_app)}
+    import_ms = (results['import_app']['p50'] - results['interpreter']['p50']) * 1000
+    results['startup'] = {'import_ms': import_ms,
+                          'target_ms': float(args.target_ms),
+                          'deferred_modules_loaded': deferred_loaded or 'none'}
+
+    if args.importtime:
+        modules = parse_importtime(run_python(['-X', 'importtime', '-c', 'import app'], env)[2])
+        for name, self_us, cumulative_us in sorted(modules, key=lambda m: m[2], reverse=True)[:args.importtime]:
+            results['module ' + name] = {'cumulative_ms': cumulative_us / 1000.0, 'self_ms': self_us / 1000.0}
+
+    bench_helpers.report('startup', {'repeat': args.repeat, 'target_ms': args.target_ms}, results, args.json_path)
+
+    if import_ms > args.target_ms or deferred_loaded:
+        sys.exit("Start-up target missed: importing app took {:.0f} ms (target {:.0f} ms); deferred modules "
+                 "loaded: {}".format(import_ms, args.target_ms, deferred_loaded or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Measures the time and memory that the Summary Report Refresher spends turning patient JSON documents into
+Patient objects and AssignmentRecords.  The patients are the fixtures in scripts/tests/patient_data.py, each
+copied (as freshly decoded JSON, the way the Patient API returns them) under its own patientSequenceNumber until
+there are as many as a production-sized refresh processes.
+
+    PYTHONPATH=. python3 benchmarks/bench_summary_report_records.py --patients 50000 --json records.json
+"""
+import json
+from itertools import cycle
+
+from benchmarks import bench_helpers
+from scripts.summary_report_refresher.patient import Patient
+from scripts.summary_report_refresher.refresher import Refresher
+from scripts.summary_report_refresher.summary_report import SummaryReport
+from scripts.tests import patient_data as pd
+
+TEMPLATE_PATIENTS = [pd.CURRENT_PATIENT, pd.FORMER_PATIENT, pd.PENDING_PATIENT, pd.NOT_ENROLLED_PATIENT,
+                     pd.COMPASSIONATE_CARE_PATIENT, pd.NOT_ELIGIBLE_PATIENT, pd.PROGRESSION_REBIOPSY_PATIENT,
+                     pd.DECEASED_PATIENT, pd.OFF_STUDY_REJOIN_PATIENT]
+TRTMT_ARM_ID = pd.PATIENT_TREATMENT_ARM['treatmentArmId']
+TRTMT_ARM = {'_id': {'$oid': '598386900e04839ba1fabcfa'},
+             'treatmentArmId': TRTMT_ARM_ID,
+             'version': pd.PATIENT_TREATMENT_ARM['version'],
+             'treatmentArmStatus': 'OPEN'}
+
+
+def create_patients(count, extra_triggers):
+    """
+    :param count: the number of patients to create
+    :param extra_triggers: the number of older triggers added to the start of each patient's trigger history
+    :return: a list of patient JSON documents, each decoded separately
+    """
+    templates = []
+    for template in TEMPLATE_PATIENTS:
+        template = dict(template)
+        template['patientTriggers'] = [pd.REGISTRATION_TRIGGER] * extra_triggers + template['patientTriggers']
+        templates.append(json.dumps(template))
+
+    patients = []
+    for i, template in zip(range(count), cycle(templates)):
+        patient = json.loads(template)
+        patient['patientSequenceNumber'] = str(100000 + i)
+        patients.append(patient)
+    return patients
+
+
+def create_patient_objects(patients):
+    return [Patient(p) for p in patients]
+
+
+def create_assignment_records(patient_objs):
+    return [Refresher._create_assignment_record(p, TRTMT_ARM_ID) for p in patient_objs]
+
+
+def refresh_summary_report(patients):
+    sum_rpt = SummaryReport(TRTMT_ARM)
+    seen_psns = set()
+    for patient in patients:
+        Refresher._add_patient(sum_rpt, patient, seen_psns)
+    return sum_rpt.get_json()
+
+
+def main():
+    parser = bench_helpers.create_arg_parser(__doc__.strip().split('\n\n')[0])
+    parser.add_argument('--patients', type=int, default=50000, help="number of patient assignments")
+    parser.add_argument('--extra-triggers', type=int, default=20, help="older triggers added to each patient")
+    args = parser.parse_args()
+
+    patients = create_patients(args.patients, args.extra_triggers)
+    patient_objs = create_patient_objects(patients)
+
+    results = dict()
+    timed_cases = [
+        ('patient_objects', lambda: create_patient_objects(patients)),
+        ('assignment_records', lambda: create_assignment_records(patient_objs)),
+        ('summary_report', lambda: refresh_summary_report(patients)),
+    ]
+    for case, func in timed_cases:
+        stats = bench_helpers.summarize(bench_helpers.time_calls(func, args.repeat))
+        stats['per_patient_us'] = stats['p50'] / args.patients * 1e6
+        results[case] = stats
+
+    memory_cases = [
+        ('patient_objects_memory', lambda: create_patient_objects(patients)),
+        ('assignment_records_memory', lambda: create_assignment_records(patient_objs)),
+    ]
+    for case, func in memory_cases:
+        _, retained, peak = bench_helpers.measure_memory(func)
+        results[case] = {'retained_bytes': retained,
+                         'peak_bytes': peak,
+                         'bytes_per_patient': retained / args.patients}
+
+    bench_helpers.report('summary_report_records',
+                         {'patients': args.patients, 'extra_triggers': args.extra_triggers, 'repeat': args.repeat},
+                         results, args.json_path)
+
+
+if __name__ == '__main__':
+    main()
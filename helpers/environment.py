@@ -5,10 +5,111 @@ from pprint import pformat
 import yaml
 
 
+def to_bool(value):
+    """Settings overridden by environment variables are strings, so 'False' must be False."""
+    if isinstance(value, bool):
+        return value
+    return str(value).upper() in ['TRUE', '1', 'YES']
+
+
+class Settings(object):
+    """
+    The configuration settings of the current environment, each converted to its type when loaded.  The settings are
+    read-only and are held in slots so that reading one is a plain attribute access.
+    """
+    # The type of each setting in the configuration file; values from the file and from environment variables
+    # (which are always strings) are converted to it.
+    TYPES = {
+        'port': int,
+        'region': str,
+        'bucket': str,
+        'tmp_file_dir': str,
+        'polling_interval': int,
+        'full_refresh_interval': float,
+        'sqs_queue_name': str,
+        'sqs_wait_time_seconds': int,
+        'sqs_max_messages': int,
+        'sqs_visibility_timeout': int,
+        'sqs_heartbeat_interval': float,
+        'sqs_max_receive_count': int,
+        'sqs_max_drain_batches': int,
+        'message_handler_workers': int,
+        'sqs_dead_letter_queue_name': str,
+        'sqs_endpoint_url': str,
+        'patient_api_url': str,
+        'refresher_concurrency': int,
+        'patient_api_connect_timeout': float,
+        'patient_api_read_timeout': float,
+        'patient_api_max_retries': int,
+        'patient_api_backoff_factor': float,
+        'patient_api_bulk_fetch': to_bool,
+        'patient_api_bulk_batch_size': int,
+        'refresher_write_batch_size': int,
+        'profile_token': str,
+        'profile_sample_rate': float,
+        'profile_dir': str,
+        'trace_exporter': str,
+        'trace_file': str,
+        'trace_otlp_endpoint': str,
+        'arm_cache_size': int,
+        'arm_cache_ttl': float,
+        'arm_cache_change_stream': to_bool,
+        'shared_cache': str,
+        'shared_cache_dir': str,
+        'shared_cache_url': str,
+        'logger_level': str,
+    }
+    READ_ONLY_MSG_FMT = 'Setting {} is read-only.'
+    INVALID_VALUE_MSG_FMT = "Invalid value '{value}' for setting {name}: {exc}"
+    UNKNOWN_SETTINGS_MSG_FMT = "Unknown configuration settings for environment {env}: {names}"
+
+    __slots__ = ('environment', 'mongodb_uri', 'db_name') + tuple(sorted(TYPES))
+
+    def __init__(self, environment, mongodb_uri, db_name, config):
+        """
+        :param environment: the name of the environment
+        :param mongodb_uri: the URI of the MongoDB database
+        :param db_name: the name of the MongoDB database
+        :param config: dict of the configuration settings of the environment
+        :raises Exception: if the configuration has a setting without a type in TYPES (e.g. a misspelt one)
+        """
+        unknown_names = sorted(set(config) - set(Settings.TYPES))
+        if unknown_names:
+            raise Exception(Settings.UNKNOWN_SETTINGS_MSG_FMT.format(env=environment, names=", ".join(unknown_names)))
+
+        object.__setattr__(self, 'environment', environment)
+        object.__setattr__(self, 'mongodb_uri', mongodb_uri)
+        object.__setattr__(self, 'db_name', db_name)
+        for name, value in config.items():
+            object.__setattr__(self, name, self._convert(name, value))
+
+    @staticmethod
+    def _convert(name, value):
+        if value is None:
+            return None
+        try:
+            return Settings.TYPES[name](value)
+        except ValueError as exc:
+            raise Exception(Settings.INVALID_VALUE_MSG_FMT.format(value=value, name=name, exc=str(exc)))
+
+    def __getattr__(self, item):
+        """
+        Only called for settings that are unknown or missing from the configuration file.  Raises AttributeError so
+        that hasattr and getattr with a default work.
+        """
+        raise AttributeError(Environment.INVALID_GET_MSG_FMT.format(item))
+
+    def __setattr__(self, name, value):
+        raise Exception(Settings.READ_ONLY_MSG_FMT.format(name))
+
+    def __delattr__(self, name):
+        raise Exception(Settings.READ_ONLY_MSG_FMT.format(name))
+
+
 class Environment(object):
     """
-    Maintainer of configuration variables that can vary based on environment.  Implemented as a Singleton so
-    that the configuration file is only read once.
+    Maintainer of configuration variables that can vary based on environment.  The configuration is only read once:
+    Environment() returns the same Settings object every time.
     """
     REQ_ENV_VARS = ['ENVIRONMENT', 'MONGODB_URI']
     REQ_VARS_MSG = "The following environment variables must be defined in your" + \
@@ -18,78 +119,60 @@ class Environment(object):
     CONFIG_FILE = "config/environment.yml"
     MISSING_CONFIG_FILE_MSG = "Configuration file {} is required".format(CONFIG_FILE)
 
-    class __EnvImpl:
-        """
-        Internal implementation of the Environment for initializing Environment.__instance.
-        """
-        def __init__(self):
-            self.logger = logging.getLogger(__name__)
-            try:
-                # self.environment = os.environ.get('ENVIRONMENT', 'test')  # assign default until this can be set up
-                self.environment = os.environ['ENVIRONMENT']
-                self.mongodb_uri = os.environ['MONGODB_URI']
-                self.db_name = 'match' if '/match' in self.mongodb_uri else 'Match'
-
-            except KeyError as e:
-                self.logger.error(Environment.REQ_VARS_MSG)
-                self.logger.error(str(e))
-                raise e
-
-            self.logger.info("Environment set to: " + self.environment)
-
-            self.load_config_file()
-            self.load_overrides_from_env()
-
-        def load_config_file(self):
-            """Read configuration variables from the yaml config file."""
-            try:
-                with open(os.path.abspath(Environment.CONFIG_FILE), 'r') as yaml_file:
-                    self._env = yaml.safe_load(yaml_file)
-            except FileNotFoundError as e:
-                err_msg = Environment.MISSING_CONFIG_FILE_MSG + ": {}".format(str(e))
-                self.logger.exception(err_msg)
-                raise FileNotFoundError(Environment.MISSING_CONFIG_FILE_MSG).with_traceback(e.__traceback__)
-
-            self.logger.debug("Variables loaded from config file for {env}:\n{vars}"
-                             .format(env=self.environment, vars=pformat(self._env[self.environment])))
-
-        def load_overrides_from_env(self):
-            """Any variable in the configuration file can be overridden by an environment variable of the same
-               name only in all caps.  For example, the environment variable SQS_QUEUE_NAME overrides the config
-               file variable sqs_queue_name.
-            """
-            for var in self._env[self.environment]:
-                if var.upper() in os.environ:
-                    self._env[self.environment][var] = os.environ[var.upper()]
-                    self.logger.info("Environment variable {} overrides default setting for {}; new value='{}'"
-                              .format(var.upper(), var, self._env[self.environment][var]))
-
-    # The private instance variable
-    __instance = None
-
-    def __init__(self):
+    # The Settings of the environment, once loaded
+    __settings = None
+
+    def __new__(cls):
         """
-        Initializes the __instance if needed.
+        :return: the Settings of the environment, loading them if needed
         """
-        if self.__instance is None:
-            Environment.__instance = Environment.__EnvImpl()
+        if cls.__settings is None:
+            Environment.__settings = cls.__load()
+        return cls.__settings
 
-    def __getattr__(self, item):
-        """
-        Provides top level read access to the item so that the caller need not know the internal representation.
-        :param item:
-        :return: the requested item
+    @classmethod
+    def __load(cls):
+        logger = logging.getLogger(__name__)
+        try:
+            environment = os.environ['ENVIRONMENT']
+            mongodb_uri = os.environ['MONGODB_URI']
+        except KeyError as e:
+            logger.error(Environment.REQ_VARS_MSG)
+            logger.error(str(e))
+            raise e
+
+        logger.info("Environment set to: " + environment)
+
+        config = cls.__load_config_file(logger, environment)
+        cls.__load_overrides_from_env(logger, config)
+        return Settings(environment, mongodb_uri, 'match' if '/match' in mongodb_uri else 'Match', config)
+
+    @staticmethod
+    def __load_config_file(logger, environment):
+        """Read configuration variables for the environment from the yaml config file."""
+        try:
+            with open(os.path.abspath(Environment.CONFIG_FILE), 'r') as yaml_file:
+                config = yaml.safe_load(yaml_file)
+        except FileNotFoundError as e:
+            err_msg = Environment.MISSING_CONFIG_FILE_MSG + ": {}".format(str(e))
+            logger.exception(err_msg)
+            raise FileNotFoundError(Environment.MISSING_CONFIG_FILE_MSG).with_traceback(e.__traceback__)
+
+        logger.debug("Variables loaded from config file for {env}:\n{vars}"
+                     .format(env=environment, vars=pformat(config[environment])))
+        return dict(config[environment])
+
+    @staticmethod
+    def __load_overrides_from_env(logger, config):
+        """Any variable in the configuration file can be overridden by an environment variable of the same
+           name only in all caps.  For example, the environment variable SQS_QUEUE_NAME overrides the config
+           file variable sqs_queue_name.
         """
-        if item == 'environment':
-            return self.__instance.environment
-        elif item == 'mongodb_uri':
-            return self.__instance.mongodb_uri
-        elif item == 'db_name':
-            return self.__instance.db_name
-        elif item in self.__instance._env[self.__instance.environment]:
-            return self.__instance._env[self.__instance.environment][item]
-        else:
-            raise Exception(Environment.INVALID_GET_MSG_FMT.format(item))
+        for var in config:
+            if var.upper() in os.environ:
+                config[var] = os.environ[var.upper()]
+                logger.info("Environment variable {} overrides default setting for {}; new value='{}'"
+                            .format(var.upper(), var, config[var]))
 
     @classmethod
     def _drop(cls):
@@ -98,4 +181,4 @@ class Environment(object):
         for each test case.
         :return:
         """
-        cls.__instance = None
+        Environment.__settings = None
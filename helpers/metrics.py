@@ -0,0 +1,243 @@
+"""
+Lightweight in-process metrics.  Counters, timers, and histograms are created on first use and kept in a
+process-wide registry so that any module can record to them and they can all be reported from one place:  as a dict
+(snapshot) or in the Prometheus text exposition format (exposition).
+
+A metric can have labels, a dict of label names and values; each set of label values of a metric name is a
+separate metric, as in Prometheus.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# The default upper bounds, in seconds, of the buckets of a Histogram (those of the Prometheus client libraries).
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The content type of the Prometheus text exposition format
+EXPOSITION_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def metric_key(name, labels=None):
+    """
+    :param name: the name of the metric
+    :param labels: dict of the label names and values of the metric, or None
+    :return: the name of the metric followed by its labels in the Prometheus format, such as name{a="1",b="2"}
+    """
+    if not labels:
+        return name
+    return name + '{' + ','.join('{}="{}"'.format(k, _escape(labels[k])) for k in sorted(labels)) + '}'
+
+
+def _escape(label_value):
+    return str(label_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    """
+    A thread-safe, monotonically increasing count.
+    """
+    PROMETHEUS_TYPE = 'counter'
+
+    def __init__(self, name, description='', labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or dict()
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return {'value': self._value}
+
+    def samples(self):
+        """
+        :return: a list of (name suffix, extra labels, value) tuples of the Prometheus samples of the metric
+        """
+        return [('', dict(), self._value)]
+
+
+class Timer(object):
+    """
+    A thread-safe accumulator of observed durations (in seconds):  the number of observations, their total,
+    and the largest one.  Exposed to Prometheus as a summary without quantiles.
+    """
+    PROMETHEUS_TYPE = 'summary'
+
+    def __init__(self, name, description='', labels=None):
+        self.name = name
+        self.description = description
+        self.labels = labels or dict()
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._count += 1
+            self._total += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    @contextmanager
+    def time(self):
+        """
+        Context manager that observes the time spent in its block (including when the block raises).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    @property
+    def count(self):
+        return self._count
+
+    def snapshot(self):
+        with self._lock:
+            return {'count': self._count,
+                    'total': self._total,
+                    'max': self._max,
+                    'mean': self._total / self._count if self._count else 0.0}
+
+    def samples(self):
+        with self._lock:
+            return [('_count', dict(), self._count), ('_sum', dict(), self._total)]
+
+
+class Histogram(Timer):
+    """
+    A Timer that also counts the observations that fall into each of a fixed set of buckets, so that the
+    distribution (and so the percentiles) of the durations can be estimated.
+    """
+    PROMETHEUS_TYPE = 'histogram'
+
+    def __init__(self, name, description='', labels=None, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: the upper bounds of the buckets in ascending order; a +Inf bucket is always added
+        """
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._bucket_counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, seconds):
+        with self._lock:
+            self._bucket_counts[bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._total += seconds
+            if seconds > self._max:
+                self._max = seconds
+
+    def snapshot(self):
+        snapshot = super().snapshot()
+        with self._lock:
+            snapshot['buckets'] = dict(zip(self.buckets + (float('inf'),), self._cumulative_counts()))
+        return snapshot
+
+    def samples(self):
+        with self._lock:
+            return [('_bucket', {'le': _format_value(float(bound))}, cnt)
+                    for bound, cnt in zip(self.buckets + (float('inf'),), self._cumulative_counts())] + \
+                   [('_count', dict(), self._count), ('_sum', dict(), self._total)]
+
+    def _cumulative_counts(self):
+        counts = []
+        total = 0
+        for cnt in self._bucket_counts:
+            total += cnt
+            counts.append(total)
+        return counts
+
+
+class MetricsRegistry(object):
+    """
+    Holds the named metrics of the process.  Asking for a metric that already exists returns the existing one.
+    """
+    def __init__(self):
+        self._metrics = dict()  # keyed by metric_key
+        self._types = dict()  # the class of the metrics of each name
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, metric_class, name, description, labels, **kwargs):
+        key = metric_key(name, labels)
+        with self._lock:
+            registered_class = self._types.setdefault(name, metric_class)
+            if registered_class is not metric_class:
+                raise Exception("Metric '{}' is already registered as a {}".format(name, registered_class.__name__))
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = metric_class(name, description, dict(labels or dict()), **kwargs)
+                self._metrics[key] = metric
+            return metric
+
+    def counter(self, name, description='', labels=None):
+        return self._get_or_create(Counter, name, description, labels)
+
+    def timer(self, name, description='', labels=None):
+        return self._get_or_create(Timer, name, description, labels)
+
+    def histogram(self, name, description='', labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def snapshot(self):
+        """
+        :return: a dict of the current values of all of the registered metrics, keyed by metric_key
+        """
+        with self._lock:
+            metrics = list(self._metrics.items())
+        return dict([(key, m.snapshot()) for key, m in metrics])
+
+    def exposition(self):
+        """
+        :return: the current values of all of the registered metrics in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: (m.name, metric_key('', m.labels)))
+        lines = []
+        for i, metric in enumerate(metrics):
+            if i == 0 or metrics[i - 1].name != metric.name:
+                if metric.description:
+                    lines.append('# HELP {} {}'.format(metric.name, metric.description.replace('\n', ' ')))
+                lines.append('# TYPE {} {}'.format(metric.name, metric.PROMETHEUS_TYPE))
+            for suffix, extra_labels, value in metric.samples():
+                lines.append('{} {}'.format(metric_key(metric.name + suffix, dict(metric.labels, **extra_labels)),
+                                            _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """
+        Not intended for production code.  Only to be used for unit testing so that each test case starts with
+        an empty registry.
+        """
+        with self._lock:
+            self._metrics.clear()
+            self._types.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+
+def counter(name, description='', labels=None):
+    return REGISTRY.counter(name, description, labels)
+
+
+def timer(name, description='', labels=None):
+    return REGISTRY.timer(name, description, labels)
+
+
+def histogram(name, description='', labels=None, buckets=DEFAULT_BUCKETS):
+    return REGISTRY.histogram(name, description, labels, buckets)
@@ -0,0 +1,106 @@
+"""
+Opt-in profiling of API requests.  A profiled request runs under cProfile and its statistics are saved in a pstats
+file named after the request ID, which is returned in the X-Profile-Id response header.  A request is profiled if
+it has an X-Profile header whose value is the configured profile_token, or if it is picked at random at the
+configured profile_sample_rate.  When neither is configured the middleware is not installed at all, so profiling
+costs nothing when it is off.
+
+To read a saved profile:
+    python3 -m pstats /tmp/treatment-arm-api-profiles/<request ID>.pstats
+"""
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import uuid
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'  # the X-Profile request header as it appears in the WSGI environ
+REQUEST_ID_HEADER = 'HTTP_X_REQUEST_ID'  # the X-Request-Id request header, used as the request ID if present
+PROFILE_ID_HEADER = 'X-Profile-Id'
+# Request IDs taken from the X-Request-Id header are only used in file names if they consist of these characters.
+SAFE_REQUEST_ID = re.compile(r'^[A-Za-z0-9_.-]{1,128}$')
+
+
+class ProfilingMiddleware(object):
+    """
+    WSGI middleware that profiles the selected requests.  Because it wraps the whole Flask application, the profile
+    includes the routing, the resource, and the encoding of the response.
+    """
+    def __init__(self, wsgi_app, profile_dir, token=None, sample_rate=0.0):
+        """
+        :param wsgi_app: the WSGI application to profile
+        :param profile_dir: the directory in which the pstats files are saved; created if it does not exist
+        :param token: the value of the X-Profile header that turns on profiling for a request; if empty or None,
+                      the header is ignored
+        :param sample_rate: the fraction (0.0 to 1.0) of the requests that are profiled at random
+        """
+        self.wsgi_app = wsgi_app
+        self.profile_dir = profile_dir
+        self.token = token or None
+        self.sample_rate = sample_rate or 0.0
+        self.logger = logging.getLogger(__name__)
+        os.makedirs(profile_dir, exist_ok=True)
+
+    def __call__(self, environ, start_response):
+        if not self._is_selected(environ):
+            return self.wsgi_app(environ, start_response)
+
+        request_id = environ.get(REQUEST_ID_HEADER, '')
+        if not SAFE_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+
+        def start_profiled_response(status, headers, exc_info=None):
+            return start_response(status, list(headers) + [(PROFILE_ID_HEADER, request_id)], exc_info)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            # The response is read here so that producing it is included in the profile.
+            response = self.wsgi_app(environ, start_profiled_response)
+            try:
+                body = list(response)
+            finally:
+                if hasattr(response, 'close'):
+                    response.close()
+        finally:
+            profiler.disable()
+            self._save(profiler, request_id, environ)
+        return body
+
+    def _is_selected(self, environ):
+        """
+        :param environ: the WSGI environ of the request
+        :return: True if the request is to be profiled
+        """
+        if self.token is not None and PROFILE_HEADER in environ and \
+                hmac.compare_digest(environ[PROFILE_HEADER].encode('utf-8'), self.token.encode('utf-8')):
+            return True
+        return self.sample_rate > 0.0 and random.random() < self.sample_rate
+
+    def _save(self, profiler, request_id, environ):
+        path = os.path.join(self.profile_dir, request_id + '.pstats')
+        try:
+            profiler.dump_stats(path)
+            self.logger.info("Profile of {method} {path} saved to {file}"
+                             .format(method=environ.get('REQUEST_METHOD'), path=environ.get('PATH_INFO'), file=path))
+        except Exception as exc:
+            self.logger.error("Could not save the profile of request {id} to {file}: {exc}"
+                              .format(id=request_id, file=path, exc=str(exc)))
+
+
+def install(app, env):
+    """
+    Wraps the Flask application in a ProfilingMiddleware if profiling is configured.
+    :param app: the Flask application
+    :param env: the Settings of the environment
+    :return: True if the middleware was installed
+    """
+    if not env.profile_token and not env.profile_sample_rate:
+        return False
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, env.profile_dir, env.profile_token, env.profile_sample_rate)
+    logging.getLogger(__name__).warning("Request profiling is on; sample rate = {rate}; X-Profile header {hdr}"
+                                        .format(rate=env.profile_sample_rate,
+                                                hdr="accepted" if env.profile_token else "ignored"))
+    return True
@@ -0,0 +1,207 @@
+"""
+An optional cache shared by all of the processes of the API on a host, so that data that every worker needs (the
+variant rules snapshot and the most requested treatment arms) is loaded from MongoDB once and then picked up by the
+other workers rather than loaded by each of them on its own schedule.
+
+The store is chosen by the shared_cache setting (see configure):
+
+*  file:   one snapshot file per key in shared_cache_dir, replaced atomically when written and memory-mapped when read.
+*  redis:  the Redis-compatible server at shared_cache_url (requires the redis package).
+
+Values are JSON-compatible objects, stored as zlib-compressed JSON.  The shared cache only saves work:  when it is off
+(the default) or fails, get_value returns None and the callers load the data themselves.
+"""
+import hashlib
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from helpers import metrics
+
+FILE_STORE = 'file'
+REDIS_STORE = 'redis'
+KEY_PREFIX = 'treatment-arm-api:'
+
+
+def encode(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def decode(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class MemoryStore(object):
+    """
+    Keeps the values in this process.  Used by the unit tests in place of the shared stores; the values are encoded
+    all the same, so that, as with the shared stores, each get returns a new copy.
+    """
+    def __init__(self):
+        self._values = dict()  # key -> (expiration time or None, encoded value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            expires, data = self._values.get(key, (None, None))
+        if data is None or (expires is not None and time.time() >= expires):
+            return None
+        return decode(data)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._values[key] = (time.time() + ttl if ttl else None, encode(value))
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class FileStore(object):
+    """
+    Keeps each value in its own file in a directory.  A file starts with the time it expires (0 if it does not) and
+    is written to a temporary file that then replaces it, so readers never see a partial value.  Reading maps the
+    file into memory, so that the value is decompressed straight from the page cache shared by all the processes.
+    """
+    HEADER = struct.Struct('>d')
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.snapshot')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as snapshot_file:
+                with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    expires = self.HEADER.unpack_from(data)[0]
+                    if expires and time.time() >= expires:
+                        return None
+                    with memoryview(data) as view:
+                        with view[self.HEADER.size:] as payload:
+                            return decode(payload)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, value, ttl=None):
+        data = self.HEADER.pack(time.time() + ttl if ttl else 0.0) + encode(value)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class RedisStore(object):
+    """
+    Keeps the values in a Redis-compatible server, which expires them itself.
+    """
+    def __init__(self, client):
+        """
+        :param client: a redis.Redis client
+        """
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise Exception("The redis package is required for shared_cache '{}'".format(REDIS_STORE))
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        data = self.client.get(KEY_PREFIX + key)
+        return decode(data) if data is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(KEY_PREFIX + key, encode(value), ex=int(math.ceil(ttl)) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(KEY_PREFIX + key)
+
+
+STORE = None
+_configure_lock = threading.Lock()
+
+
+def configure(env):
+    """
+    Sets STORE from the shared_cache setting, unless it has already been configured.
+    :param env: the Settings of the environment
+    :return: the store, or None if the shared cache is off
+    """
+    global STORE
+    with _configure_lock:
+        if STORE is None:
+            if env.shared_cache == FILE_STORE:
+                STORE = FileStore(env.shared_cache_dir)
+            elif env.shared_cache == REDIS_STORE:
+                STORE = RedisStore.from_url(env.shared_cache_url)
+            elif env.shared_cache:
+                raise Exception("Unknown shared_cache '{}'; expected '{}' or '{}'"
+                                .format(env.shared_cache, FILE_STORE, REDIS_STORE))
+            if STORE is not None:
+                logging.getLogger(__name__).info("Shared cache in {}".format(env.shared_cache))
+        return STORE
+
+
+def enabled():
+    return STORE is not None
+
+
+def get_value(key):
+    """
+    :param key: the key of the value
+    :return: the value, or None if it is not in the shared cache (or the shared cache is off or failed)
+    """
+    store = STORE
+    if store is None:
+        return None
+    try:
+        value = store.get(key)
+    except Exception as exc:
+        _log_error('read', key, exc)
+        return None
+    metrics.counter('shared_cache_hits_total' if value is not None else 'shared_cache_misses_total',
+                    'Shared cache reads that found a value' if value is not None
+                    else 'Shared cache reads that found no value').inc()
+    return value
+
+
+def set_value(key, value, ttl=None):
+    """
+    Stores the value in the shared cache, if it is on.
+    :param key: the key of the value
+    :param value: a JSON-compatible object
+    :param ttl: seconds until the value expires; None or 0 if it does not
+    """
+    store = STORE
+    if store is not None:
+        try:
+            store.set(key, value, ttl)
+        except Exception as exc:
+            _log_error('write', key, exc)
+
+
+def _log_error(action, key, exc):
+    metrics.counter('shared_cache_errors_total', 'Shared cache reads and writes that failed').inc()
+    logging.getLogger(__name__).warning("Could not {action} {key} in the shared cache: {exc}"
+                                        .format(action=action, key=key, exc=str(exc)))
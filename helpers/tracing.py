@@ -0,0 +1,303 @@
+"""
+Lightweight tracing in the spirit of OpenTelemetry.  A span records the name, timing, and attributes of one operation;
+spans started while another span is current on the same thread become its children, and all of the spans descended
+from the same root share its trace ID, so that a slow request or refresh can be broken down into its parts.
+
+Spans are only recorded once an exporter has been configured (see configure); until then start_span yields a span
+that ignores everything, so instrumented code costs next to nothing when tracing is off.  Finished spans are
+exported either as JSON lines to a local file or, in batches, to an OTLP/HTTP collector in the OTLP JSON encoding.
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+FILE_EXPORTER = 'file'
+OTLP_EXPORTER = 'otlp'
+SERVICE_NAME = 'treatment-arm-api'
+
+
+def _new_id(byte_cnt):
+    return os.urandom(byte_cnt).hex()
+
+
+class Span(object):
+    """
+    One timed operation.
+    """
+    is_recording = True
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        """
+        :param name: the name of the operation
+        :param trace_id: the ID (32 hex digits) of the trace the span belongs to
+        :param parent_id: the ID (16 hex digits) of the parent span, or None for the root span of the trace
+        :param attributes: dict of the initial attributes of the span
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or dict())
+        self.status = 'OK'
+        self.start_time = time.time()
+        self.end_time = None
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc):
+        self.status = 'ERROR'
+        self.attributes['exception.type'] = type(exc).__name__
+        self.attributes['exception.message'] = str(exc)
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+        self.end_time = self.start_time + self.duration
+
+    def to_dict(self):
+        """
+        :return: the span as a dict that can be encoded as JSON
+        """
+        return {'traceId': self.trace_id,
+                'spanId': self.span_id,
+                'parentSpanId': self.parent_id,
+                'name': self.name,
+                'startTime': self.start_time,
+                'endTime': self.end_time,
+                'durationMs': self.duration * 1000.0 if self.duration is not None else None,
+                'status': self.status,
+                'attributes': self.attributes}
+
+
+class _NoopSpan(object):
+    """
+    The span yielded by start_span when tracing is off.
+    """
+    is_recording = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exc):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class FileExporter(object):
+    """
+    Appends each finished span to a file as a line of JSON.  The file is opened once and kept open, line buffered,
+    until shutdown; the spans finished after that are dropped.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1)
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(line)
+
+    def shutdown(self):
+        with self._lock:
+            self._file.close()
+
+
+class OtlpExporter(object):
+    """
+    Sends the finished spans, in batches, to an OTLP/HTTP collector (POST <endpoint>/v1/traces with the OTLP JSON
+    encoding).  The spans are sent by a background thread so that the traced code does not wait on the collector;
+    if the collector falls behind, spans are dropped rather than held without limit.
+    """
+    MAX_QUEUED_SPANS = 10000
+
+    def __init__(self, endpoint, batch_size=100, flush_interval=5.0):
+        """
+        :param endpoint: the base URL of the collector, such as http://localhost:4318
+        :param batch_size: the most spans sent in one request
+        :param flush_interval: the most seconds that a finished span waits before it is sent
+        """
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.logger = logging.getLogger(__name__)
+        self._queue = queue.Queue(self.MAX_QUEUED_SPANS)
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='otlp-exporter', daemon=True)
+        self._thread.start()
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.logger.warning("Span {} dropped because the OTLP exporter is behind".format(span.name))
+
+    def shutdown(self, timeout=10.0):
+        """
+        Sends the spans that are still queued and stops the background thread.
+        """
+        self._stopping.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, min(deadline - time.monotonic(), 0.5))))
+            except queue.Empty:
+                pass
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline or
+                          (self._stopping.is_set() and self._queue.empty())):
+                self._send(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+        if batch:
+            self._send(batch)
+
+    def _send(self, spans):
+        try:
+            response = requests.post(self.url, json=self.encode(spans), timeout=5)
+            if response.status_code >= 300:
+                self.logger.error("OTLP collector at {url} returned {code} for {cnt} spans"
+                                  .format(url=self.url, code=response.status_code, cnt=len(spans)))
+        except Exception as exc:
+            self.logger.error("Could not send {cnt} spans to the OTLP collector at {url}: {exc}"
+                              .format(cnt=len(spans), url=self.url, exc=str(exc)))
+
+    @staticmethod
+    def encode(spans):
+        """
+        :param spans: a list of finished Spans
+        :return: the body of an OTLP/HTTP ExportTraceServiceRequest in the JSON encoding
+        """
+        return {'resourceSpans': [{
+            'resource': {'attributes': [OtlpExporter._attribute('service.name', SERVICE_NAME)]},
+            'scopeSpans': [{
+                'scope': {'name': __name__},
+                'spans': [{
+                    'traceId': span.trace_id,
+                    'spanId': span.span_id,
+                    'parentSpanId': span.parent_id or '',
+                    'name': span.name,
+                    'kind': 1,  # SPAN_KIND_INTERNAL
+                    'startTimeUnixNano': str(int(span.start_time * 1e9)),
+                    'endTimeUnixNano': str(int(span.end_time * 1e9)),
+                    'attributes': [OtlpExporter._attribute(k, v) for k, v in sorted(span.attributes.items())],
+                    'status': {'code': 2 if span.status == 'ERROR' else 1},
+                } for span in spans]}]}]}
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            typed_value = {'boolValue': value}
+        elif isinstance(value, int):
+            typed_value = {'intValue': str(value)}
+        elif isinstance(value, float):
+            typed_value = {'doubleValue': value}
+        else:
+            typed_value = {'stringValue': str(value)}
+        return {'key': key, 'value': typed_value}
+
+
+class Tracer(object):
+    """
+    Starts spans and hands them to the exporter when they end.  The current span is kept per thread.
+    """
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self._local = threading.local()
+
+    def current_span(self):
+        """
+        :return: the innermost span started on this thread that has not ended, or None
+        """
+        return getattr(self._local, 'span', None)
+
+    @contextmanager
+    def start_span(self, name, attributes=None, parent=None):
+        """
+        Context manager that records its block as a span.  If the block raises, the exception is recorded on the span.
+        :param name: the name of the operation
+        :param attributes: dict of the initial attributes of the span
+        :param parent: the parent span; defaults to the current span.  Needed to continue a trace on another thread.
+        :return: the Span, or NOOP_SPAN if tracing is off
+        """
+        exporter = self.exporter
+        if exporter is None:
+            yield NOOP_SPAN
+            return
+
+        previous = self.current_span()
+        parent = parent if parent is not None else previous
+        if parent is not None and parent.is_recording:
+            span = Span(name, parent.trace_id, parent.span_id, attributes)
+        else:
+            span = Span(name, _new_id(16), None, attributes)
+        self._local.span = span
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_exception(exc)
+            raise
+        finally:
+            self._local.span = previous
+            span.end()
+            try:
+                exporter.export(span)
+            except Exception as exc:
+                logging.getLogger(__name__).error("Could not export span {}: {}".format(name, str(exc)))
+
+
+TRACER = Tracer()
+_configure_lock = threading.Lock()
+
+
+def configure(env):
+    """
+    Sets the exporter of TRACER from the trace_exporter setting, unless it has already been configured.
+    :param env: the Settings of the environment
+    :return: the exporter, or None if tracing is off
+    """
+    with _configure_lock:
+        if TRACER.exporter is None:
+            if env.trace_exporter == FILE_EXPORTER:
+                TRACER.exporter = FileExporter(env.trace_file)
+            elif env.trace_exporter == OTLP_EXPORTER:
+                TRACER.exporter = OtlpExporter(env.trace_otlp_endpoint)
+            elif env.trace_exporter:
+                raise Exception("Unknown trace_exporter '{}'; expected '{}' or '{}'"
+                                .format(env.trace_exporter, FILE_EXPORTER, OTLP_EXPORTER))
+            if TRACER.exporter is not None:
+                logging.getLogger(__name__).info("Tracing spans exported with {}".format(env.trace_exporter))
+        return TRACER.exporter
+
+
+def shutdown():
+    """
+    Exports the spans that are still pending and turns tracing off.
+    """
+    with _configure_lock:
+        exporter, TRACER.exporter = TRACER.exporter, None
+    if exporter is not None:
+        exporter.shutdown()
+
+
+def start_span(name, attributes=None, parent=None):
+    return TRACER.start_span(name, attributes, parent)
+
+
+def current_span():
+    return TRACER.current_span()
@@ -16,6 +16,7 @@ An example of how to call this service can be found in scripts/examples/call_amo
 """
 
 import logging
+import time
 import traceback
 from datetime import datetime, timedelta
 from pprint import pformat
@@ -23,6 +24,9 @@ from pprint import pformat
 from flask_restful import Resource, request
 
 from accessors.treatment_arm_accessor import TreatmentArmsAccessor
+from helpers import metrics
+from helpers import shared_cache
+from helpers import tracing
 from resources.auth0_resource import requires_auth
 
 
@@ -53,22 +57,26 @@ class VariantRulesMgr:
                  snv_identifier_rules=None,
                  gene_fusion_identifier_rules=None,
                  indel_identifier_rules=None):
-        ta_accessor = TreatmentArmsAccessor()
-        self.nhs_rules = non_hotspot_rules if non_hotspot_rules is not None \
-            else ta_accessor.get_ta_non_hotspot_rules()
-        self.cnv_identifier_rules = cnv_identifier_rules if cnv_identifier_rules is not None \
-            else ta_accessor.get_ta_identifier_rules('copyNumberVariants')
-        self.snv_identifier_rules = snv_identifier_rules if snv_identifier_rules is not None \
-            else ta_accessor.get_ta_identifier_rules('singleNucleotideVariants')
-        self.gf_identifier_rules = gene_fusion_identifier_rules if gene_fusion_identifier_rules is not None \
-            else ta_accessor.get_ta_identifier_rules('geneFusions')
-        self.indel_identifier_rules = indel_identifier_rules if indel_identifier_rules is not None \
-            else ta_accessor.get_ta_identifier_rules('indels')
-
-        self.cnv_protein_rules = self._extract_protein_rules(self.cnv_identifier_rules)
-        self.snv_protein_rules = self._extract_protein_rules(self.snv_identifier_rules)
-        self.gf_protein_rules = self._extract_protein_rules(self.gf_identifier_rules)
-        self.indel_protein_rules = self._extract_protein_rules(self.indel_identifier_rules)
+        with tracing.start_span('VariantRulesMgr.load') as span:
+            ta_accessor = TreatmentArmsAccessor()
+            self.nhs_rules = non_hotspot_rules if non_hotspot_rules is not None \
+                else ta_accessor.get_ta_non_hotspot_rules()
+            self.cnv_identifier_rules = cnv_identifier_rules if cnv_identifier_rules is not None \
+                else ta_accessor.get_ta_identifier_rules('copyNumberVariants')
+            self.snv_identifier_rules = snv_identifier_rules if snv_identifier_rules is not None \
+                else ta_accessor.get_ta_identifier_rules('singleNucleotideVariants')
+            self.gf_identifier_rules = gene_fusion_identifier_rules if gene_fusion_identifier_rules is not None \
+                else ta_accessor.get_ta_identifier_rules('geneFusions')
+            self.indel_identifier_rules = indel_identifier_rules if indel_identifier_rules is not None \
+                else ta_accessor.get_ta_identifier_rules('indels')
+
+            self.cnv_protein_rules = self._extract_protein_rules(self.cnv_identifier_rules)
+            self.snv_protein_rules = self._extract_protein_rules(self.snv_identifier_rules)
+            self.gf_protein_rules = self._extract_protein_rules(self.gf_identifier_rules)
+            self.indel_protein_rules = self._extract_protein_rules(self.indel_identifier_rules)
+            span.set_attribute('rules.count', self.nonhotspot_rule_count() + self.copy_number_variant_rule_count() +
+                               self.single_nucleotide_variant_rule_count() + self.gene_fusion_rule_count() +
+                               self.indel_rule_count())
 
     @staticmethod
     def _extract_protein_rules(identifier_rules):
@@ -305,15 +313,26 @@ class VariantRulesMgrCache:
     _variant_rules_mgr = None
     _interval = 30
     _load_timestamp = datetime.now() - timedelta(seconds=_interval*2)
+    # The key of the rules snapshot in the shared cache
+    SNAPSHOT_KEY = 'variant_rules_snapshot'
 
     @classmethod
     def _reload(cls):
         """
         Creates a new instance of the VariantRulesMgr (which, in effects, reloads the rules from the database)
-        and saves the time that it did so.
-        """
-        cls._variant_rules_mgr = VariantRulesMgr()
-        cls._load_timestamp = datetime.now()
+        and saves the time that it did so.  With the shared cache on, the rules are taken from the snapshot that
+        another process loaded within the last _interval seconds, if there is one, and the time saved is when that
+        snapshot was loaded, so that the rules are never more than _interval seconds old.
+        """
+        age = 0.0
+        with metrics.timer('variant_rules_reload_seconds', 'Time spent reloading the variant rules').time():
+            if shared_cache.enabled():
+                rules, loaded = cls._get_rules_snapshot()
+                age = min(max(0.0, time.time() - loaded), cls._interval)
+                cls._variant_rules_mgr = VariantRulesMgr(**rules)
+            else:
+                cls._variant_rules_mgr = VariantRulesMgr()
+        cls._load_timestamp = datetime.now() - timedelta(seconds=age)
 
         logger = logging.getLogger(__name__)
         logger.debug("{cnt} nonHotspotRules loaded from treatmentArms collection"
@@ -327,6 +346,27 @@ class VariantRulesMgrCache:
         logger.debug("{cnt} Indel Rules loaded from treatmentArms collection"
                      .format(cnt=cls._variant_rules_mgr.indel_rule_count()))
 
+    @classmethod
+    def _get_rules_snapshot(cls):
+        """
+        :return: a tuple of the rules, a dict of the keyword arguments of VariantRulesMgr, and the time (as seconds
+                 since the epoch) that they were loaded from the database; from the shared cache or, if they are not
+                 there, from the database (in which case they are put in the shared cache for the other processes)
+        """
+        snapshot = shared_cache.get_value(cls.SNAPSHOT_KEY)
+        if snapshot is None:
+            loaded = time.time()
+            ta_accessor = TreatmentArmsAccessor()
+            rules = {'non_hotspot_rules': ta_accessor.get_ta_non_hotspot_rules(),
+                     'cnv_identifier_rules': ta_accessor.get_ta_identifier_rules('copyNumberVariants'),
+                     'snv_identifier_rules': ta_accessor.get_ta_identifier_rules('singleNucleotideVariants'),
+                     'gene_fusion_identifier_rules': ta_accessor.get_ta_identifier_rules('geneFusions'),
+                     'indel_identifier_rules': ta_accessor.get_ta_identifier_rules('indels')}
+            # Stored before VariantRulesMgr adds the protein rule type to the identifier rules
+            snapshot = {'loaded': loaded, 'rules': rules}
+            shared_cache.set_value(cls.SNAPSHOT_KEY, snapshot, cls._interval)
+        return snapshot['rules'], snapshot['loaded']
+
     @classmethod
     def get_variant_rules_mgr(cls):
         """
@@ -336,7 +376,10 @@ class VariantRulesMgrCache:
         seconds_elapsed = (datetime.now() - cls._load_timestamp).seconds
         # logging.getLogger(__name__).debug("seconds_elapsed={}, interval={}".format(seconds_elapsed, cls._interval))
         if seconds_elapsed >= cls._interval:
+            metrics.counter('variant_rules_cache_reloads_total', 'Variant rules reloaded because they were stale').inc()
             cls._reload()
+        else:
+            metrics.counter('variant_rules_cache_hits_total', 'Variant rules served from the cache').inc()
         return cls._variant_rules_mgr
 
 
@@ -519,35 +562,40 @@ def find_amois(vr, var_rules_mgr):
     :param var_rules_mgr: instance of the VariantRulesMgr class
     """
     logger = logging.getLogger(__name__)
-    for variant in vr['copyNumberVariants']:
-        amois = var_rules_mgr.get_matching_copy_number_variant_identifier_rules(variant)
-        amois.extend(var_rules_mgr.get_matching_copy_number_variant_protein_rules(variant))
-        if amois:
-            logger.debug("CNV aMOIs:\n{}".format(pformat(amois)))
-            variant['amois'] = create_amois_annotation(amois)
-
-    for variant in vr['unifiedGeneFusions']:
-        amois = var_rules_mgr.get_matching_gene_fusions_identifier_rules(variant)
-        amois.extend(var_rules_mgr.get_matching_gene_fusions_protein_rules(variant))
-        if amois:
-            logger.debug("UGF aMOIs:\n{}".format(pformat(amois)))
-            variant['amois'] = create_amois_annotation(amois)
-
-    for variant in vr['indels']:
-        amois = var_rules_mgr.get_matching_indel_identifier_rules(variant)
-        amois.extend(var_rules_mgr.get_matching_indel_protein_rules(variant))
-        amois.extend(var_rules_mgr.get_matching_nonhotspot_rules(variant))
-        if amois:
-            logger.debug("Indel aMOIs:\n{}".format(pformat(amois)))
-            variant['amois'] = create_amois_annotation(amois)
-
-    for variant in vr['singleNucleotideVariants']:
-        amois = var_rules_mgr.get_matching_single_nucleotide_variant_identifier_rules(variant)
-        amois.extend(var_rules_mgr.get_matching_single_nucleotide_variant_protein_rules(variant))
-        amois.extend(var_rules_mgr.get_matching_nonhotspot_rules(variant))
-        if amois:
-            logger.debug("SNV aMOIs:\n{}".format(pformat(amois)))
-            variant['amois'] = create_amois_annotation(amois)
+    with tracing.start_span('find_amois.copyNumberVariants', {'variant.count': len(vr['copyNumberVariants'])}):
+        for variant in vr['copyNumberVariants']:
+            amois = var_rules_mgr.get_matching_copy_number_variant_identifier_rules(variant)
+            amois.extend(var_rules_mgr.get_matching_copy_number_variant_protein_rules(variant))
+            if amois:
+                logger.debug("CNV aMOIs:\n{}".format(pformat(amois)))
+                variant['amois'] = create_amois_annotation(amois)
+
+    with tracing.start_span('find_amois.unifiedGeneFusions', {'variant.count': len(vr['unifiedGeneFusions'])}):
+        for variant in vr['unifiedGeneFusions']:
+            amois = var_rules_mgr.get_matching_gene_fusions_identifier_rules(variant)
+            amois.extend(var_rules_mgr.get_matching_gene_fusions_protein_rules(variant))
+            if amois:
+                logger.debug("UGF aMOIs:\n{}".format(pformat(amois)))
+                variant['amois'] = create_amois_annotation(amois)
+
+    with tracing.start_span('find_amois.indels', {'variant.count': len(vr['indels'])}):
+        for variant in vr['indels']:
+            amois = var_rules_mgr.get_matching_indel_identifier_rules(variant)
+            amois.extend(var_rules_mgr.get_matching_indel_protein_rules(variant))
+            amois.extend(var_rules_mgr.get_matching_nonhotspot_rules(variant))
+            if amois:
+                logger.debug("Indel aMOIs:\n{}".format(pformat(amois)))
+                variant['amois'] = create_amois_annotation(amois)
+
+    with tracing.start_span('find_amois.singleNucleotideVariants',
+                            {'variant.count': len(vr['singleNucleotideVariants'])}):
+        for variant in vr['singleNucleotideVariants']:
+            amois = var_rules_mgr.get_matching_single_nucleotide_variant_identifier_rules(variant)
+            amois.extend(var_rules_mgr.get_matching_single_nucleotide_variant_protein_rules(variant))
+            amois.extend(var_rules_mgr.get_matching_nonhotspot_rules(variant))
+            if amois:
+                logger.debug("SNV aMOIs:\n{}".format(pformat(amois)))
+                variant['amois'] = create_amois_annotation(amois)
 
 
 # def dedup_amois(amois_list):
@@ -664,7 +712,8 @@ class IsAmoisResource(Resource):
             self.logger.debug("Variants =\n{}".format(pformat(variant_list)))
 
             var_rules_mgr = VariantRulesMgr()
-            result_list = [var_rules_mgr.is_amoi(variant, variant_type) for variant in variant_list]
+            with tracing.start_span('is_amoi', {'variant.type': variant_type, 'variant.count': len(variant_list)}):
+                result_list = [var_rules_mgr.is_amoi(variant, variant_type) for variant in variant_list]
             ret_val = result_list
 
         except Exception as exc:
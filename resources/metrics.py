@@ -0,0 +1,72 @@
+"""
+The metrics of the API process in the Prometheus text exposition format, and the instrumentation of the resources
+that records the number and latency of their requests and traces each one in a span.
+"""
+import logging
+import time
+from functools import wraps
+
+from flask import request, Response
+from flask_restful import Resource
+from werkzeug.exceptions import HTTPException
+
+from helpers import metrics
+from helpers import tracing
+from resources.auth0_resource import AuthenticationError
+
+REQUESTS_METRIC = 'http_requests_total'
+REQUEST_SECONDS_METRIC = 'http_request_duration_seconds'
+
+
+def instrument(view):
+    """
+    Decorator for the view function of a resource (as passed to flask_restful.Api in decorators) that counts its
+    requests by method and status code, and records their latency by method, labelled with the resource class.
+    A view that raises an HTTPException is counted with the exception's status code and one that raises an
+    AuthenticationError with 401; any other exception is counted as a 500.
+    Each request is also the root span of a trace.
+    :param view: the view function created by flask_restful for a Resource class
+    :return: the instrumented view function
+    """
+    resource = getattr(getattr(view, 'view_class', None), '__name__', view.__name__)
+
+    @wraps(view)
+    def instrumented_view(*args, **kwargs):
+        start = time.perf_counter()
+        status = 500
+        try:
+            with tracing.start_span('{} {}'.format(request.method, resource),
+                                    {'http.method': request.method, 'http.target': request.path}) as span:
+                response = view(*args, **kwargs)
+                status = getattr(response, 'status_code', 200)
+                span.set_attribute('http.status_code', status)
+            return response
+        except HTTPException as exc:
+            status = exc.code or 500
+            raise
+        except AuthenticationError:
+            status = 401
+            raise
+        finally:
+            labels = {'resource': resource, 'method': request.method}
+            metrics.histogram(REQUEST_SECONDS_METRIC, 'Latency of the requests to each resource',
+                              labels).observe(time.perf_counter() - start)
+            metrics.counter(REQUESTS_METRIC, 'Requests to each resource by status code',
+                            dict(labels, status=str(status))).inc()
+
+    return instrumented_view
+
+
+class MetricsResource(Resource):
+    """
+    Metrics resource
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+
+    def get(self):
+        """
+        Gets the current values of the metrics of the process in the Prometheus text exposition format
+        """
+        self.logger.debug('Retrieving metrics')
+        return Response(metrics.REGISTRY.exposition(), content_type=metrics.EXPOSITION_CONTENT_TYPE)
@@ -8,8 +8,12 @@ from flask_restful import Resource
 from flask_restful import request
 
 from accessors.treatment_arm_accessor import TreatmentArmsAccessor
+from accessors.treatment_arm_cache import TreatmentArmCache
 from resources.auth0_resource import requires_auth
 
+# Without a projection parameter, every field is returned except those that are only for the API's internal use.
+DEFAULT_PROJECTION = {'summaryReportFingerprint': 0}
+
 
 def is_active_only(active_param):
     return True if active_param and active_param.upper() in ['TRUE', '1'] else False
@@ -30,7 +34,7 @@ def get_query(args):
 
 
 def get_projection(args):
-    projection = None
+    projection = dict(DEFAULT_PROJECTION)
     if 'projection' in args and args['projection'] is not None:
         projection_list = str.split(args['projection'], ',')
         projection = dict([(f, 1) for f in projection_list])
@@ -85,10 +89,14 @@ class TreatmentArmsById(Resource):
         query.update(get_query(args))
         projection = get_projection(args)
 
-        treatment_arms = TreatmentArmsAccessor().find(query, projection)
-        for ta in treatment_arms:
-            reformat_status_log(ta)
-        return sorted(treatment_arms, key=lambda ta: ta[self.SORT_KEY], reverse=True)
+        def load():
+            treatment_arms = TreatmentArmsAccessor().find(query, projection)
+            for ta in treatment_arms:
+                reformat_status_log(ta)
+            return sorted(treatment_arms, key=lambda ta: ta[self.SORT_KEY], reverse=True)
+
+        shape = (is_active_only(args['active']), tuple(sorted(projection.items())) if projection else None)
+        return TreatmentArmCache.instance().get(arm_id, shape, load)
 
 
 class TreatmentArmsOverview(Resource):
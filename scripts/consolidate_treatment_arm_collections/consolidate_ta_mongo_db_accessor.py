@@ -1,20 +1,111 @@
 import pymongo
 
+# Collection that records how far the conversion of each source collection has gotten so that it can be resumed.
+PROGRESS_COLLECTION = 'treatmentArmsConsolidationProgress'
+# Suffix of the _id of the progress document that holds the boundaries of the _id ranges of a source collection.
+RANGES_SUFFIX = '#ranges'
+
 
 class MongoDbAccessor(object):
 
     def __init__(self, uri, db):
+        self.uri = uri
+        self.db_name = db
         mongo_client = pymongo.MongoClient(uri)
         self.database = mongo_client[db]
 
-    def get_documents(self, coll_name):
-        return self.database[coll_name].find()
+    def get_documents(self, coll_name, after_id=None, batch_size=None, min_id=None, max_id=None):
+        """
+        :param coll_name: the name of the collection
+        :param after_id: if given, only the documents whose _id is greater than it are returned
+        :param batch_size: if given, the number of documents the cursor fetches per round trip
+        :param min_id: if given, only the documents whose _id is at least min_id are returned
+        :param max_id: if given, only the documents whose _id is less than max_id are returned
+        :return: a cursor over the documents in _id order
+        """
+        query = self._id_range_query(min_id, max_id)
+        if after_id is not None:
+            query.setdefault('_id', dict())['$gt'] = after_id
+        cursor = self.database[coll_name].find(query).sort('_id', pymongo.ASCENDING)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+        return cursor
+
+    def get_document_count(self, coll_name, min_id=None, max_id=None):
+        return self.database[coll_name].count(self._id_range_query(min_id, max_id))
+
+    def compute_range_boundaries(self, coll_name, range_cnt):
+        """
+        Splits the collection into range_cnt ranges of _ids with about the same number of documents in each.
+        :param coll_name: the name of the collection
+        :param range_cnt: the number of ranges
+        :return: a list of the _ids, in ascending order, at which each range after the first starts
+        """
+        if range_cnt <= 1:
+            return []
+        buckets = self.database[coll_name].aggregate([{'$bucketAuto': {'groupBy': '$_id', 'buckets': range_cnt}}])
+        return [bucket['_id']['min'] for bucket in buckets][1:]
 
-    def get_document_count(self, coll_name):
-        return self.database[coll_name].find().count()
+    def put_treatment_arms_documents(self, docs):
+        """
+        :param docs: a list of documents to insert into treatmentArms
+        :return: the list of the _ids of the inserted documents
+        """
+        return self.database.treatmentArms.insert_many(docs, ordered=False).inserted_ids
 
-    def put_treatment_arms_documents(self, doc):
-        return self.database.treatmentArms.insert_one(doc).inserted_id
+    def remove_treatment_arms_documents(self, ids):
+        """
+        :param ids: the _ids of the documents to remove from treatmentArms
+        :return: the number of documents removed
+        """
+        return self.database.treatmentArms.delete_many({'_id': {'$in': list(ids)}}).deleted_count
 
     def clear_treatment_arms(self):
-        self.database.treatmentArms.remove({})
\ No newline at end of file
+        self.database.treatmentArms.remove({})
+
+    def get_progress(self, coll_name):
+        """
+        :param coll_name: the name of the source collection
+        :return: the progress document saved by save_progress for the collection, or None if there is none
+        """
+        return self.database[PROGRESS_COLLECTION].find_one({'_id': coll_name})
+
+    def save_progress(self, coll_name, last_source_id, count, in_flight_ids):
+        """
+        :param coll_name: the name of the source collection
+        :param last_source_id: the _id of the last source document whose treatmentArms document has been inserted
+        :param count: the number of source documents converted so far
+        :param in_flight_ids: the _ids of the treatmentArms documents being inserted, which are to be removed if the
+                              conversion is resumed before the next call
+        """
+        self.database[PROGRESS_COLLECTION].replace_one({'_id': coll_name},
+                                                       {'_id': coll_name,
+                                                        'lastSourceId': last_source_id,
+                                                        'count': count,
+                                                        'inFlightIds': list(in_flight_ids)},
+                                                       upsert=True)
+
+    def get_range_boundaries(self, coll_name):
+        """
+        :param coll_name: the name of the source collection
+        :return: the range boundaries saved by save_range_boundaries for the collection, or None if there are none
+        """
+        doc = self.database[PROGRESS_COLLECTION].find_one({'_id': coll_name + RANGES_SUFFIX})
+        return None if doc is None else doc['boundaries']
+
+    def save_range_boundaries(self, coll_name, boundaries):
+        self.database[PROGRESS_COLLECTION].replace_one({'_id': coll_name + RANGES_SUFFIX},
+                                                       {'_id': coll_name + RANGES_SUFFIX, 'boundaries': boundaries},
+                                                       upsert=True)
+
+    def clear_progress(self):
+        self.database[PROGRESS_COLLECTION].delete_many({})
+
+    @staticmethod
+    def _id_range_query(min_id, max_id):
+        id_range = dict()
+        if min_id is not None:
+            id_range['$gte'] = min_id
+        if max_id is not None:
+            id_range['$lt'] = max_id
+        return {'_id': id_range} if id_range else dict()
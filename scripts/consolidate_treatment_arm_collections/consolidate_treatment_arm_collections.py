@@ -29,12 +29,29 @@ Note:  In production, this script will need to be run only once.  To simplify
 development/testing efforts, it will first remove all documents from the
 treatmentArms collection if they exist.
 
+The source collections are read in batches of --batch-size documents, in _id order,
+and each batch is written to treatmentArms with a single insert.  After each batch,
+the last source _id written is recorded so that, after a failure, running the
+script again with --resume continues from the last batch that was committed
+instead of starting over.
+
+With --workers greater than 1, treatmentArm and treatmentArmHistory are converted at
+the same time on a pool of that many processes, and treatmentArmHistory is split into
+that many ranges of _ids with about the same number of documents in each.  Each range
+is converted by its own process with its own cursor and database connection.
+
 Returns 0 if successful; otherwise -1.
 """
+import argparse
 import logging
 import os
 import sys
+import time
 import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from bson import ObjectId
 
 from config import log
 from scripts.consolidate_treatment_arm_collections.consolidate_ta_mongo_db_accessor import MongoDbAccessor
@@ -47,6 +64,12 @@ OA_ARMS = ['EAY131-A', 'EAY131-C1', 'EAY131-C2', 'EAY131-E', 'EAY131-F', 'EAY131
            'EAY131-M', 'EAY131-R', 'EAY131-S2', 'EAY131-T', 'EAY131-U', 'EAY131-V', 'EAY131-X', 'EAY131-Y',
            'EAY131-Z1B', 'EAY131-Z1C', 'EAY131-Z1E']
 
+# Number of source documents read and inserted into treatmentArms per round trip.
+DEFAULT_BATCH_SIZE = 1000
+# Number of processes that convert the source collections (and ranges of treatmentArmHistory) at the same time.
+DEFAULT_WORKERS = 4
+
+
 def get_study_types(treatmentArmId):
     if treatmentArmId not in OA_ARMS:
         return ['STANDARD']
@@ -136,8 +159,10 @@ class TAHConverter(ConverterBase):
 
 def prepare_treatment_arms_collection(db_accessor):
     """It is necessary to remove any existing documents from treatmentArms prior
-       to adding the items from the other source tables.
+       to adding the items from the other source tables.  The progress of any
+       earlier conversion is discarded as well.
     """
+    db_accessor.clear_progress()
     trtmt_arms_cnt = db_accessor.get_document_count('treatmentArms')
     if trtmt_arms_cnt:
         LOGGER.info('treatmentArms must be empty; %d documents will be removed before continuing.',
@@ -151,33 +176,127 @@ def prepare_treatment_arms_collection(db_accessor):
     return trtmt_arms_cnt  # should always return 0; used for unit-testing
 
 
-def convert_to_treatment_arms(db_accessor, converter):
+def iter_batches(docs, batch_size):
+    """Yields lists of up to batch_size consecutive documents from docs."""
+    docs = iter(docs)
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_resume_point(db_accessor, progress_key):
+    """Returns a tuple of the _id of the last source document that was converted under
+       progress_key in an earlier run (None if there was none) and the number of documents
+       it converted.  Any treatmentArms documents from a batch that was being inserted
+       when the earlier run stopped are removed so that the batch can be inserted again.
+    """
+    progress = db_accessor.get_progress(progress_key)
+    if not progress:
+        return None, 0
+
+    if progress['inFlightIds']:
+        removed_cnt = db_accessor.remove_treatment_arms_documents(progress['inFlightIds'])
+        LOGGER.info("Removed %d treatmentArms documents of an uncommitted batch from %s",
+                    removed_cnt, progress_key)
+    LOGGER.info("Resuming %s after document %s; %d documents already converted",
+                progress_key, progress['lastSourceId'], progress['count'])
+    return progress['lastSourceId'], progress['count']
+
+
+def get_id_ranges(db_accessor, coll_name, range_cnt, resume=False):
+    """Splits the collection named coll_name into range_cnt ranges of _ids.  The boundaries
+       are saved so that a resumed run uses the same ranges as the run it continues.
+       Returns a list of (min_id, max_id) tuples:  each range runs from min_id (inclusive)
+       to max_id (exclusive), where None means that the range is unbounded on that side.
+    """
+    boundaries = db_accessor.get_range_boundaries(coll_name) if resume else None
+    if boundaries is None:
+        boundaries = db_accessor.compute_range_boundaries(coll_name, range_cnt)
+        db_accessor.save_range_boundaries(coll_name, boundaries)
+    bounds = [None] + list(boundaries) + [None]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def convert_to_treatment_arms(db_accessor, converter, batch_size=DEFAULT_BATCH_SIZE, resume=False,
+                              id_range=(None, None), progress_key=None):
     """Using the db_accessor, get all of the documents from collection named in converter,
        convert them to the required format using the converter.convert function, and insert
-       them into the treatmentArms collection.
+       them into the treatmentArms collection, batch_size documents at a time.  If resume is
+       True, continues from the last batch committed by an earlier run.  Only the documents
+       in id_range, a (min_id, max_id) tuple as returned by get_id_ranges, are converted;
+       their progress is saved under progress_key, which defaults to the collection name.
        Return the number of documents converted.
     """
-    LOGGER.info("\nConverting documents from %s into documents for treatmentArms...",
-                converter.get_collection_name())
+    coll_name = converter.get_collection_name()
+    progress_key = progress_key or coll_name
+    min_id, max_id = id_range
+    LOGGER.info("\nConverting documents from %s into documents for treatmentArms...", progress_key)
+
+    last_id, cnt = get_resume_point(db_accessor, progress_key) if resume else (None, 0)
+    total_cnt = db_accessor.get_document_count(coll_name, min_id, max_id)
+    start_time = time.time()
+    run_cnt = 0
+    docs = db_accessor.get_documents(coll_name, last_id, batch_size, min_id, max_id)
+    for batch in iter_batches(docs, batch_size):
+        new_docs = [converter.convert(doc) for doc in batch]
+        # The _ids are assigned here rather than by insert so that the batch can be removed if it is not committed.
+        for new_doc in new_docs:
+            new_doc['_id'] = ObjectId()
+
+        db_accessor.save_progress(progress_key, last_id, cnt, [d['_id'] for d in new_docs])
+        db_accessor.put_treatment_arms_documents(new_docs)
+        last_id = batch[-1]['_id']
+        cnt += len(batch)
+        run_cnt += len(batch)
+        db_accessor.save_progress(progress_key, last_id, cnt, [])
+
+        LOGGER.debug("  %d treatmentArms documents created from %s.%s to %s.%s",
+                     len(batch), coll_name, batch[0]['_id'], coll_name, last_id)
+        elapsed = time.time() - start_time
+        LOGGER.info("  %s: %d/%d documents converted (%.0f documents/second)",
+                    progress_key, cnt, total_cnt, run_cnt / elapsed if elapsed else 0.0)
+
+    LOGGER.info("%d documents inserted into treatmentArms from %s", cnt, progress_key)
+    return cnt
 
-    cnt = 0
-    for doc in db_accessor.get_documents(converter.get_collection_name()):
-        new_doc = converter.convert(doc)
-        new_id = db_accessor.put_treatment_arms_documents(new_doc)
-        cnt += 1
 
-        log_msg = "  TreamentArms document %s created from %s.%s"
-        LOGGER.debug(log_msg, new_id, converter.get_collection_name(), doc['_id'])
+def convert_range(uri, db, converter, batch_size, resume, id_range, progress_key):
+    """Runs convert_to_treatment_arms in a worker process, which needs its own connection
+       to the database.
+    """
+    return convert_to_treatment_arms(MongoDbAccessor(uri, db), converter, batch_size, resume, id_range, progress_key)
 
-    LOGGER.info("%d documents inserted into treatmentArms from %s", cnt, converter.get_collection_name())
-    return cnt
 
+def convert_collections(db_accessor, batch_size=DEFAULT_BATCH_SIZE, resume=False, workers=1):
+    """Converts treatmentArm and the ranges of treatmentArmHistory (one per worker), on a
+       pool of worker processes if workers is more than 1 and otherwise one after the other.
+       Return the number of documents converted.
+    """
+    tasks = []
+    for converter, range_cnt in [(TAConverter(), 1), (TAHConverter(), workers)]:
+        coll_name = converter.get_collection_name()
+        for i, id_range in enumerate(get_id_ranges(db_accessor, coll_name, range_cnt, resume)):
+            tasks.append((converter, id_range, '{}#{}'.format(coll_name, i)))
+
+    if workers <= 1:
+        return sum(convert_to_treatment_arms(db_accessor, converter, batch_size, resume, id_range, progress_key)
+                   for converter, id_range, progress_key in tasks)
+
+    LOGGER.info("Converting %d ranges of documents on %d worker processes", len(tasks), workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_range, db_accessor.uri, db_accessor.db_name, converter, batch_size, resume,
+                                   id_range, progress_key)
+                   for converter, id_range, progress_key in tasks]
+        return sum(future.result() for future in futures)
 
-def main(db_accessor):
+
+def main(db_accessor, batch_size=DEFAULT_BATCH_SIZE, resume=False, workers=1):
     try:
-        prepare_treatment_arms_collection(db_accessor)
-        doc_cnt = convert_to_treatment_arms(db_accessor, TAConverter())
-        doc_cnt += convert_to_treatment_arms(db_accessor, TAHConverter())
+        if not resume:
+            prepare_treatment_arms_collection(db_accessor)
+        doc_cnt = convert_collections(db_accessor, batch_size, resume, workers)
 
         LOGGER.info("\n%d total documents inserted into treatmentArms.", doc_cnt)
 
@@ -209,4 +328,13 @@ if __name__ == '__main__':
     if sys.version_info >= (3, 6, 0):
         LOGGER.warning("Script may not run with python 3.6; please try python 3.5 if you have problems.\n")
 
-    exit(main(get_mongo_accessor()))
+    parser = argparse.ArgumentParser(description="Consolidate treatmentArm and treatmentArmHistory into treatmentArms.")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="number of documents inserted per round trip")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue from the last committed batch of a run that failed")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="number of processes converting documents at the same time")
+    args = parser.parse_args()
+
+    exit(main(get_mongo_accessor(), args.batch_size, args.resume, args.workers))
@@ -3,6 +3,10 @@ class AssignmentRecord(object):
     An object to store all of the data required in the AssignmentRecords field of the summaryReport
     subcollection of the TreatmentArms collection in the match MongoDb database.
     """
+    # A refresh creates one of these for every assignment of every arm, so there is no per-instance __dict__.
+    __slots__ = ('patient_sequence_number', 'patient_type', 'treatment_arm_version', 'assignment_status_outcome',
+                 'analysis_id', 'patient_assmt_idx', 'date_selected', 'date_on_arm', 'date_off_arm', 'step_number',
+                 'diseases', 'assignment_reason', 'biopsy_seq_num')
 
     def __init__(self, pat_seq_num, patient_type, ta_version, assnmnt_status, assnmnt_reason, step_num, diseases,
                  analysis_id, patient_assmt_idx, biopsy_seq_num, date_selected, date_on_arm, date_off_arm=None):
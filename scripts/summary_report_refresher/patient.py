@@ -1,18 +1,23 @@
+import logging
+from bisect import bisect_left
 from datetime import datetime, timedelta
 
+EPOCH = datetime(1970, 1, 1)
+ONE_MS = timedelta(milliseconds=1)
+# A PENDING_CONFIRMATION trigger created within this many milliseconds after the assignment date belongs to it.
+ASSIGNMENT_WINDOW_MS = 300 * 1000
+
 
 def convert_date(json_date_dict):
     """Converts the date as it is stored in the Match MongoDB database into a python datetime object."""
     if not isinstance(json_date_dict, dict) or '$date' not in json_date_dict:
         raise TypeError("parameter must be a dict with a '$date' key")
-    # return datetime.utcfromtimestamp(int(json_date_dict['$date']/1000))
+    return EPOCH + timedelta(milliseconds=int(json_date_dict['$date']))
 
-    # datetime.utcfromtimestamp can't handle a timestamp with milliseconds, so we have to remove them before
-    # conversion and then add them back before returning.
-    timestamp = json_date_dict['$date']
-    ms_from_timestamp = int(timestamp%1000)
 
-    return datetime.utcfromtimestamp(int(timestamp/1000)) + timedelta(milliseconds=ms_from_timestamp)
+def datetime_to_epoch_ms(date):
+    """Converts a python datetime object into milliseconds since the epoch (the inverse of convert_date)."""
+    return (date - EPOCH) // ONE_MS
 
 
 class Patient(object):
@@ -20,6 +25,12 @@ class Patient(object):
     An object to store all of the Patient data required for summaryReport refresh.
     The data is formatted in accordance with that of the Patient collection in the match MongoDb database.
     """
+    # The fields of patient_json that are copied into attributes by the constructor
+    FIELDS = ('currentPatientStatus', 'patientAssignmentIdx', 'patientAssignments', 'patientSequenceNumber',
+              'patientType', 'currentStepNumber', 'patientTriggers', 'diseases', 'biopsies', 'treatmentArm')
+    __slots__ = FIELDS + ('_pat', '_triggers', '_trigger_statuses', '_trigger_times', '_last_trigger_idx',
+                          '_pending_conf_triggers')
+
     def __init__(self, patient_json):
         """
         The expected format of the patient_json is that returned by
@@ -27,20 +38,36 @@ class Patient(object):
         :param patient_json: dictionary containing required patient data
         """
         self._pat = patient_json
+        for field in Patient.FIELDS:
+            if field in patient_json:
+                setattr(self, field, patient_json[field])
+
+        # The triggers are indexed once, up front:  their statuses and creation times (in epoch milliseconds) in
+        # parallel lists, the index of the last trigger with each status, and the PENDING_CONFIRMATION triggers
+        # sorted by creation time as (time, index) tuples.  A trigger without a status or creation date cannot be
+        # placed in the patient's history, so it is skipped rather than failing the refresh of the whole batch.
+        self._triggers = []
+        self._trigger_statuses = []
+        self._trigger_times = []
+        for trigger in patient_json.get('patientTriggers', []):
+            try:
+                status, created = trigger['patientStatus'], int(trigger['dateCreated']['$date'])
+            except (KeyError, TypeError, ValueError) as exc:
+                logging.getLogger(__name__).warning("Skipping malformed trigger of patient {psn}: {exc!r}"
+                                                    .format(psn=patient_json.get('patientSequenceNumber'), exc=exc))
+                continue
+            self._triggers.append(trigger)
+            self._trigger_statuses.append(status)
+            self._trigger_times.append(created)
+        self._last_trigger_idx = dict([(status, i) for i, status in enumerate(self._trigger_statuses)])
+        self._pending_conf_triggers = sorted([(self._trigger_times[i], i)
+                                              for i, status in enumerate(self._trigger_statuses)
+                                              if status == "PENDING_CONFIRMATION"])
 
     def __getattr__(self, item):
         """
-        Provides easy "getter" access to the following items:
-            currentPatientStatus
-            patientAssignmentIdx
-            patientAssignments
-            patientSequenceNumber
-            patientType
-            currentStepNumber
-            patientTriggers
-            diseases
-            biopsies
-            treatmentArm
+        The items in FIELDS are plain attributes, so this is only called for the other items of the patient data
+        (and for the items in FIELDS that the patient data does not have, which raise KeyError as the others do).
         :param item: the desired item
         :return: the value of the desired item
         """
@@ -48,14 +75,12 @@ class Patient(object):
 
     def find_trigger_by_status(self, status):
         """
-        Searches the patientTriggers for the matching status
+        Looks up the last of the patientTriggers with the matching status in the index built by the constructor
         :param status: the search criterion
         :return: the matching trigger if found, otherwise None
         """
-        for trigger in reversed(self._pat['patientTriggers']):
-            if trigger['patientStatus'] == status:
-                return trigger
-        return None
+        idx = self._last_trigger_idx.get(status)
+        return self._triggers[idx] if idx is not None else None
 
     def treatment_arm_version(self):
         """
@@ -101,24 +126,36 @@ class Patient(object):
         date_on_arm = None
         date_off_arm = None
         last_status = None
-        assignment_flag = False
 
-        for trigger in self._pat['patientTriggers']:
-            if assignment_flag:
-                last_status = trigger['patientStatus']
+        assignment_idx = self._find_assignment_trigger_idx(date_assigned)
+        if assignment_idx is not None:
+            last_status = self._trigger_statuses[assignment_idx]
+            for idx in range(assignment_idx + 1, len(self._trigger_statuses)):
+                last_status = self._trigger_statuses[idx]
                 if last_status == "ON_TREATMENT_ARM":
-                    date_on_arm = convert_date(trigger['dateCreated'])
+                    date_on_arm = EPOCH + self._trigger_times[idx] * ONE_MS
                 elif last_status != "PENDING_APPROVAL":
                     if date_on_arm is not None:
-                        date_off_arm = convert_date(trigger['dateCreated'])
+                        date_off_arm = EPOCH + self._trigger_times[idx] * ONE_MS
                     break
-            elif trigger['patientStatus'] == "PENDING_CONFIRMATION":
-                if self._trigger_belongs_to_assignment(trigger, date_assigned):
-                    assignment_flag = True
-                    last_status = trigger['patientStatus']
 
         return date_assigned, date_on_arm, date_off_arm, last_status
 
+    def _find_assignment_trigger_idx(self, assignment_date):
+        """
+        Finds the first PENDING_CONFIRMATION trigger that belongs to the assignment (see
+        _trigger_belongs_to_assignment) with a binary search over the creation times of the PENDING_CONFIRMATION
+        triggers.
+        :param assignment_date: a datetime object containing the date the patient as assigned to an arm, or None
+        :return: the index of the trigger among the well-formed patientTriggers, or None if no trigger belongs to the assignment
+        """
+        if assignment_date is None:
+            return None
+        assignment_ms = datetime_to_epoch_ms(assignment_date)
+        start = bisect_left(self._pending_conf_triggers, (assignment_ms, -1))
+        end = bisect_left(self._pending_conf_triggers, (assignment_ms + ASSIGNMENT_WINDOW_MS, -1), start)
+        return min([idx for _, idx in self._pending_conf_triggers[start:end]], default=None)
+
     @staticmethod
     def _trigger_belongs_to_assignment(trigger, assignment_date):
         """
@@ -128,15 +165,9 @@ class Patient(object):
         :param assignment_date: a datetime object containing the date the patient as assigned to an arm
         :return: True/False
         """
-        belongs = False
-
-        delta = convert_date(trigger['dateCreated']) - assignment_date
-
         # let's give ourselves a 5 min window - is a bit large but ....
-        if delta.total_seconds() >= 0 and delta.total_seconds() < 300:
-            belongs = True
-
-        return belongs
+        delta_ms = int(trigger['dateCreated']['$date']) - datetime_to_epoch_ms(assignment_date)
+        return 0 <= delta_ms < ASSIGNMENT_WINDOW_MS
 
     def get_date_assigned(self):
         """
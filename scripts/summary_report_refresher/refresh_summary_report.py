@@ -9,6 +9,9 @@ import logging
 #
 # from config.flask_config import Configuration
 from config import log
+from helpers import shared_cache
+from helpers import tracing
+from helpers.environment import Environment
 from scripts.summary_report_refresher.refresher import Refresher
 
 # Logging functionality
@@ -25,11 +28,16 @@ if __name__ == '__main__':
     exit_code = 0
     try:
         # with APP.app_context():
+        tracing.configure(Environment())
+        shared_cache.configure(Environment())
         r = Refresher()
-        r.run()
+        if r.run():
+            exit_code = 1
     except Exception as exc:
         LOGGER.exception(str(exc))
         exit_code = 1
+    finally:
+        tracing.shutdown()  # exports the spans that are still pending
 
     LOGGER.info("Summary Report Refresher completed with exit code {}".format(exit_code))
     exit(exit_code)
@@ -1,7 +1,14 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import ExitStack
 
 from accessors.patient_accessor import PatientAccessor
 from accessors.treatment_arm_accessor import TreatmentArmsAccessor
+from accessors.treatment_arm_cache import TreatmentArmCache
+from helpers import metrics
+from helpers import tracing
+from helpers.environment import Environment
 from scripts.summary_report_refresher.assignment_record import AssignmentRecord
 from scripts.summary_report_refresher.patient import Patient
 from scripts.summary_report_refresher.summary_report import SummaryReport
@@ -21,55 +28,231 @@ class Refresher(object):
         'OFF_TRIAL_DECEASED': 'FORMERLY_ON_ARM_DECEASED',
     }
 
-    def __init__(self):
+    def __init__(self, concurrency=None, bulk_fetch=None, treatment_arm_ids=None, patient_seq_nums=None):
+        """
+        By default, the summary reports of all of the active arms are refreshed.  If treatment_arm_ids (and,
+        optionally, patient_seq_nums) are given, only the summary reports of the arms affected by them are refreshed.
+        :param concurrency: maximum number of summary reports refreshed at the same time; defaults to the
+                            refresher_concurrency configuration setting.
+        :param bulk_fetch: if True, the patients of patient_api_bulk_batch_size arms are retrieved from the Patient
+                           API with a single request; defaults to the patient_api_bulk_fetch configuration setting.
+        :param treatment_arm_ids: IDs of the arms to refresh, including the arms the patients are now assigned to
+        :param patient_seq_nums: sequence numbers of patients whose arms are to be refreshed
+        """
+        env = Environment()
         self.logger = logging.getLogger(__name__)
-        self.pat_accessor = PatientAccessor()  # provides access to the Patient API
+        self.concurrency = max(1, int(concurrency or env.refresher_concurrency))
+        self.bulk_fetch = bulk_fetch if bulk_fetch is not None else env.patient_api_bulk_fetch
+        self.bulk_batch_size = max(1, env.patient_api_bulk_batch_size)
+        self.write_batch_size = max(1, env.refresher_write_batch_size)
+        self.pat_accessor = PatientAccessor(self.concurrency)  # provides access to the Patient API
         self.ta_accessor = TreatmentArmsAccessor()  # provides access to the TreatmentArms collection in MongoDB
-        self.summary_rpts = [SummaryReport(ta_data)
-                             for ta_data in self.ta_accessor.get_arms_for_summary_report_refresh()]
+        arms = self.ta_accessor.get_arms_for_summary_report_refresh(
+            self._select_arm_ids(treatment_arm_ids, patient_seq_nums))
+        TreatmentArmCache.observe_state_tokens(arms)  # arms changed since they were cached are dropped from the cache
+        self.summary_rpts = [SummaryReport(ta_data) for ta_data in arms]
         self.token = create_authentication_token()
+        self.run_span = None  # the tracing span of run, the parent of the spans of the refresher's worker threads
+
+    def _select_arm_ids(self, treatment_arm_ids, patient_seq_nums):
+        """
+        Determines which arms are affected by the given arms and patients.  A patient's arms are the ones whose
+        summary reports already contain an assignment record for the patient; an arm that the patient has just been
+        assigned to has no such record yet, so it must be among treatment_arm_ids.  Patients given without any arms
+        therefore cannot be refreshed incrementally, and all of the active arms are refreshed instead.
+        :param treatment_arm_ids: IDs of arms to refresh, or None
+        :param patient_seq_nums: sequence numbers of patients whose arms are to be refreshed, or None
+        :return: a list of TreatmentArm IDs; or None, meaning all of the active arms
+        """
+        if not treatment_arm_ids:
+            if patient_seq_nums:
+                self.logger.warning("No treatment arms given for patients {}; refreshing all of the summary reports"
+                                    .format(", ".join(sorted(patient_seq_nums))))
+            return None
+
+        arm_ids = set(treatment_arm_ids or [])
+        if patient_seq_nums:
+            arm_ids.update(self.ta_accessor.get_arm_ids_for_patients(patient_seq_nums))
+        self.logger.info("Incremental refresh of the summary reports of arms: {}".format(", ".join(sorted(arm_ids))))
+        return sorted(arm_ids)
 
     def run(self):
-        sum_rpt_cnt = len(self.summary_rpts)
-        self.logger.info("{cnt} summary reports selected for update".format(cnt=sum_rpt_cnt))
+        """
+        Refreshes all of the selected summary reports, up to self.concurrency of them (or, with bulk fetching,
+        self.concurrency batches of them) at a time.  A failure while
+        refreshing one summary report is logged and counted, but does not prevent the others from being refreshed.
+        The refreshed summary reports are written to the database self.write_batch_size at a time; those whose
+        fingerprint matches the one stored with the arm are unchanged and are not written at all.
+        :return: the number of summary reports that could not be refreshed (0 if all of them were)
+        """
+        with tracing.start_span('Refresher.run', {'summary_report.count': len(self.summary_rpts),
+                                                  'bulk_fetch': self.bulk_fetch}) as self.run_span:
+            start = time.perf_counter()
+            sum_rpt_cnt = len(self.summary_rpts)
+            self.logger.info("{cnt} summary reports selected for update; concurrency = {conc}; bulk fetch = {bulk}"
+                             .format(cnt=sum_rpt_cnt, conc=self.concurrency, bulk=self.bulk_fetch))
 
-        upd_cnt = 0
-        for sr in self.summary_rpts:
-            if self._update_summary_report(sr):
-                upd_cnt += 1
+            upd_cnt = 0
+            unchanged_cnt = 0
+            pending_writes = []  # (SummaryReport, summary report JSON, fingerprint) tuples that are ready to be written
+            batch_size = self.bulk_batch_size if self.bulk_fetch else 1
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                futures = [executor.submit(self._refresh_summary_reports, self.summary_rpts[i:i + batch_size])
+                           for i in range(0, sum_rpt_cnt, batch_size)]
+                for future in as_completed(futures):
+                    for sr, sr_json in future.result():
+                        if sr_json is None:
+                            continue
+                        fingerprint = SummaryReport.compute_fingerprint(sr_json)
+                        if fingerprint == sr.get_stored_fingerprint():
+                            # The summary report in the database is already up to date, so there is nothing to write.
+                            unchanged_cnt += 1
+                        else:
+                            pending_writes.append((sr, sr_json, fingerprint))
+                        if len(pending_writes) >= self.write_batch_size:
+                            upd_cnt += self._write_summary_reports(pending_writes)
+                            pending_writes = []
+            upd_cnt += self._write_summary_reports(pending_writes)
+
+            metrics.timer('summary_report_refresh_seconds', 'Duration of the runs of the Summary Report Refresher') \
+                .observe(time.perf_counter() - start)
+            metrics.counter('summary_reports_written_total', 'Refreshed summary reports written').inc(upd_cnt)
+            metrics.counter('summary_reports_unchanged_total', 'Refreshed summary reports that were unchanged') \
+                .inc(unchanged_cnt)
+            failed_cnt = sum_rpt_cnt - upd_cnt - unchanged_cnt
+            metrics.counter('summary_reports_failed_total', 'Summary reports that could not be refreshed') \
+                .inc(failed_cnt)
+            self.logger.info("{upd} summary reports written; {unchanged} unchanged summary reports skipped"
+                             .format(upd=upd_cnt, unchanged=unchanged_cnt))
+            if failed_cnt:
+                self.logger.error("Only {cnt}/{total} summary reports updated"
+                                  .format(cnt=upd_cnt + unchanged_cnt, total=sum_rpt_cnt))
             else:
+                self.logger.info("All {cnt} summary reports were updated.".format(cnt=sum_rpt_cnt))
+            return failed_cnt
+
+    def _refresh_summary_reports(self, sum_rpts):
+        """
+        Refreshes a batch of summary reports.  With bulk fetching, the patients of all of the arms in the batch are
+        streamed from the Patient API with a single request and each one is matched to its summary report as it
+        arrives; if that fails, each summary report retrieves its own patients instead.  A failure while
+        refreshing a summary report is logged and does not prevent the others from being refreshed.
+        :param sum_rpts: list of SummaryReports
+        :return: list of (SummaryReport, summary report JSON) tuples; the JSON is None if the refresh failed
+        """
+        with tracing.start_span('Refresher.refresh_batch', {'summary_report.count': len(sum_rpts)},
+                                parent=self.run_span):
+            if self.bulk_fetch:
+                trtmt_ids = [sr.treatmentArmId for sr in sum_rpts]
+                try:
+                    self._match_streamed_patients(sum_rpts)
+                    return [(sr, sr.get_json()) for sr in sum_rpts]
+                except Exception as exc:
+                    self.logger.warning("Bulk retrieval of patients for {ids} failed; retrieving them one arm at a "
+                                        "time: {exc}".format(ids=", ".join(trtmt_ids), exc=str(exc)))
+                    for sr in sum_rpts:
+                        sr.reset()
+
+            return [(sr, self._get_refreshed_json(sr)) for sr in sum_rpts]
+
+    def _match_streamed_patients(self, sum_rpts):
+        """
+        Matches the patients of all of the given summary reports' arms, retrieved with a single bulk request, to
+        their summary reports as they are streamed from the Patient API.  As the patients of the arms are interleaved
+        in the stream, the span of each arm's update covers the whole stream.
+        :param sum_rpts: list of SummaryReports
+        """
+        sum_rpts_by_arm = dict([(sr.treatmentArmId, sr) for sr in sum_rpts])
+        seen_psns_by_arm = dict([(trtmt_id, set()) for trtmt_id in sum_rpts_by_arm])
+        batch_span = tracing.current_span()
+        with ExitStack() as stack:
+            spans_by_arm = dict()
+            for trtmt_id, sr in sum_rpts_by_arm.items():
+                spans_by_arm[trtmt_id] = stack.enter_context(tracing.start_span(
+                    'Refresher.update_summary_report', {'treatmentArmId': trtmt_id, 'version': sr.version},
+                    parent=batch_span))
+            for trtmt_id, patient in self.pat_accessor.iter_patients_by_treatment_arm_ids(list(sum_rpts_by_arm),
+                                                                                          self.token):
+                Refresher._add_patient(sum_rpts_by_arm[trtmt_id], patient, seen_psns_by_arm[trtmt_id])
+            for trtmt_id, seen_psns in seen_psns_by_arm.items():
+                self.logger.info("{cnt} patients returned for '{trtmt_id}"
+                                 .format(cnt=len(seen_psns), trtmt_id=trtmt_id))
+                spans_by_arm[trtmt_id].set_attribute('patient.count', len(seen_psns))
+
+    def _get_refreshed_json(self, sum_rpt):
+        """
+        Refreshes a single summary report, logging it if it failed.
+        :param sum_rpt: the summary report to refresh
+        :return: the summary report JSON to be written to the database if successful; otherwise None
+        """
+        try:
+            return self._update_summary_report(sum_rpt)
+        except Exception as exc:
+            self.logger.exception("Failed to update Summary Report for {trtmtId}:{version}: {exc}"
+                                  .format(trtmtId=sum_rpt.treatmentArmId, version=sum_rpt.version, exc=str(exc)))
+        return None
+
+    def _write_summary_reports(self, pending_writes):
+        """
+        Writes the given summary reports to the treatmentArms collection on the database with a single bulk write.
+        :param pending_writes: list of (SummaryReport, summary report JSON, fingerprint) tuples
+        :return: the number of summary reports that were updated
+        """
+        if not pending_writes:
+            return 0
+
+        try:
+            results = self.ta_accessor.update_summary_reports([(sr._id, sr_json, fingerprint)
+                                                               for sr, sr_json, fingerprint in pending_writes])
+        except Exception as exc:
+            self.logger.exception("Failed to write {cnt} Summary Reports: {exc}"
+                                  .format(cnt=len(pending_writes), exc=str(exc)))
+            results = [False] * len(pending_writes)
+
+        for (sr, _, _), updated in zip(pending_writes, results):
+            if not updated:
                 self.logger.error("Failed to update Summary Report for {trtmtId}:{version}"
                                   .format(trtmtId=sr.treatmentArmId, version=sr.version))
-
-        if upd_cnt != sum_rpt_cnt:
-            self.logger.error("Only {cnt}/{total} summary reports updated".format(cnt=upd_cnt, total=sum_rpt_cnt))
-        else:
-            self.logger.info("All {cnt} summary reports were updated.".format(cnt=sum_rpt_cnt))
+        TreatmentArmCache.invalidate_arms([sr.treatmentArmId for (sr, _, _), updated in zip(pending_writes, results)
+                                           if updated])
+        return results.count(True)
 
     def _update_summary_report(self, sum_rpt):
         """
         Update the given summary report with counts and assignment records.
         :param sum_rpt: The summary report of a treatment arm that requires updating.
+        :return: the summary report JSON to be written to the database
         """
         # Get all patients associated with the Treatment Arm of the given Summary Report.
         # Patients are sorted by patientSequenceNumber (ascending) and patientAssignments.dateConfirmed (descending).
-        # patients = [Patient(p) for p in self.pat_accessor.get_patients_by_treatment_arm_id(sum_rpt.treatmentArmId)]
-        patients = [Patient(p) for p in self.pat_accessor.get_patients_by_treatment_arm_id(sum_rpt.treatmentArmId,
-                                                                                           self.token)]
-        self.logger.info("{cnt} patients returned for '{trtmt_id}"
-                         .format(cnt=len(patients), trtmt_id=sum_rpt.treatmentArmId))
-
-        # Update the summary report object for any patients that meet the criteria.
-        pat_id = []
-        for pat in patients:
-            # Only match the patient the first time he/she is encountered.  (A patient can be assigned to an arm more
-            # than once [different versions], but only the most recent occurrence should be counted.)
-            if pat.patientSequenceNumber not in pat_id:
-                Refresher._match(pat, sum_rpt)
-                pat_id.append(pat.patientSequenceNumber)
-
-        # Update the summary report in the treatmentArms collection on the database
-        return self.ta_accessor.update_summary_report(sum_rpt._id, sum_rpt.get_json())
+        with tracing.start_span('Refresher.update_summary_report', {'treatmentArmId': sum_rpt.treatmentArmId,
+                                                                     'version': sum_rpt.version}) as span:
+            patients = self.pat_accessor.iter_patients_by_treatment_arm_id(sum_rpt.treatmentArmId, self.token)
+
+            # Update the summary report object for any patients that meet the criteria as they arrive.
+            seen_psns = set()
+            for patient in patients:
+                Refresher._add_patient(sum_rpt, patient, seen_psns)
+            self.logger.info("{cnt} patients returned for '{trtmt_id}"
+                             .format(cnt=len(seen_psns), trtmt_id=sum_rpt.treatmentArmId))
+            span.set_attribute('patient.count', len(seen_psns))
+
+            return sum_rpt.get_json()
+
+    @staticmethod
+    def _add_patient(sum_rpt, patient, seen_psns):
+        """
+        Matches the patient to the summary report unless the patient has already been seen.
+        :param sum_rpt: the summary report of the patient's treatment arm
+        :param patient: a patient JSON document
+        :param seen_psns: set of the patientSequenceNumbers already seen for sum_rpt; updated with the patient's
+        """
+        # Only match the patient the first time he/she is encountered.  (A patient can be assigned to an arm more
+        # than once [different versions], but only the most recent occurrence should be counted.)
+        patient_seq_num = patient['patientSequenceNumber']
+        if patient_seq_num not in seen_psns:
+            seen_psns.add(patient_seq_num)
+            Refresher._match(Patient(patient), sum_rpt)
 
     @staticmethod
     def _match(patient, sum_rpt):
@@ -1,3 +1,7 @@
+import hashlib
+import json
+
+
 class SummaryReport(object):
     # Patient Type Constants
     NOT_ENROLLED = 'numNotEnrolledPatient'
@@ -5,6 +9,8 @@ class SummaryReport(object):
     PENDING = 'numPendingArmApproval'
     CURRENT = 'numCurrentPatientsOnArm'
     ASSNMNT_RECS = 'assignmentRecords'
+    # Field of the treatmentArms document that holds the fingerprint of its summaryReport
+    FINGERPRINT = 'summaryReportFingerprint'
 
     _SR_COUNT_FIELDS = [NOT_ENROLLED, FORMER, CURRENT, PENDING]
     _REQ_JSON_FIELDS = ['_id', 'treatmentArmId', 'version', 'treatmentArmStatus']
@@ -29,6 +35,12 @@ class SummaryReport(object):
         """
         SummaryReport._validate_sr_json_doc(ta_json_doc)
         self.ta = ta_json_doc
+        self.reset()
+
+    def reset(self):
+        """
+        Discards any patients that have been added, returning the counts to 0 and the assignmentRecords to [].
+        """
         self.sr = dict([(f, 0) for f in SummaryReport._SR_COUNT_FIELDS])
         self.sr[SummaryReport.ASSNMNT_RECS] = []
 
@@ -58,6 +70,23 @@ class SummaryReport(object):
         self.sr[SummaryReport.ASSNMNT_RECS] = self._finalize_assignment_records(self.sr[SummaryReport.ASSNMNT_RECS])
         return self.sr
 
+    def get_stored_fingerprint(self):
+        """
+        :return: the fingerprint of the summary report currently stored in the database, or None if there is none
+        """
+        return self.ta.get(SummaryReport.FINGERPRINT)
+
+    @staticmethod
+    def compute_fingerprint(sum_rpt_json):
+        """
+        Computes a stable hash of the given summary report JSON:  equal summary reports always have the same
+        fingerprint regardless of the order of their keys.
+        :param sum_rpt_json: the JSON returned by get_json()
+        :return: the hex digest string
+        """
+        canonical = json.dumps(sum_rpt_json, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
     @classmethod
     def _finalize_assignment_records(cls, assignment_recs):
         """
@@ -0,0 +1,133 @@
+"""
+Runs the handlers of the messages received by the TreatmentArmMessageManager on a bounded pool of worker threads.
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers import metrics
+from helpers import tracing
+
+
+class _MessageType(object):
+    """
+    The registration of a message type with the dispatcher and the state of its work.
+    """
+    def __init__(self, name, handler, max_concurrency, merge):
+        self.name = name
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+        self.merge = merge
+        self.running = 0
+        self.waiting = deque()  # (work, messages) tuples waiting for the type to be under its concurrency limit
+        self.latency_timer = metrics.timer('message_handler_seconds', 'Time spent handling messages', {'type': name})
+        self.failure_counter = metrics.counter('message_handler_failures_total', 'Failed handling of messages',
+                                               {'type': name})
+
+
+class MessageDispatcher(object):
+    """
+    Routes work for each registered message type to its handler on a bounded pool of worker threads.  Each type has
+    its own concurrency limit; work for a type that is at its limit waits in the type's queue without tying up a
+    worker.  If the type was registered with a merge function, work submitted while other work for the type is
+    waiting is merged into that work instead, so that it is all handled with a single call.
+    """
+    def __init__(self, max_workers, done_func=None):
+        """
+        :param max_workers: the number of worker threads, which limits the handlers running at the same time
+        :param done_func: if given, function called after each handler call with the messages of the work and
+                          whether the handler succeeded (returned True)
+        """
+        self.logger = logging.getLogger(__name__)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._done_func = done_func
+        self._types = dict()
+        self._cond = threading.Condition()
+
+    def register(self, msg_type, name, handler, max_concurrency=None, merge=None):
+        """
+        :param msg_type: the message that the handler handles
+        :param name: short name of the message type, used for its metrics
+        :param handler: function called with the work; returns True if it succeeded
+        :param max_concurrency: the most calls of handler at the same time; None for no limit other than the pool's
+        :param merge: if given, function that combines two pieces of work for handler into one
+        """
+        self._types[msg_type] = _MessageType(name, handler, max_concurrency, merge)
+
+    def handles(self, msg_type):
+        return msg_type in self._types
+
+    def submit(self, msg_type, work, messages=None):
+        """
+        Schedules handling of the work.
+        :param msg_type: a registered message type
+        :param work: the argument for the type's handler
+        :param messages: the messages the work came from
+        :return: True if the handler was started; False if the work is waiting (or was merged into waiting work)
+        """
+        msg_type = self._types[msg_type]
+        messages = list(messages or [])
+        with self._cond:
+            if msg_type.max_concurrency is None or msg_type.running < msg_type.max_concurrency:
+                self._start(msg_type, work, messages)
+                return True
+            if msg_type.merge is not None and msg_type.waiting:
+                waiting_work, waiting_messages = msg_type.waiting.pop()
+                msg_type.waiting.append((msg_type.merge(waiting_work, work), waiting_messages + messages))
+            else:
+                msg_type.waiting.append((work, messages))
+            return False
+
+    def is_idle(self):
+        with self._cond:
+            return self._is_idle()
+
+    def drain(self, timeout=None):
+        """
+        Waits for all of the running and waiting work to be done.
+        :param timeout: the most seconds to wait, or None to wait as long as it takes
+        :return: True if all of the work is done
+        """
+        with self._cond:
+            return self._cond.wait_for(self._is_idle, timeout)
+
+    def shutdown(self):
+        """
+        Drains the work and stops the worker threads.
+        """
+        self.drain()
+        self._executor.shutdown()
+
+    def _is_idle(self):
+        return all(t.running == 0 and not t.waiting for t in self._types.values())
+
+    def _start(self, msg_type, work, messages):
+        # Called with self._cond held
+        msg_type.running += 1
+        self._executor.submit(self._run, msg_type, work, messages)
+
+    def _run(self, msg_type, work, messages):
+        succeeded = False
+        try:
+            with tracing.start_span('message.' + msg_type.name, {'message.count': len(messages)}) as span, \
+                    msg_type.latency_timer.time():
+                succeeded = bool(msg_type.handler(work))
+                span.set_attribute('succeeded', succeeded)
+        except Exception as exc:
+            self.logger.exception("{name} message handler failed: {exc}".format(name=msg_type.name, exc=str(exc)))
+        if not succeeded:
+            msg_type.failure_counter.inc()
+
+        try:
+            if self._done_func is not None:
+                self._done_func(messages, succeeded)
+        except Exception as exc:
+            self.logger.exception("Completion of {name} message handling failed: {exc}"
+                                  .format(name=msg_type.name, exc=str(exc)))
+        finally:
+            with self._cond:
+                msg_type.running -= 1
+                if msg_type.waiting:
+                    self._start(msg_type, *msg_type.waiting.popleft())
+                self._cond.notify_all()
@@ -1,93 +1,438 @@
 #!/usr/bin/env python3
 
+import json
 import logging
+import threading
 import time
 
+from accessors.refresh_schedule_accessor import RefreshScheduleAccessor
 from accessors.sqs_accessor import SqsAccessor
 from config import log
+from helpers import metrics
+from helpers import shared_cache
+from helpers import tracing
 from helpers.environment import Environment
 from scripts.summary_report_refresher.refresher import Refresher
+from scripts.ta_message_manager.message_dispatcher import MessageDispatcher
 
 
 log.log_config()
 
 # Recognized messages:
 REFRESH_MSG = "RefreshSummaryReport"
+STATUS_MSG = "ReportStatus"
 STOP_MSG = "STOP"
 
+# A message may also be a JSON object with the message in its "message" field and any parameters in other fields.
+# For REFRESH_MSG, the optional "treatmentArmIds" field limits the refresh to the arms affected by those arms and by
+# the patients in the optional "patientSequenceNumbers" field; treatmentArmIds must include the arms that the patients
+# are now assigned to.  Without treatmentArmIds, all of the summary reports are refreshed.  For example:
+#   {"message": "RefreshSummaryReport", "treatmentArmIds": ["EAY131-B"], "patientSequenceNumbers": ["14442"]}
+
+
+def parse_message(msg_body):
+    """
+    Separates the message from its parameters.
+    :param msg_body: either the message itself or a JSON object with the message in its "message" field
+    :return: tuple of the message and a dict of its parameters
+    """
+    try:
+        payload = json.loads(msg_body)
+    except ValueError:
+        return msg_body, dict()
+    if isinstance(payload, dict) and 'message' in payload:
+        return payload['message'], payload
+    return msg_body, dict()
+
+
+def create_refresh_message(treatment_arm_ids=None, patient_seq_nums=None):
+    """
+    Creates the body of a message requesting that the summary reports be refreshed.
+    :param treatment_arm_ids: IDs of arms whose summary reports are to be refreshed, including the arms that the
+                              patients are now assigned to
+    :param patient_seq_nums: sequence numbers of patients whose arms' summary reports are to be refreshed
+    :return: the message body string; if no treatment_arm_ids are given, the message requests a full refresh
+    """
+    if not treatment_arm_ids and not patient_seq_nums:
+        return REFRESH_MSG
+    payload = {'message': REFRESH_MSG}
+    if treatment_arm_ids:
+        payload['treatmentArmIds'] = list(treatment_arm_ids)
+    if patient_seq_nums:
+        payload['patientSequenceNumbers'] = list(patient_seq_nums)
+    return json.dumps(payload)
+
+
+class RefreshRequest(object):
+    """
+    A request to refresh the summary reports of either all of the active arms (full) or only of the arms affected by
+    certain arms and patients (incremental).  A request with patients but no arms is full, since the arms that the
+    patients have just been assigned to are not known.
+    """
+    def __init__(self, treatment_arm_ids=None, patient_seq_nums=None):
+        self.treatment_arm_ids = set(treatment_arm_ids or [])
+        self.patient_seq_nums = set(patient_seq_nums or [])
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload.get('treatmentArmIds'), payload.get('patientSequenceNumbers'))
+
+    @property
+    def is_full(self):
+        return not self.treatment_arm_ids
+
+    def merge(self, other):
+        """
+        :param other: another RefreshRequest
+        :return: a RefreshRequest that covers both this one and other; it is full if either of them is
+        """
+        if self.is_full or other.is_full:
+            return RefreshRequest()
+        return RefreshRequest(self.treatment_arm_ids | other.treatment_arm_ids,
+                              self.patient_seq_nums | other.patient_seq_nums)
+
+
+class VisibilityHeartbeat(object):
+    """
+    Keeps the messages being worked on hidden from other consumers of the queue:  every interval seconds, extends
+    the visibility timeout of each held message to visibility_timeout seconds from then, until it is released.
+    """
+    def __init__(self, queue, visibility_timeout, interval):
+        """
+        :param queue: the SqsAccessor of the queue the messages were received from
+        :param visibility_timeout: seconds that the held messages are hidden after each heartbeat
+        :param interval: seconds between heartbeats; must be well under visibility_timeout
+        """
+        self.logger = logging.getLogger(__name__)
+        self.queue = queue
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval
+        self._held = dict()  # messages keyed by MessageId
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def hold(self, messages):
+        with self._lock:
+            for message in messages:
+                self._held[message['MessageId']] = message
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sqs-visibility-heartbeat', daemon=True)
+                self._thread.start()
+
+    def release(self, messages):
+        with self._lock:
+            for message in messages:
+                self._held.pop(message['MessageId'], None)
+
+    @property
+    def held_count(self):
+        with self._lock:
+            return len(self._held)
+
+    def beat(self):
+        """
+        Extends the visibility timeout of all of the held messages.
+        """
+        with self._lock:
+            messages = list(self._held.values())
+        if not messages:
+            return
+        try:
+            for message, reason in self.queue.change_visibility(messages, self.visibility_timeout):
+                self.logger.warning("Could not extend the visibility timeout of message {id}: {reason}"
+                                    .format(id=message['MessageId'], reason=reason))
+        except Exception as exc:
+            self.logger.exception("Visibility heartbeat failed: {}".format(str(exc)))
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.beat()
+
 
 class TreatmentArmMessageManager(object):
 
     def __init__(self, sleep_time=None):
         """
         Creates the Treatment Arms API message queue.
-        :param sleep_time: interval, in seconds, for checking the queue for messages.
+        :param sleep_time: interval, in seconds, for checking the queue for messages when long polling is disabled
+                           (that is, when sqs_wait_time_seconds is 0).
         """
         env = Environment()
 
         self.logger = logging.getLogger(__name__)
         self.sleep_time = sleep_time or env.polling_interval
+        self.wait_time = env.sqs_wait_time_seconds
+        self.max_messages = env.sqs_max_messages
+        self.max_drain_batches = env.sqs_max_drain_batches
+        self.visibility_timeout = env.sqs_visibility_timeout
+        self.max_receive_count = env.sqs_max_receive_count
+        self.dead_letter_queue_name = env.sqs_dead_letter_queue_name
+        self.dead_letter_queue = None  # created when the first message is moved to it
+        self.full_refresh_interval = env.full_refresh_interval
+        self.next_full_refresh_check = 0  # when the shared schedule is next checked for a full refresh that is due
+        self.lag_timer = metrics.timer('sqs_message_lag_seconds',
+                                       'Time from when a message was sent to the queue until it was received')
+        self.receive_timer = metrics.histogram('sqs_receive_seconds', 'Time spent in each receive from the queue')
+        self.received_counter = metrics.counter('sqs_messages_received_total', 'Messages received from the queue')
+
+        # Refreshes run one at a time, and the refresh requests received while one is running are merged and run
+        # once, together, when it is done; other messages are handled in parallel on the rest of the workers.
+        self.dispatcher = MessageDispatcher(env.message_handler_workers, self._finish_messages)
+        self.dispatcher.register(REFRESH_MSG, 'refresh', self._handle_refresh, max_concurrency=1,
+                                 merge=RefreshRequest.merge)
+        self.dispatcher.register(STATUS_MSG, 'status', self._report_status)
+
         self.queue = SqsAccessor(env.sqs_queue_name)
+        self.refresh_schedule = RefreshScheduleAccessor()
+        self.heartbeat = VisibilityHeartbeat(self.queue, self.visibility_timeout, env.sqs_heartbeat_interval)
 
-        self.logger.info("Connected to SQS queue {qn} at {url}; polling interval = {pi} seconds"
-                         .format(qn=self.queue.queue_name, url=self.queue.queue_url, pi=self.sleep_time))
+        self.logger.info("Connected to SQS queue {qn} at {url}; long polling wait time = {wt} seconds"
+                         .format(qn=self.queue.queue_name, url=self.queue.queue_url, wt=self.wait_time))
 
     def run(self):
         """
-        Runs continually, periodically checking the queue for messages, until a STOP message is received.
+        Runs continually, receiving batches of messages from the queue with long polling, until a STOP message is
+        received.  There is no pause between receives; a receive returns as soon as there are messages or after
+        waiting self.wait_time seconds for some.  Whenever messages arrive, all of the messages currently available
+        are drained from the queue and handed to the dispatcher together.  Before each receive, a full refresh is
+        scheduled if one is due.  Before returning, waits for the handling of the messages already received to be done.
         """
         time_to_stop = False
-        while not time_to_stop:
-            response = self.queue.receive_message(['SentTimestamp'])
+        try:
+            while not time_to_stop:
+                self._schedule_full_refresh()
+                messages = self._receive_messages(self.wait_time)
 
-            # import pprint
-            # pprint.pprint(response)
+                if messages:
+                    time_to_stop = self._handle_messages(self._drain(messages))
+                elif not self.wait_time:
+                    time.sleep(self.sleep_time)
+        finally:
+            self.dispatcher.shutdown()
+            self.heartbeat.stop()
+            self.logger.info("Message manager metrics: {}".format(metrics.REGISTRY.snapshot()))
 
-            if 'Messages' in response and len(response['Messages']):
-                message = response['Messages'][0]
-                time_to_stop = self._handle_message(message)
+    def _receive_messages(self, wait_time):
+        with self.receive_timer.time():
+            messages = self.queue.receive_messages(['SentTimestamp', 'ApproximateReceiveCount'], self.max_messages,
+                                                   wait_time, self.visibility_timeout)
+        self.received_counter.inc(len(messages))
+        return messages
 
-            time.sleep(self.sleep_time)
+    def _drain(self, messages):
+        """
+        Receives, without waiting, the rest of the messages that are available on the queue, up to
+        max_drain_batches more batches of them, so that a steady stream of messages cannot keep the received ones
+        from being handled (or from being held by the heartbeat before their visibility timeout expires).
+        :param messages: the messages already received
+        :return: a list of all of the messages received; stops draining at the first STOP message
+        """
+        messages = list(messages)
+        for _ in range(self.max_drain_batches):
+            if any(parse_message(message['Body'])[0] == STOP_MSG for message in messages):
+                break
+            more_messages = self._receive_messages(0)
+            if not more_messages:
+                break
+            messages.extend(more_messages)
+        return messages
 
-    def _handle_message(self, message):
+    def _handle_messages(self, messages):
         """
-        Takes the proper actions based on the passed in message.
-        :param message: the 'Body' should be one of the recognized messages
+        Handles a batch of received messages in the order received.  Each recognized message is handed to the
+        dispatcher, which runs its handler on a worker thread; messages of the same type in the batch are handed over
+        together, so all of the refresh requests in the batch are collapsed into a single refresh.  Processing is
+        at-least-once:  a dispatched message is held (its visibility timeout extended by the heartbeat) while its
+        handler runs and is deleted only if the handler succeeds; otherwise it is received again once its visibility
+        timeout expires.  STOP and unknown messages are deleted right away.  A message that has already been received
+        max_receive_count times is moved to the dead-letter queue instead of being handled again.  Messages after a
+        STOP message are made visible again for the next consumer.  On STOP, waits for all of the dispatched messages
+        to be handled.
+        :param messages: list of messages received from the queue
         :return: True if the STOP message was received; otherwise False
         """
-        msg_body = message['Body']
-        self.logger.info("Message received: {msg}".format(msg=msg_body))
-
-        # Delete received message from queue
-        self.queue.delete_message(message)
+        msgs = [parse_message(message['Body'])[0] for message in messages]
+        if STOP_MSG in msgs:
+            self._log_failures("make visible", self.queue.change_visibility(messages[msgs.index(STOP_MSG) + 1:], 0))
+            messages = messages[:msgs.index(STOP_MSG) + 1]
 
-        # Now handle the message
         rcvd_stop_msg = False
-        if msg_body == REFRESH_MSG:
-            self._refresh_summary_report()
-        elif msg_body == STOP_MSG:
-            rcvd_stop_msg = True
-            # self._delete_queue()
-        else:
-            self.logger.error("Unknown message received: {}".format(msg_body))
+        dispatched = dict()  # lists of (work, message) tuples keyed by message type, in the order received
+        handled_messages = []
+        for message in messages:
+            msg_body = message['Body']
+            self.logger.info("Message received: {msg}".format(msg=msg_body))
+            self._observe_lag(message)
+
+            receive_cnt = int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1))
+            if receive_cnt > self.max_receive_count:
+                self._move_to_dead_letter_queue(message, receive_cnt)
+                continue
 
+            msg, payload = parse_message(msg_body)
+            if msg == STOP_MSG:
+                rcvd_stop_msg = True
+                handled_messages.append(message)
+                # self._delete_queue()
+            elif self.dispatcher.handles(msg):
+                work = RefreshRequest.from_payload(payload) if msg == REFRESH_MSG else payload
+                dispatched.setdefault(msg, []).append((work, message))
+            else:
+                self.logger.error("Unknown message received: {}".format(msg_body))
+                handled_messages.append(message)
+
+        self._delete_messages(handled_messages)
+        for msg, work_items in dispatched.items():
+            self.heartbeat.hold([message for _, message in work_items])
+            self._dispatch(msg, work_items)
+        if rcvd_stop_msg:
+            self.dispatcher.drain()
         return rcvd_stop_msg
 
-    def _refresh_summary_report(self):
+    def _dispatch(self, msg, work_items):
+        """
+        Hands the work for messages of one type to the dispatcher.  Refresh requests are collapsed into one refresh;
+        each other message is handled separately.
+        :param msg: the message type
+        :param work_items: a non-empty list of (work, message) tuples
+        """
+        if msg != REFRESH_MSG:
+            for work, message in work_items:
+                self.dispatcher.submit(msg, work, [message])
+            return
+
+        refresh_request = work_items[0][0]
+        for other_request, _ in work_items[1:]:
+            refresh_request = refresh_request.merge(other_request)
+
+        if self.dispatcher.submit(REFRESH_MSG, refresh_request, [message for _, message in work_items]):
+            self.logger.info("Refresh started for {cnt} refresh request(s)".format(cnt=len(work_items)))
+        else:
+            self.logger.info("Refresh in progress; {cnt} refresh request(s) will be run once it is done"
+                             .format(cnt=len(work_items)))
+
+    def _observe_lag(self, message):
+        sent_timestamp = message.get('Attributes', {}).get('SentTimestamp')
+        if sent_timestamp is not None:
+            self.lag_timer.observe(max(0.0, time.time() - int(sent_timestamp) / 1000.0))
+
+    def _finish_messages(self, messages, succeeded):
+        """
+        Called by the dispatcher when the handling of messages is done.  Deletes the messages if their handler
+        succeeded; otherwise leaves them on the queue to be received again when their visibility timeout expires.
+        :param messages: the messages that were handled
+        :param succeeded: True if the handler succeeded
+        """
+        self.heartbeat.release(messages)
+        if succeeded:
+            self._delete_messages(messages)
+        elif messages:
+            self.logger.warning("Message handling failed; its {cnt} message(s) will be received again in {secs} "
+                                "seconds".format(cnt=len(messages), secs=self.visibility_timeout))
+
+    def _delete_messages(self, messages):
+        if not messages:
+            return
+        try:
+            self._log_failures("delete", self.queue.delete_messages(messages))
+        except Exception as exc:
+            self.logger.exception("Failed to delete {cnt} message(s): {exc}".format(cnt=len(messages), exc=str(exc)))
+
+    def _log_failures(self, action, failures):
+        for message, reason in failures:
+            self.logger.error("Failed to {action} message {id}: {reason}".format(action=action,
+                                                                                 id=message.get('MessageId'),
+                                                                                 reason=reason))
+
+    def _move_to_dead_letter_queue(self, message, receive_cnt):
+        """
+        Sends the message to the dead-letter queue and deletes it from the queue.
+        :param message: the message
+        :param receive_cnt: the number of times the message has been received
+        """
+        self.logger.error("Message {id} received {cnt} times; moving it to the dead-letter queue {dlq}: {msg}"
+                          .format(id=message.get('MessageId'), cnt=receive_cnt, dlq=self.dead_letter_queue_name,
+                                  msg=message['Body']))
+        try:
+            if self.dead_letter_queue is None:
+                self.dead_letter_queue = SqsAccessor(self.dead_letter_queue_name)
+            self.dead_letter_queue.send_message(message['Body'])
+        except Exception as exc:
+            self.logger.exception("Failed to send message {id} to the dead-letter queue: {exc}"
+                                  .format(id=message.get('MessageId'), exc=str(exc)))
+            return
+        self._delete_messages([message])
+
+    def _schedule_full_refresh(self):
+        """
+        Hands a full refresh to the dispatcher if this message manager claims it, so that any drift left by
+        incremental refreshes is corrected whether or not messages arrive.  The schedule is shared, in the database,
+        by all of the message managers:  a full refresh is claimed by only one of them, and only once it has been
+        full_refresh_interval seconds since the last one started (so restarting does not start one).  If a refresh
+        is running, the full refresh waits for it (and absorbs any refresh requests received meanwhile).
+        """
+        now = time.time()
+        if now < self.next_full_refresh_check:
+            return
+        try:
+            claimed, last_started = self.refresh_schedule.claim_full_refresh(self.full_refresh_interval)
+        except Exception as exc:
+            self.logger.exception("Failed to check the schedule of full refreshes: {}".format(str(exc)))
+            self.next_full_refresh_check = now + self.sleep_time
+            return
+
+        self.next_full_refresh_check = max((last_started or now) + self.full_refresh_interval, now + self.sleep_time)
+        if claimed:
+            self.logger.info("Full refresh of the summary reports is due")
+            self.dispatcher.submit(REFRESH_MSG, RefreshRequest())
+
+    def _handle_refresh(self, refresh_request):
+        return self._refresh_summary_report(refresh_request) == 0
+
+    def _report_status(self, payload):
+        """
+        Logs the state of the message manager and its metrics.
+        :param payload: the parameters of the message (unused)
+        :return: True
+        """
+        self.logger.info("Status: {held} message(s) held; metrics: {metrics}"
+                         .format(held=self.heartbeat.held_count, metrics=metrics.REGISTRY.snapshot()))
+        return True
+
+    def _refresh_summary_report(self, refresh_request=None):
         """
-        Runs the Summary Report Refresh.
+        Runs the Summary Report Refresh.  It fails if any of the summary reports could not be refreshed, so that the
+        messages that requested it are not deleted and the refresh is retried.
+        :param refresh_request: a RefreshRequest; if None, the refresh is a full one
         :return: 0 if successful; otherwise 1.
         """
-        self.logger.info("Starting the Summary Report Refresher")
+        full_refresh = refresh_request is None or refresh_request.is_full
+        self.logger.info("Starting the {type} Summary Report Refresher".format(type="full" if full_refresh
+                                                                               else "incremental"))
 
         return_code = 0
         try:
-            Refresher().run()
+            if full_refresh:
+                failed_cnt = Refresher().run()
+            else:
+                failed_cnt = Refresher(treatment_arm_ids=refresh_request.treatment_arm_ids,
+                                       patient_seq_nums=refresh_request.patient_seq_nums).run()
+            if failed_cnt:
+                self.logger.error("{cnt} summary reports could not be refreshed".format(cnt=failed_cnt))
+                return_code = 1
         except Exception as e:
             self.logger.exception(str(e))
             return_code = 1
 
-            self.logger.info("Summary Report Refresher completed with return code {}".format(return_code))
+        self.logger.info("Summary Report Refresher completed with return code {}".format(return_code))
         return return_code
 
 
@@ -105,5 +450,7 @@ def send_message_to_ta_queue(msg):
 if __name__ == '__main__':
     logger = logging.getLogger(__name__)
     logger.info("Starting the Treatment Arm API Message Queue")
+    tracing.configure(Environment())
+    shared_cache.configure(Environment())
     TreatmentArmMessageManager().run()
     logger.info("Exiting the Treatment Arm API Message Queue")
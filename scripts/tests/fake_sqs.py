@@ -0,0 +1,111 @@
+"""
+An in-process stand-in for the boto3 SQS client, for testing the message manager's handling of visibility timeouts,
+receive counts, and deletes without AWS.  Only the calls and parameters used by accessors/sqs_accessor.py are
+implemented.
+
+    with patch('accessors.sqs_accessor.boto3') as mock_boto3:
+        mock_boto3.client.return_value = FakeSqsClient()
+"""
+import itertools
+import threading
+import time
+
+
+class _Message(object):
+    def __init__(self, message_id, body):
+        self.message_id = message_id
+        self.body = body
+        self.sent_timestamp = int(time.time() * 1000)
+        self.receive_count = 0
+        self.visible_at = 0.0
+        self.receipt_handle = None
+
+
+class FakeSqsClient(object):
+    def __init__(self, default_visibility_timeout=30):
+        self.default_visibility_timeout = default_visibility_timeout
+        self._queues = dict()  # lists of _Messages keyed by queue URL
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def create_queue(self, QueueName):
+        url = 'https://sqs.fake/{}'.format(QueueName)
+        with self._cond:
+            self._queues.setdefault(url, [])
+        return {'QueueUrl': url}
+
+    def send_message(self, QueueUrl, MessageBody):
+        with self._cond:
+            message = _Message(str(next(self._ids)), MessageBody)
+            self._queues[QueueUrl].append(message)
+            self._cond.notify_all()
+        return {'MessageId': message.message_id}
+
+    def receive_message(self, QueueUrl, AttributeNames=None, MaxNumberOfMessages=1, WaitTimeSeconds=0,
+                        VisibilityTimeout=None):
+        visibility_timeout = self.default_visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        deadline = time.time() + WaitTimeSeconds
+        with self._cond:
+            while True:
+                now = time.time()
+                visible = [m for m in self._queues[QueueUrl] if m.visible_at <= now][:MaxNumberOfMessages]
+                if visible or now >= deadline:
+                    break
+                # Wake up when a message is sent or when the next hidden message becomes visible.
+                hidden_until = [m.visible_at for m in self._queues[QueueUrl] if m.visible_at > now]
+                self._cond.wait(min([deadline] + hidden_until) - now)
+
+            messages = []
+            for message in visible:
+                message.receive_count += 1
+                message.visible_at = now + visibility_timeout
+                message.receipt_handle = '{}-{}'.format(message.message_id, next(self._ids))
+                messages.append({'MessageId': message.message_id,
+                                 'ReceiptHandle': message.receipt_handle,
+                                 'Body': message.body,
+                                 'Attributes': {'SentTimestamp': str(message.sent_timestamp),
+                                                'ApproximateReceiveCount': str(message.receive_count)}})
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self.delete_message_batch(QueueUrl, [{'Id': '0', 'ReceiptHandle': ReceiptHandle}])
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        def delete(message, entry):
+            self._queues[QueueUrl].remove(message)
+        return self._batch(QueueUrl, Entries, delete)
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        def change_visibility(message, entry):
+            message.visible_at = time.time() + entry['VisibilityTimeout']
+        return self._batch(QueueUrl, Entries, change_visibility)
+
+    def _batch(self, queue_url, entries, operation):
+        successful = []
+        failed = []
+        with self._cond:
+            for entry in entries:
+                message = self._find(queue_url, entry['ReceiptHandle'])
+                if message is None:
+                    failed.append({'Id': entry['Id'], 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True})
+                else:
+                    operation(message, entry)
+                    successful.append({'Id': entry['Id']})
+            self._cond.notify_all()
+        return {'Successful': successful, 'Failed': failed}
+
+    def _find(self, queue_url, receipt_handle):
+        """
+        As in SQS, only the receipt handle from the most recent receive of a message is valid.
+        """
+        for message in self._queues[queue_url]:
+            if message.receipt_handle == receipt_handle:
+                return message
+        return None
+
+    def queue_bodies(self, queue_url):
+        """
+        :return: the bodies of all of the messages on the queue, whether or not they are visible
+        """
+        with self._cond:
+            return [m.body for m in self._queues[queue_url]]
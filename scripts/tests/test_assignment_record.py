@@ -74,6 +74,12 @@ class TestAssignmentRecord(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(assignment_rec.get_json(), exp_json)
 
+    def test_slots(self):
+        assignment_rec = AssignmentRecord(*create_assignment_rec_args())
+        self.assertFalse(hasattr(assignment_rec, '__dict__'))
+        with self.assertRaises(AttributeError):
+            assignment_rec.not_an_attribute = 1
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -2,9 +2,10 @@
 
 import datetime
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 
 from ddt import ddt, data, unpack
-from mock import patch
+from mock import patch, MagicMock
 
 from scripts.consolidate_treatment_arm_collections import consolidate_treatment_arm_collections as ctac
 import uuid
@@ -242,13 +243,125 @@ class TestConsolidateTreatmentArmCollections(unittest.TestCase):
     @patch(SCRIPT_PATH + '.LOGGER')
     @patch(SCRIPT_PATH + '.MongoDbAccessor')
     def test_convert_to_treatment_arms(self, indata, mock_db_accessor, mock_logger):
-        mock_db_accessor.get_documents = lambda n: indata
+        mock_db_accessor.get_documents = lambda n, after_id, batch_size, min_id, max_id: indata
+        mock_db_accessor.get_document_count = lambda n, min_id=None, max_id=None: len(indata)
         cnt = ctac.convert_to_treatment_arms(mock_db_accessor, ctac.TAConverter())
         self.assertEqual(cnt, len(indata))
 
         mock_logger.debug.assert_called()
         mock_logger.info.assert_called()
 
+    # Test that the documents are inserted in batches and that the progress is saved around each insert.
+    @data(
+        (1, [1, 1, 1]),
+        (2, [2, 1]),
+        (3, [3]),
+        (1000, [3]),
+    )
+    @unpack
+    @patch(SCRIPT_PATH + '.LOGGER')
+    @patch(SCRIPT_PATH + '.MongoDbAccessor')
+    def test_convert_to_treatment_arms_batches(self, batch_size, exp_batch_sizes, mock_db_accessor, mock_logger):
+        mock_db_accessor.get_documents.return_value = [self.TA_DOC1, self.TA_DOC2, self.TA_DOC3]
+        mock_db_accessor.get_document_count.return_value = 3
+
+        cnt = ctac.convert_to_treatment_arms(mock_db_accessor, ctac.TAConverter(), batch_size)
+
+        self.assertEqual(cnt, 3)
+        mock_db_accessor.get_documents.assert_called_once_with('treatmentArm', None, batch_size, None, None)
+        batches = [c[0][0] for c in mock_db_accessor.put_treatment_arms_documents.call_args_list]
+        self.assertEqual([len(b) for b in batches], exp_batch_sizes)
+        self.assertEqual([d['treatmentArmId'] for b in batches for d in b], ['EAY131-Z1', 'EAY131-Q', 'EAY131-Z'])
+
+        # Before each insert, the new _ids are saved as in flight; after it, the last source _id is committed.
+        save_calls = [c[0] for c in mock_db_accessor.save_progress.call_args_list]
+        self.assertEqual(len(save_calls), 2 * len(batches))
+        for batch, before, after in zip(batches, save_calls[::2], save_calls[1::2]):
+            self.assertEqual(before[3], [d['_id'] for d in batch])
+            self.assertEqual(after[3], [])
+        self.assertEqual(save_calls[-1], ('treatmentArm', 'EAY131-Z', 3, []))
+        mock_db_accessor.get_progress.assert_not_called()
+
+    # Test that a resumed conversion removes the uncommitted batch and continues after the last committed one.
+    @data(
+        (None, None, 0, 3, False),
+        ({'lastSourceId': 'EAY131-Q', 'count': 2, 'inFlightIds': ['id1']}, 'EAY131-Q', 2, 3, True),
+        ({'lastSourceId': 'EAY131-Q', 'count': 2, 'inFlightIds': []}, 'EAY131-Q', 2, 3, False),
+    )
+    @unpack
+    @patch(SCRIPT_PATH + '.LOGGER')
+    @patch(SCRIPT_PATH + '.MongoDbAccessor')
+    def test_convert_to_treatment_arms_resume(self, progress, exp_after_id, exp_prior_cnt, exp_cnt, exp_removed,
+                                              mock_db_accessor, mock_logger):
+        mock_db_accessor.get_progress.return_value = progress
+        mock_db_accessor.get_documents.return_value = [self.TA_DOC3]
+        mock_db_accessor.get_document_count.return_value = 3
+
+        cnt = ctac.convert_to_treatment_arms(mock_db_accessor, ctac.TAConverter(), 10, resume=True)
+
+        self.assertEqual(cnt, exp_prior_cnt + 1)
+        mock_db_accessor.get_documents.assert_called_once_with('treatmentArm', exp_after_id, 10, None, None)
+        self.assertEqual(mock_db_accessor.save_progress.call_args_list[0][0][:3],
+                         ('treatmentArm', exp_after_id, exp_prior_cnt))
+        if exp_removed:
+            mock_db_accessor.remove_treatment_arms_documents.assert_called_once_with(['id1'])
+        else:
+            mock_db_accessor.remove_treatment_arms_documents.assert_not_called()
+
+    @data(
+        ([], 3, []),
+        ([1, 2, 3, 4, 5], 2, [[1, 2], [3, 4], [5]]),
+        (iter([1, 2]), 2, [[1, 2]]),
+    )
+    @unpack
+    def test_iter_batches(self, docs, batch_size, exp_batches):
+        self.assertEqual(list(ctac.iter_batches(docs, batch_size)), exp_batches)
+
+    # Test that the ranges are computed and saved, or, when resuming, taken from the earlier run.
+    @data(
+        (False, None, ['b', 'd'], [(None, 'b'), ('b', 'd'), ('d', None)], True),
+        (True, None, ['b', 'd'], [(None, 'b'), ('b', 'd'), ('d', None)], True),
+        (True, ['c'], ['b', 'd'], [(None, 'c'), ('c', None)], False),
+        (False, None, [], [(None, None)], True),
+    )
+    @unpack
+    @patch(SCRIPT_PATH + '.MongoDbAccessor')
+    def test_get_id_ranges(self, resume, saved_boundaries, computed_boundaries, exp_ranges, exp_computed,
+                           mock_db_accessor):
+        mock_db_accessor.get_range_boundaries.return_value = saved_boundaries
+        mock_db_accessor.compute_range_boundaries.return_value = computed_boundaries
+
+        self.assertEqual(ctac.get_id_ranges(mock_db_accessor, 'treatmentArmHistory', 3, resume), exp_ranges)
+        if exp_computed:
+            mock_db_accessor.compute_range_boundaries.assert_called_once_with('treatmentArmHistory', 3)
+            mock_db_accessor.save_range_boundaries.assert_called_once_with('treatmentArmHistory',
+                                                                           computed_boundaries)
+        else:
+            mock_db_accessor.compute_range_boundaries.assert_not_called()
+
+    # Test that, with more than one worker, each collection range is converted by a worker with its own accessor.
+    @patch(SCRIPT_PATH + '.ProcessPoolExecutor', ThreadPoolExecutor)
+    @patch(SCRIPT_PATH + '.LOGGER')
+    @patch(SCRIPT_PATH + '.MongoDbAccessor')
+    def test_convert_collections_workers(self, mock_db_accessor_class, mock_logger):
+        history = {None: [self.TA_HISTORY_DOC1], '4300d834-4234-44e3-acdf-65b4a3c444b1': [self.TA_HISTORY_DOC2]}
+        worker_accessor = mock_db_accessor_class.return_value
+        worker_accessor.get_documents = lambda n, after_id, batch_size, min_id, max_id: \
+            [self.TA_DOC1, self.TA_DOC2] if n == 'treatmentArm' else history[min_id]
+        worker_accessor.get_document_count.return_value = 1
+        db_accessor = MagicMock(uri='mongodb://localhost:27017/Match', db_name='Match')
+        db_accessor.compute_range_boundaries.side_effect = lambda n, cnt: \
+            ['4300d834-4234-44e3-acdf-65b4a3c444b1'] if cnt == 2 else []
+
+        cnt = ctac.convert_collections(db_accessor, 10, workers=2)
+
+        self.assertEqual(cnt, 4)
+        self.assertEqual(mock_db_accessor_class.call_args_list, [(('mongodb://localhost:27017/Match', 'Match'),)] * 3)
+        progress_keys = set(c[0][0] for c in worker_accessor.save_progress.call_args_list)
+        self.assertEqual(progress_keys, {'treatmentArm#0', 'treatmentArmHistory#0', 'treatmentArmHistory#1'})
+        self.assertEqual(len(worker_accessor.put_treatment_arms_documents.call_args_list), 3)
+        db_accessor.put_treatment_arms_documents.assert_not_called()
+
     @data([82], [0])
     @unpack
     @patch(SCRIPT_PATH + '.LOGGER')
@@ -301,14 +414,27 @@ class TestConsolidateTreatmentArmCollections(unittest.TestCase):
     @patch(SCRIPT_PATH + '.LOGGER')
     @patch(SCRIPT_PATH + '.MongoDbAccessor')
     def test_main(self, ta_data, tah_data, exp_ret_val, mock_db_accessor, mock_logger):
-        mock_db_accessor.get_documents = lambda n: ta_data if n == 'treatmentArm' else tah_data
-        mock_db_accessor.get_document_count = lambda n: 0
+        mock_db_accessor.get_documents = lambda n, after_id, batch_size, min_id, max_id: ta_data if n == 'treatmentArm' else tah_data
+        mock_db_accessor.get_document_count = lambda n, min_id=None, max_id=None: 0
         ret_val = ctac.main(mock_db_accessor)
         self.assertEqual(ret_val, exp_ret_val)
         mock_logger.info.assert_called()
+        mock_db_accessor.clear_progress.assert_called_once()
         if ret_val != 0:
             mock_logger.exception.assert_called_once()
 
+    # Test that a resumed run does not clear treatmentArms.
+    @patch(SCRIPT_PATH + '.LOGGER')
+    @patch(SCRIPT_PATH + '.MongoDbAccessor')
+    def test_main_resume(self, mock_db_accessor, mock_logger):
+        mock_db_accessor.get_documents.return_value = []
+        mock_db_accessor.get_document_count.return_value = 0
+        mock_db_accessor.get_progress.return_value = None
+
+        self.assertEqual(ctac.main(mock_db_accessor, 10, resume=True), 0)
+        mock_db_accessor.clear_treatment_arms.assert_not_called()
+        mock_db_accessor.clear_progress.assert_not_called()
+
 
     # Test the get_mongo_accessor() function
     @data(
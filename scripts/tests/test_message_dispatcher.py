@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import threading
+import unittest
+
+from mock import MagicMock
+
+from helpers import metrics
+from scripts.ta_message_manager.message_dispatcher import MessageDispatcher
+
+EXCLUSIVE_MSG = 'Exclusive'
+PARALLEL_MSG = 'Parallel'
+
+
+class BlockingHandler(object):
+    """
+    A handler that records its work and blocks until released.
+    """
+    def __init__(self, result=True):
+        self.result = result
+        self.work = []
+        self.running = 0
+        self.max_running = 0
+        self.release = threading.Event()
+        self._lock = threading.Lock()
+        self._started = threading.Semaphore(0)
+
+    def __call__(self, work):
+        with self._lock:
+            self.work.append(work)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self._started.release()
+        self.release.wait(5)
+        with self._lock:
+            self.running -= 1
+        return self.result
+
+    def wait_started(self, cnt):
+        return all(self._started.acquire(timeout=5) for _ in range(cnt))
+
+
+class MessageDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+        self.done = MagicMock()
+        self.dispatcher = MessageDispatcher(4, self.done)
+        self.addCleanup(self.dispatcher.shutdown)
+
+    # Work for an exclusive type waits for the running handler; waiting work is merged into a single call.
+    def test_exclusive_type_merges_waiting_work(self):
+        handler = BlockingHandler()
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', handler, max_concurrency=1, merge=lambda a, b: a + b)
+
+        self.assertTrue(self.dispatcher.submit(EXCLUSIVE_MSG, [1], ['m1']))
+        self.assertTrue(handler.wait_started(1))
+        self.assertFalse(self.dispatcher.submit(EXCLUSIVE_MSG, [2], ['m2']))
+        self.assertFalse(self.dispatcher.submit(EXCLUSIVE_MSG, [3], ['m3']))
+        self.assertFalse(self.dispatcher.is_idle())
+
+        handler.release.set()
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertEqual(handler.work, [[1], [2, 3]])
+        self.assertEqual(handler.max_running, 1)
+        self.assertEqual([c[0] for c in self.done.call_args_list], [(['m1'], True), (['m2', 'm3'], True)])
+        self.assertEqual(metrics.REGISTRY.snapshot()['message_handler_seconds{type="exclusive"}']['count'], 2)
+
+    # Work for a type without a merge function waits, in order, for its turn.
+    def test_exclusive_type_without_merge(self):
+        handler = BlockingHandler()
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', handler, max_concurrency=1)
+
+        self.dispatcher.submit(EXCLUSIVE_MSG, 1)
+        self.assertTrue(handler.wait_started(1))
+        self.dispatcher.submit(EXCLUSIVE_MSG, 2)
+        self.dispatcher.submit(EXCLUSIVE_MSG, 3)
+
+        handler.release.set()
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertEqual(handler.work, [1, 2, 3])
+
+    # Other types run in parallel, alongside the exclusive type, up to the number of workers.
+    def test_parallel_types(self):
+        exclusive_handler = BlockingHandler()
+        parallel_handler = BlockingHandler()
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', exclusive_handler, max_concurrency=1)
+        self.dispatcher.register(PARALLEL_MSG, 'parallel', parallel_handler)
+
+        self.dispatcher.submit(EXCLUSIVE_MSG, 0)
+        for i in range(5):
+            self.assertTrue(self.dispatcher.submit(PARALLEL_MSG, i))
+        self.assertTrue(exclusive_handler.wait_started(1))
+        self.assertTrue(parallel_handler.wait_started(3))
+        self.assertEqual(parallel_handler.max_running, 3)  # the exclusive handler has the fourth worker
+
+        exclusive_handler.release.set()
+        parallel_handler.release.set()
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertEqual(sorted(parallel_handler.work), list(range(5)))
+
+    # A handler that fails, by returning False or raising, is reported to done_func as not succeeding.
+    def test_failed_handlers(self):
+        def raise_exc(work):
+            raise Exception("handler failed")
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', lambda work: False)
+        self.dispatcher.register(PARALLEL_MSG, 'parallel', raise_exc)
+
+        self.dispatcher.submit(EXCLUSIVE_MSG, 1, ['m1'])
+        self.dispatcher.submit(PARALLEL_MSG, 2, ['m2'])
+        self.assertTrue(self.dispatcher.drain(5))
+
+        self.assertEqual(sorted(c[0] for c in self.done.call_args_list), [(['m1'], False), (['m2'], False)])
+        snapshot = metrics.REGISTRY.snapshot()
+        self.assertEqual(snapshot['message_handler_failures_total{type="exclusive"}']['value'], 1)
+        self.assertEqual(snapshot['message_handler_failures_total{type="parallel"}']['value'], 1)
+
+    # Draining times out while a handler is still running.
+    def test_drain_timeout(self):
+        handler = BlockingHandler()
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', handler)
+        self.dispatcher.submit(EXCLUSIVE_MSG, 1)
+        self.assertTrue(handler.wait_started(1))
+
+        self.assertFalse(self.dispatcher.drain(0.1))
+        handler.release.set()
+        self.assertTrue(self.dispatcher.drain(5))
+        self.assertTrue(self.dispatcher.is_idle())
+
+    def test_handles(self):
+        self.dispatcher.register(EXCLUSIVE_MSG, 'exclusive', MagicMock())
+        self.assertTrue(self.dispatcher.handles(EXCLUSIVE_MSG))
+        self.assertFalse(self.dispatcher.handles(PARALLEL_MSG))
+
+
+if __name__ == '__main__':
+    unittest.main()
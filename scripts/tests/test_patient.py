@@ -4,7 +4,7 @@ import unittest
 
 from ddt import ddt, data, unpack
 
-from scripts.summary_report_refresher.patient import Patient, convert_date
+from scripts.summary_report_refresher.patient import Patient, convert_date, datetime_to_epoch_ms
 from scripts.tests import patient_data as pd
 
 
@@ -23,6 +23,13 @@ class TestPatient(unittest.TestCase):
         self.assertEqual(p.patientAssignmentIdx, pd.TEST_PATIENT['patientAssignmentIdx'])
         self.assertEqual(p.get_patient_assignment_step_number(), pd.DEFAULT_PAT_ASSNMNT_STEP_NUM)
 
+    # Test that a missing field raises KeyError whether or not it is one of the fields copied by the constructor.
+    @data('treatmentArm', 'notAPatientField')
+    def test_get_missing_field(self, field):
+        p = Patient(pd.TEST_PATIENT_NO_TA)
+        with self.assertRaises(KeyError):
+            getattr(p, field)
+
     # Test the Patient.treatment_arm_version method.
     @data(
         (pd.TEST_PATIENT, pd.PATIENT_TREATMENT_ARM['version']),
@@ -77,6 +84,39 @@ class TestPatient(unittest.TestCase):
         self.assertEqual(date_off, exp_date_off)
         self.assertEqual(status, exp_status)
 
+    # Test that PENDING_CONFIRMATION triggers outside of the assignment window do not start the assignment.
+    @data(
+        (datetime.timedelta(days=-1), pd.ON_ARM_DATE, 'ON_TREATMENT_ARM'),
+        (datetime.timedelta(seconds=299), None, 'PENDING_CONFIRMATION'),
+    )
+    @unpack
+    def test_get_dates_status_from_arm_earlier_assignment(self, earlier_offset, exp_date_on, exp_status):
+        earlier_pending_conf = pd.create_patient_trigger('PENDING_CONFIRMATION',
+                                                         date_created=pd.ASSIGNMENT_DATE + earlier_offset)
+        pending_conf = pd.create_patient_trigger('PENDING_CONFIRMATION', date_created=pd.ASSIGNMENT_DATE)
+        on_arm = pd.create_patient_trigger('ON_TREATMENT_ARM', date_created=pd.ON_ARM_DATE)
+        patient = pd.create_patient(triggers=[pd.REGISTRATION_TRIGGER, earlier_pending_conf, pending_conf, on_arm])
+
+        self.assertEqual(Patient(patient).get_dates_status_from_arm(),
+                         (pd.ASSIGNMENT_DATE, exp_date_on, None, exp_status))
+
+    # Test that triggers without a status or creation date are skipped, with a warning, instead of raising.
+    @data(
+        {'message': 'no status', 'dateCreated': {'$date': 0}},
+        {'patientStatus': 'OFF_TRIAL', 'message': 'no date'},
+        {'patientStatus': 'OFF_TRIAL', 'dateCreated': None},
+    )
+    def test_malformed_trigger(self, malformed_trigger):
+        patient = pd.create_patient(triggers=[pd.REGISTRATION_TRIGGER, pd.PENDING_CONF_TRIGGER, malformed_trigger,
+                                              pd.PENDING_APPR_TRIGGER, pd.ON_ARM_TRIGGER])
+        with self.assertLogs('scripts.summary_report_refresher.patient', 'WARNING'):
+            p = Patient(patient)
+
+        self.assertEqual(p.find_trigger_by_status('ON_TREATMENT_ARM'), pd.ON_ARM_TRIGGER)
+        self.assertIsNone(p.find_trigger_by_status('OFF_TRIAL'))
+        self.assertEqual(p.get_dates_status_from_arm(),
+                         (pd.ASSIGNMENT_DATE, pd.ON_ARM_DATE, None, 'ON_TREATMENT_ARM'))
+
     # Test Patient._trigger_belongs_to_assignment method.
     @data(
         (pd.PENDING_CONF_TRIGGER, pd.PENDING_CONF_DATE, True),
@@ -139,6 +179,11 @@ class TestConvertDate(unittest.TestCase):
         ts = pd.datetime_to_timestamp(dt)
         self.assertEqual(convert_date(ts), dt)
 
+    def test_milliseconds(self):
+        dt = datetime.datetime(2016, 11, 1, 12, 30, 15, 123000)
+        self.assertEqual(convert_date({'$date': datetime_to_epoch_ms(dt)}), dt)
+        self.assertEqual(datetime_to_epoch_ms(dt), 1478003415123)
+
     def test_exc(self):
         with self.assertRaises(TypeError):
             convert_date(pd.PENDING_CONF_DATE)
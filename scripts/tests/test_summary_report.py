@@ -183,6 +183,21 @@ class TestSummaryReport(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(result, exp_result)
 
+    def test_compute_fingerprint(self):
+        sr = SummaryReport(create_ta_json())
+        sr.add_patient_by_type(SummaryReport.CURRENT, CURRENTLY_ON_TA_ASSMT_REC)
+        sr_json = sr.get_json()
+        fingerprint = SummaryReport.compute_fingerprint(sr_json)
+
+        reordered_json = dict(reversed(list(sr_json.items())))
+        self.assertEqual(SummaryReport.compute_fingerprint(reordered_json), fingerprint)
+        self.assertNotEqual(SummaryReport.compute_fingerprint(dict(sr_json, numFormerPatients=1)), fingerprint)
+
+    def test_get_stored_fingerprint(self):
+        self.assertIsNone(SummaryReport(create_ta_json()).get_stored_fingerprint())
+        ta_json = dict(create_ta_json(), summaryReportFingerprint='abc123')
+        self.assertEqual(SummaryReport(ta_json).get_stored_fingerprint(), 'abc123')
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -6,6 +6,7 @@ from datetime import datetime
 from ddt import ddt, data, unpack
 from mock import patch, MagicMock
 
+from helpers import tracing
 from scripts.summary_report_refresher.assignment_record import AssignmentRecord
 from scripts.summary_report_refresher.patient import Patient, convert_date
 from scripts.summary_report_refresher.refresher import Refresher
@@ -56,6 +57,15 @@ DATE_NOW = datetime(2016, 11, 1)  # used for mocking datetime.now()
 # ******** Test the Refresher class in refresher.py. ******** #
 @ddt
 class RefresherTest(unittest.TestCase):
+    def setUp(self):
+        env_patcher = patch('scripts.summary_report_refresher.refresher.Environment')
+        self.addCleanup(env_patcher.stop)
+        self.mock_env = env_patcher.start().return_value
+        self.mock_env.refresher_concurrency = 3
+        self.mock_env.patient_api_bulk_fetch = False
+        self.mock_env.patient_api_bulk_batch_size = 2
+        self.mock_env.refresher_write_batch_size = 2
+
     # Test the Refresher._match method.
     @data(
         (None, False),
@@ -141,42 +151,46 @@ class RefresherTest(unittest.TestCase):
 
         # Set up the mocked PatientAccessor
         pa_instance = mock_patient_accessor.return_value
-        pa_instance.get_patients_by_treatment_arm_id.return_value = patients
-
-        # Set up the mocked TreatmentArmsAccessor
-        taa_instance = mock_ta_accessor.return_value
-        taa_instance.update_summary_report = lambda _id, json: self.assertEqual(json, expected_sum_rpt_json)
+        pa_instance.iter_patients_by_treatment_arm_id.return_value = iter(patients)
 
         # Set up the mocked create_authentication_token method
         mock_create_token.return_value = "Bearer my_fake_authentication_token"
 
         sum_rpt = SummaryReport(ta_data_for_sum_rpt)
         r = Refresher()
-        r._update_summary_report(sum_rpt)
+        self.assertEqual(r._update_summary_report(sum_rpt), expected_sum_rpt_json)
+        mock_ta_accessor.return_value.update_summary_report.assert_not_called()  # written in bulk by run
 
     # Test the Refresher.run method.
     @data(
-        ([True, True, True]),
-        ([True, False, True, True]),
+        ([True, True, True], [[True, True], [True]]),
+        ([True, False, True, True], [[True, False], [True, True]]),
+        ([True, True, True, True, True], [[True, True], [True, True], [True]]),
     )
+    @unpack
     @patch('scripts.summary_report_refresher.refresher.logging')
     @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
     @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
     @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
-    def test_run(self, update_summary_rpt_rets, mock_ta_accessor, mock_patient_accessor, mock_create_token, mock_logging):
+    def test_run(self, update_summary_rpt_rets, exp_bulk_writes, mock_ta_accessor, mock_patient_accessor,
+                 mock_create_token, mock_logging):
         self.maxDiff = None
 
         # Set up the mocked TreatmentArmsAccessor
         taa_instance = mock_ta_accessor.return_value
         taa_instance.get_arms_for_summary_report_refresh.return_value = [DEFAULT_TA] * len(update_summary_rpt_rets)
+        taa_instance.update_summary_reports.side_effect = exp_bulk_writes
 
         # Set up the mocked create_authentication_token method
         mock_create_token.return_value = "Bearer my_fake_authentication_token"
 
         r = Refresher()
-        r._update_summary_report = MagicMock(side_effect=update_summary_rpt_rets)
+        r._update_summary_report = MagicMock(return_value=create_sr_json())
         r.run()
 
+        # The refreshed summary reports are written in batches of refresher_write_batch_size.
+        self.assertEqual([len(c[0][0]) for c in taa_instance.update_summary_reports.call_args_list],
+                         [len(w) for w in exp_bulk_writes])
         mock_logger = mock_logging.getLogger()
         mock_logger.info.assert_called()
         if False in update_summary_rpt_rets:
@@ -186,6 +200,232 @@ class RefresherTest(unittest.TestCase):
             mock_logger.error.assert_not_called()
             # mock_logger.exception.assert_not_called()
 
+    # Test that an exception while refreshing one summary report does not stop the others from being refreshed.
+    @patch('scripts.summary_report_refresher.refresher.logging')
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_run_with_exc(self, mock_ta_accessor, mock_patient_accessor, mock_create_token, mock_logging):
+        update_summary_rpt_rets = [{}, Exception("Patient API unavailable"), {}, {}]
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arms_for_summary_report_refresh.return_value = [DEFAULT_TA] * len(update_summary_rpt_rets)
+        taa_instance.update_summary_reports.side_effect = [[True, False], [True]]
+
+        r = Refresher()
+        r._update_summary_report = MagicMock(side_effect=update_summary_rpt_rets)
+        self.assertEqual(r.run(), 2)
+
+        self.assertEqual(r._update_summary_report.call_count, len(update_summary_rpt_rets))
+        mock_logger = mock_logging.getLogger()
+        mock_logger.exception.assert_called_once()
+        mock_logger.error.assert_any_call("Only 2/4 summary reports updated")
+
+    # Test that a failed bulk write is counted as a failure of each of its summary reports.
+    @patch('scripts.summary_report_refresher.refresher.logging')
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_run_with_write_exc(self, mock_ta_accessor, mock_patient_accessor, mock_create_token, mock_logging):
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arms_for_summary_report_refresh.return_value = [DEFAULT_TA] * 3
+        taa_instance.update_summary_reports.side_effect = [Exception("connection reset"), [True]]
+
+        r = Refresher()
+        r._update_summary_report = MagicMock(return_value={})
+        self.assertEqual(r.run(), 2)
+
+        mock_logger = mock_logging.getLogger()
+        mock_logger.exception.assert_called_once()
+        mock_logger.error.assert_any_call("Only 1/3 summary reports updated")
+
+    # Test that summary reports whose fingerprint has not changed are not written.
+    @patch('scripts.summary_report_refresher.refresher.logging')
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_run_skips_unchanged(self, mock_ta_accessor, mock_patient_accessor, mock_create_token, mock_logging):
+        sr_json = create_sr_json(numCurrentPatientsOnArm=1)
+        fingerprint = SummaryReport.compute_fingerprint(sr_json)
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arms_for_summary_report_refresh.return_value = [
+            dict(DEFAULT_TA, treatmentArmId='EAY131-A', summaryReportFingerprint=fingerprint),
+            dict(DEFAULT_TA, treatmentArmId='EAY131-B', summaryReportFingerprint='stale'),
+            dict(DEFAULT_TA, treatmentArmId='EAY131-C'),
+        ]
+        taa_instance.update_summary_reports.side_effect = lambda updates: [True] * len(updates)
+
+        r = Refresher()
+        r._update_summary_report = MagicMock(return_value=sr_json)
+        self.assertEqual(r.run(), 0)
+
+        written = [update for c in taa_instance.update_summary_reports.call_args_list for update in c[0][0]]
+        self.assertEqual(written, [(DEFAULT_TA['_id'], sr_json, fingerprint)] * 2)
+        mock_logger = mock_logging.getLogger()
+        mock_logger.error.assert_not_called()
+        mock_logger.info.assert_any_call("2 summary reports written; 1 unchanged summary reports skipped")
+        mock_logger.info.assert_any_call("All 3 summary reports were updated.")
+
+    # Test that the cached documents of the arms are invalidated when they change or their summary reports are written.
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmCache')
+    @patch('scripts.summary_report_refresher.refresher.logging')
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_run_invalidates_cache(self, mock_ta_accessor, mock_patient_accessor, mock_create_token, mock_logging,
+                                   mock_cache):
+        arms = [dict(DEFAULT_TA, treatmentArmId='EAY131-A'), dict(DEFAULT_TA, treatmentArmId='EAY131-B')]
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arms_for_summary_report_refresh.return_value = arms
+        taa_instance.update_summary_reports.return_value = [False, True]
+
+        r = Refresher(concurrency=1)
+        mock_cache.observe_state_tokens.assert_called_once_with(arms)
+        r._update_summary_report = MagicMock(side_effect=[create_sr_json(), create_sr_json()])
+        r.run()
+
+        mock_cache.invalidate_arms.assert_called_once_with(['EAY131-B'])
+
+    # Test the Refresher.run method with bulk retrieval of patients.
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_run_with_bulk_fetch(self, mock_ta_accessor, mock_patient_accessor, mock_create_token):
+        arm_ids = ['EAY131-A', 'EAY131-B', 'EAY131-C', 'EAY131-D', 'EAY131-E']
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arms_for_summary_report_refresh.return_value = \
+            [dict(DEFAULT_TA, treatmentArmId=arm_id) for arm_id in arm_ids]
+        taa_instance.update_summary_reports.side_effect = lambda updates: [True] * len(updates)
+
+        def failing_stream():
+            yield 'EAY131-C', pd.CURRENT_PATIENT
+            raise Exception("connection reset")
+
+        # The second batch fails part way through, so its arms must fall back to retrieving their own patients.
+        pa_instance = mock_patient_accessor.return_value
+        pa_instance.iter_patients_by_treatment_arm_ids.side_effect = [
+            iter([('EAY131-A', pd.CURRENT_PATIENT), ('EAY131-A', pd.CURRENT_PATIENT), ('EAY131-B', pd.FORMER_PATIENT)]),
+            failing_stream(),
+            iter([('EAY131-E', pd.PENDING_PATIENT)]),
+        ]
+        pa_instance.iter_patients_by_treatment_arm_id.side_effect = \
+            lambda trtmt_id, token: iter([pd.FORMER_PATIENT] if trtmt_id == 'EAY131-D' else [])
+
+        r = Refresher(bulk_fetch=True)
+        r.run()
+
+        self.assertEqual([c[0][0] for c in pa_instance.iter_patients_by_treatment_arm_ids.call_args_list],
+                         [['EAY131-A', 'EAY131-B'], ['EAY131-C', 'EAY131-D'], ['EAY131-E']])
+        self.assertEqual(sorted([c[0][0] for c in pa_instance.iter_patients_by_treatment_arm_id.call_args_list]),
+                         ['EAY131-C', 'EAY131-D'])
+        counts = dict([(sr.treatmentArmId, (sr.numCurrentPatientsOnArm, sr.numFormerPatients,
+                                            sr.numPendingArmApproval)) for sr in r.summary_rpts])
+        self.assertEqual(counts, {'EAY131-A': (1, 0, 0), 'EAY131-B': (0, 1, 0), 'EAY131-C': (0, 0, 0),
+                                   'EAY131-D': (0, 1, 0), 'EAY131-E': (0, 0, 1)})
+
+    # Test the Refresher._match_streamed_patients method with the patients of several arms interleaved in the stream.
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_match_streamed_patients(self, mock_ta_accessor, mock_patient_accessor, mock_create_token):
+        sum_rpts = [SummaryReport(dict(DEFAULT_TA, treatmentArmId=arm_id)) for arm_id in ['EAY131-A', 'EAY131-B']]
+        pa_instance = mock_patient_accessor.return_value
+        pa_instance.iter_patients_by_treatment_arm_ids.return_value = iter([
+            ('EAY131-A', pd.CURRENT_PATIENT), ('EAY131-B', pd.FORMER_PATIENT),
+            ('EAY131-A', pd.CURRENT_PATIENT), ('EAY131-A', pd.PENDING_PATIENT),
+        ])
+
+        Refresher()._match_streamed_patients(sum_rpts)
+
+        pa_instance.iter_patients_by_treatment_arm_ids.assert_called_once_with(['EAY131-A', 'EAY131-B'],
+                                                                               mock_create_token.return_value)
+        pa_instance.iter_patients_by_treatment_arm_id.assert_not_called()
+        counts = [(sr.numCurrentPatientsOnArm, sr.numFormerPatients, sr.numPendingArmApproval) for sr in sum_rpts]
+        self.assertEqual(counts, [(1, 0, 1), (0, 1, 0)])
+
+    # Test that Refresher._update_summary_report records a tracing span for the arm.
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_update_summary_report_span(self, mock_ta_accessor, mock_patient_accessor, mock_create_token):
+        mock_patient_accessor.return_value.iter_patients_by_treatment_arm_id.return_value = \
+            iter([pd.CURRENT_PATIENT, pd.FORMER_PATIENT])
+        exporter = MagicMock()
+        with patch.object(tracing.TRACER, 'exporter', exporter):
+            Refresher()._update_summary_report(SummaryReport(DEFAULT_TA))
+
+        span = exporter.export.call_args[0][0]
+        self.assertEqual(span.name, 'Refresher.update_summary_report')
+        self.assertEqual(span.attributes, {'treatmentArmId': DEFAULT_TA['treatmentArmId'],
+                                           'version': DEFAULT_TA['version'],
+                                           'patient.count': 2})
+
+    # Test that Refresher._match_streamed_patients records the same tracing span for each arm as the per-arm path.
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_match_streamed_patients_spans(self, mock_ta_accessor, mock_patient_accessor, mock_create_token):
+        sum_rpts = [SummaryReport(dict(DEFAULT_TA, treatmentArmId=arm_id)) for arm_id in ['EAY131-A', 'EAY131-B']]
+        mock_patient_accessor.return_value.iter_patients_by_treatment_arm_ids.return_value = iter([
+            ('EAY131-A', pd.CURRENT_PATIENT), ('EAY131-A', pd.FORMER_PATIENT), ('EAY131-A', pd.PENDING_PATIENT),
+        ])
+        exporter = MagicMock()
+        with patch.object(tracing.TRACER, 'exporter', exporter):
+            with tracing.start_span('Refresher.refresh_batch') as batch_span:
+                Refresher()._match_streamed_patients(sum_rpts)
+
+        spans = [c[0][0] for c in exporter.export.call_args_list]
+        self.assertEqual([span.name for span in spans], ['Refresher.update_summary_report'] * 2 +
+                         ['Refresher.refresh_batch'])
+        self.assertEqual(sorted([span.attributes for span in spans[:2]], key=lambda a: a['treatmentArmId']),
+                         [{'treatmentArmId': 'EAY131-A', 'version': DEFAULT_TA['version'], 'patient.count': 3},
+                          {'treatmentArmId': 'EAY131-B', 'version': DEFAULT_TA['version'], 'patient.count': 0}])
+        self.assertEqual([span.parent_id for span in spans[:2]], [batch_span.span_id] * 2)
+
+    # Test the Refresher constructor's selection of arms for full and incremental refreshes.
+    @data(
+        (None, None, [], None),
+        (['EAY131-B', 'EAY131-A'], None, [], ['EAY131-A', 'EAY131-B']),
+        (['EAY131-C', 'EAY131-A'], ['14442', '14443'], ['EAY131-B', 'EAY131-C'], ['EAY131-A', 'EAY131-B', 'EAY131-C']),
+        # the patient has just been assigned to EAY131-D, whose summary report does not contain the patient yet
+        (['EAY131-D'], ['14442'], ['EAY131-C'], ['EAY131-C', 'EAY131-D']),
+        (['EAY131-D'], ['99999'], [], ['EAY131-D']),
+        # without any arms, the arms that the patients have just been assigned to are unknown
+        (None, ['14442'], ['EAY131-C'], None),
+        ([], ['14442'], ['EAY131-C'], None),
+    )
+    @unpack
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_select_arms(self, treatment_arm_ids, patient_seq_nums, patient_arm_ids, exp_arm_ids,
+                         mock_ta_accessor, mock_patient_accessor, mock_create_token):
+        taa_instance = mock_ta_accessor.return_value
+        taa_instance.get_arm_ids_for_patients.return_value = patient_arm_ids
+        taa_instance.get_arms_for_summary_report_refresh.return_value = [DEFAULT_TA]
+
+        r = Refresher(treatment_arm_ids=treatment_arm_ids, patient_seq_nums=patient_seq_nums)
+        taa_instance.get_arms_for_summary_report_refresh.assert_called_once_with(exp_arm_ids)
+        self.assertEqual(len(r.summary_rpts), 1)
+        if patient_seq_nums and treatment_arm_ids:
+            taa_instance.get_arm_ids_for_patients.assert_called_once_with(patient_seq_nums)
+        else:
+            taa_instance.get_arm_ids_for_patients.assert_not_called()
+
+    # Test the Refresher constructor's handling of the concurrency limit.
+    @data(
+        (None, 3),
+        (5, 5),
+        ('6', 6),
+        (0, 3),
+    )
+    @unpack
+    @patch('scripts.summary_report_refresher.refresher.create_authentication_token')
+    @patch('scripts.summary_report_refresher.refresher.PatientAccessor')
+    @patch('scripts.summary_report_refresher.refresher.TreatmentArmsAccessor')
+    def test_concurrency(self, concurrency, exp_concurrency, mock_ta_accessor, mock_patient_accessor,
+                         mock_create_token):
+        self.assertEqual(Refresher(concurrency).concurrency, exp_concurrency)
+
     # Test the Refresher._determine_patient_classification_by_dates method.
     @data(
         (None, None, None, None, None),
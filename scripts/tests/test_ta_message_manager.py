@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 
 import logging
+import threading
+import time
 import unittest
 
 from ddt import ddt, data, unpack
 from mock import patch, MagicMock
 
 from scripts.ta_message_manager import ta_message_manager as mm
+from scripts.tests.fake_sqs import FakeSqsClient
 
 logging.getLogger('botocore').propagate = False  # Disable boto logging for unit tests.
 
 TEST_QUEUE_URL = 'https://queue.amazonaws.com/127516845550/TreatmentArmQueue'
 TEST_QUEUE_NAME = 'TreatmentArmQueue'
 TEST_SLEEP_TIME = 25
+TEST_FULL_REFRESH_INTERVAL = 3600
 
 @ddt
 class TreatmentArmsMessageManagerTestCase(unittest.TestCase):
@@ -33,6 +37,19 @@ class TreatmentArmsMessageManagerTestCase(unittest.TestCase):
         self.mock_env = env_patcher.start().return_value
         self.mock_env.sqs_queue_name = TEST_QUEUE_NAME
         self.mock_env.polling_interval = TEST_SLEEP_TIME
+        self.mock_env.full_refresh_interval = TEST_FULL_REFRESH_INTERVAL
+        self.mock_env.sqs_wait_time_seconds = 20
+        self.mock_env.sqs_max_messages = 10
+        self.mock_env.sqs_max_drain_batches = 3
+        self.mock_env.sqs_visibility_timeout = 300
+        self.mock_env.sqs_heartbeat_interval = 60
+
+        schedule_patcher = patch('scripts.ta_message_manager.ta_message_manager.RefreshScheduleAccessor')
+        self.addCleanup(schedule_patcher.stop)
+        self.mock_schedule = schedule_patcher.start().return_value
+        self.mock_env.sqs_max_receive_count = 3
+        self.mock_env.sqs_dead_letter_queue_name = TEST_QUEUE_NAME + '-dlq'
+        self.mock_env.message_handler_workers = 4
 
     # Test the TreatmentArmsMessageManager constructor method.
     def test_constructor(self):
@@ -47,49 +64,288 @@ class TreatmentArmsMessageManagerTestCase(unittest.TestCase):
         self.mock_logger.info.assert_called_once()
 
     # Test the TreatmentArmsMessageManager run method.
-    def test_run(self):
+    @data(
+        (20, 0),
+        (0, 2),
+    )
+    @unpack
+    @patch('scripts.ta_message_manager.ta_message_manager.time.sleep')
+    def test_run(self, wait_time, exp_sleeps, mock_sleep):
+        self.mock_env.sqs_wait_time_seconds = wait_time
         queue_instance = self.mock_queue.return_value
-        message = {'Messages': ['1']}
-        no_message = {}
-        queue_instance.receive_message.side_effect = [no_message, message, message, no_message, message]
+        message = {'Body': mm.REFRESH_MSG}
+        # Each non-empty receive is followed by a drain that finds the queue empty.
+        queue_instance.receive_messages.side_effect = [[], [message, message], [], [message], [], [], [message], []]
 
-        mock_handle_message = MagicMock(side_effect=[False, False, True])
+        mock_handle_messages = MagicMock(side_effect=[False, False, True])
 
         tamm = mm.TreatmentArmMessageManager(1)
-        tamm._handle_message = mock_handle_message
+        tamm._handle_messages = mock_handle_messages
+        tamm._schedule_full_refresh = MagicMock()
         tamm.run()
 
-        self.assertEqual(mock_handle_message.call_count, 3)  # should only be called when there is a message
+        self.assertEqual(tamm._schedule_full_refresh.call_count, 5)  # before every receive that is not a drain
+
+        self.assertEqual(mock_handle_messages.call_count, 3)  # should only be called when there are messages
+        self.assertEqual(mock_handle_messages.call_args_list[0][0][0], [message, message])
+        attribute_names = ['SentTimestamp', 'ApproximateReceiveCount']
+        queue_instance.receive_messages.assert_any_call(attribute_names, 10, wait_time, 300)
+        queue_instance.receive_messages.assert_called_with(attribute_names, 10, 0, 300)
+        self.assertEqual(mock_sleep.call_count, exp_sleeps)  # only sleeps between empty short polls
+
+    # Test the TreatmentArmsMessageManager _drain method.
+    @data(
+        ([[]], 1, 1),
+        ([[{'Body': mm.REFRESH_MSG}] * 10, [{'Body': mm.REFRESH_MSG}] * 3, []], 14, 3),
+        ([[{'Body': mm.REFRESH_MSG}, {'Body': mm.STOP_MSG}], [{'Body': mm.REFRESH_MSG}]], 3, 1),
+        # a steady stream of messages is drained at most sqs_max_drain_batches times
+        ([[{'Body': mm.REFRESH_MSG}] * 10] * 5, 31, 3),
+    )
+    @unpack
+    def test_drain(self, receives, exp_message_cnt, exp_receive_cnt):
+        queue_instance = self.mock_queue.return_value
+        queue_instance.receive_messages.side_effect = receives
+
+        tamm = mm.TreatmentArmMessageManager()
+        messages = tamm._drain([{'Body': mm.REFRESH_MSG}])
+
+        self.assertEqual(len(messages), exp_message_cnt)
+        self.assertEqual(queue_instance.receive_messages.call_count, exp_receive_cnt)
 
-    # Test the TreatmentArmsMessageManager _handle_message method.
+    # Test the TreatmentArmsMessageManager _handle_messages method.
     @data(
-        (mm.REFRESH_MSG, False, False),
-        (mm.STOP_MSG, True, False),
-        ("UnknownMessage", False, True),
+        ([mm.REFRESH_MSG, mm.REFRESH_MSG], False, 2),
+        ([mm.REFRESH_MSG, mm.STOP_MSG, mm.REFRESH_MSG], True, 2),
+        ([mm.STOP_MSG], True, 1),
     )
     @unpack
-    def test_handle_message(self, msg, exp_ret_val, exp_error):
+    def test_handle_messages(self, msg_bodies, exp_ret_val, exp_handled_cnt):
         queue_instance = self.mock_queue.return_value
+        messages = [{'Body': body, 'MessageId': str(i), 'ReceiptHandle': 'rh' + str(i)}
+                    for i, body in enumerate(msg_bodies)]
+        queue_instance.delete_messages.side_effect = lambda msgs: [(msgs[0], 'ReceiptHandleIsInvalid')]
+        queue_instance.change_visibility.return_value = []
 
         tamm = mm.TreatmentArmMessageManager()
-        tamm._refresh_summary_report = MagicMock()
-        ret_val = tamm._handle_message({'Body': msg})
+        tamm.dispatcher.submit = MagicMock()
+        tamm.dispatcher.drain = MagicMock()
+        tamm.heartbeat = MagicMock()
+        ret_val = tamm._handle_messages(messages)
 
         self.assertEqual(ret_val, exp_ret_val)
-        self.assertEqual(queue_instance.delete_message.call_count, 1)
+        handled = messages[:exp_handled_cnt]
+        refresh_messages = [m for m in handled if m['Body'] == mm.REFRESH_MSG]
+        # Only the STOP message is deleted right away; the refresh messages are held until their refresh is done.
+        stop_messages = [m for m in handled if m['Body'] == mm.STOP_MSG]
+        if stop_messages:
+            queue_instance.delete_messages.assert_called_once_with(stop_messages)
+            self.mock_logger.error.assert_called_once_with(
+                "Failed to delete message {}: ReceiptHandleIsInvalid".format(stop_messages[0]['MessageId']))
+        else:
+            queue_instance.delete_messages.assert_not_called()
+        # Messages after the STOP message are made visible again.
+        if exp_ret_val:
+            queue_instance.change_visibility.assert_called_once_with(messages[exp_handled_cnt:], 0)
+        else:
+            queue_instance.change_visibility.assert_not_called()
+        # All of the refresh requests are collapsed into a single refresh.
+        if refresh_messages:
+            tamm.heartbeat.hold.assert_called_once_with(refresh_messages)
+            tamm.dispatcher.submit.assert_called_once()
+            self.assertEqual(tamm.dispatcher.submit.call_args[0][2], refresh_messages)
+        else:
+            tamm.dispatcher.submit.assert_not_called()
+        self.assertEqual(tamm.dispatcher.drain.call_count, 1 if exp_ret_val else 0)
+
+    # Test that messages received too many times are moved to the dead-letter queue.
+    def test_handle_messages_dead_letter(self):
+        queue_instance = self.mock_queue.return_value
+        queue_instance.delete_messages.return_value = []
+        message = {'Body': mm.REFRESH_MSG, 'MessageId': '1', 'ReceiptHandle': 'rh1',
+                   'Attributes': {'ApproximateReceiveCount': '4'}}
+
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.dispatcher.submit = MagicMock()
+        tamm.dispatcher.drain = MagicMock()
+        self.assertFalse(tamm._handle_messages([message]))
+
+        self.mock_queue.assert_called_with(TEST_QUEUE_NAME + '-dlq')
+        queue_instance.send_message.assert_called_once_with(mm.REFRESH_MSG)
+        queue_instance.delete_messages.assert_called_once_with([message])
+        tamm.dispatcher.submit.assert_not_called()
+
+    # Test the TreatmentArmsMessageManager _finish_messages method.
+    @data(
+        (True, True),
+        (False, False),
+    )
+    @unpack
+    def test_finish_messages(self, succeeded, exp_deleted):
+        queue_instance = self.mock_queue.return_value
+        queue_instance.delete_messages.return_value = []
+        messages = [{'Body': mm.REFRESH_MSG, 'MessageId': '1', 'ReceiptHandle': 'rh1'}]
+
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.heartbeat = MagicMock()
+        tamm._finish_messages(messages, succeeded)
+
+        tamm.heartbeat.release.assert_called_once_with(messages)
+        self.assertEqual(queue_instance.delete_messages.call_count, 1 if exp_deleted else 0)
+
+    # Test the TreatmentArmsMessageManager _handle_messages method with each type of message.
+    @data(
+        (mm.REFRESH_MSG, False, False, set()),
+        (mm.STOP_MSG, True, False, None),
+        ("UnknownMessage", False, True, None),
+        (mm.create_refresh_message(['EAY131-A']), False, False, {'EAY131-A'}),
+        ('{"message": "UnknownMessage"}', False, True, None),
+    )
+    @unpack
+    def test_handle_message(self, msg, exp_ret_val, exp_error, exp_refresh_arm_ids):
+        queue_instance = self.mock_queue.return_value
+        queue_instance.delete_messages.return_value = []
+
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.dispatcher.submit = MagicMock()
+        tamm.dispatcher.drain = MagicMock()
+        tamm.heartbeat = MagicMock()
+        ret_val = tamm._handle_messages([{'Body': msg, 'MessageId': '1', 'ReceiptHandle': 'rh'}])
+
+        self.assertEqual(ret_val, exp_ret_val)
+        if exp_refresh_arm_ids is None:
+            tamm.dispatcher.submit.assert_not_called()
+        else:
+            refresh_request = tamm.dispatcher.submit.call_args[0][1]
+            self.assertEqual(refresh_request.treatment_arm_ids, exp_refresh_arm_ids)
 
         if exp_error:
             self.mock_logger.error.assert_called_once()
         else:
             self.mock_logger.error.assert_not_called()
 
-    # Test the TreatmentArmsMessageManager _refresh_summary_report method with normal execution.
+    # Test that messages other than refreshes are dispatched one by one and that the queue lag is recorded.
+    @patch('scripts.ta_message_manager.ta_message_manager.time.time')
+    def test_handle_messages_status(self, mock_time):
+        mock_time.return_value = 1500000010.0
+        messages = [{'Body': mm.STATUS_MSG, 'MessageId': str(i), 'ReceiptHandle': 'rh' + str(i),
+                     'Attributes': {'SentTimestamp': '1500000000000'}} for i in range(2)]
+
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.dispatcher.submit = MagicMock()
+        tamm.heartbeat = MagicMock()
+        lag_count = tamm.lag_timer.count
+        self.assertFalse(tamm._handle_messages(messages))
+
+        tamm.heartbeat.hold.assert_called_once_with(messages)
+        self.assertEqual(tamm.dispatcher.submit.call_args_list,
+                         [((mm.STATUS_MSG, {}, [m]),) for m in messages])
+        self.assertEqual(tamm.lag_timer.count, lag_count + 2)
+        self.mock_queue.return_value.delete_messages.assert_not_called()
+
+    # Test the TreatmentArmsMessageManager _report_status method.
+    def test_report_status(self):
+        tamm = mm.TreatmentArmMessageManager()
+        self.assertTrue(tamm._report_status(dict()))
+        self.assertIn("0 message(s) held", self.mock_logger.info.call_args[0][0])
+
+    # Test that refresh requests are coalesced:  RefreshRequest.merge.
+    @data(
+        (mm.RefreshRequest(['EAY131-A']), mm.RefreshRequest(['EAY131-B'], ['14442']), {'EAY131-A', 'EAY131-B'},
+         {'14442'}),
+        (mm.RefreshRequest(['EAY131-A']), mm.RefreshRequest(), set(), set()),
+        (mm.RefreshRequest(), mm.RefreshRequest(None, ['14442']), set(), set()),
+        (mm.RefreshRequest(['EAY131-A']), mm.RefreshRequest(None, ['14442']), set(), set()),
+    )
+    @unpack
+    def test_refresh_request_merge(self, request1, request2, exp_arm_ids, exp_patient_seq_nums):
+        merged = request1.merge(request2)
+        self.assertEqual(merged.treatment_arm_ids, exp_arm_ids)
+        self.assertEqual(merged.patient_seq_nums, exp_patient_seq_nums)
+
+    # Test the TreatmentArmsMessageManager _refresh_summary_report method with normal execution and with summary
+    # reports that could not be refreshed.
+    @data(
+        (0, 0),
+        (2, 1),
+    )
+    @unpack
     @patch('scripts.ta_message_manager.ta_message_manager.Refresher')
-    def test_refresh_summary_report(self, mock_refresher):
+    def test_refresh_summary_report(self, failed_cnt, exp_ret_code, mock_refresher):
+        mock_refresher.return_value.run.return_value = failed_cnt
         tamm = mm.TreatmentArmMessageManager()
 
         ret_code = tamm._refresh_summary_report()
-        self.assertEqual(ret_code, 0)
+        self.assertEqual(ret_code, exp_ret_code)
+        if failed_cnt:
+            self.mock_logger.error.assert_called_once_with("2 summary reports could not be refreshed")
+        else:
+            self.mock_logger.error.assert_not_called()
+
+    # Test the TreatmentArmsMessageManager _refresh_summary_report method with full and incremental requests.
+    @data(
+        # 1. no request is a full refresh
+        (None, None, True),
+        # 2. an incremental request
+        (mm.RefreshRequest(['EAY131-A']), {'EAY131-A'}, False),
+        # 3. an incremental request with patients
+        (mm.RefreshRequest(['EAY131-A'], ['14442']), {'EAY131-A'}, False),
+        # 4. a request without any arms or patients is a full refresh
+        (mm.RefreshRequest([], []), None, True),
+        # 5. a request with patients but no arms is a full refresh
+        (mm.RefreshRequest(None, ['14442']), None, True),
+    )
+    @unpack
+    @patch('scripts.ta_message_manager.ta_message_manager.Refresher')
+    def test_refresh_summary_report_type(self, refresh_request, exp_arm_ids, exp_full, mock_refresher):
+        mock_refresher.return_value.run.return_value = 0
+        tamm = mm.TreatmentArmMessageManager()
+
+        self.assertEqual(tamm._refresh_summary_report(refresh_request), 0)
+        if exp_full:
+            mock_refresher.assert_called_once_with()
+        else:
+            mock_refresher.assert_called_once_with(treatment_arm_ids=exp_arm_ids,
+                                                   patient_seq_nums=refresh_request.patient_seq_nums)
+        mock_refresher.return_value.run.assert_called_once_with()
+        self.mock_schedule.claim_full_refresh.assert_not_called()
+
+    # Test the TreatmentArmsMessageManager _schedule_full_refresh method.
+    @data(
+        # 1. claimed by this message manager
+        ((True, 1001), True, 1001 + TEST_FULL_REFRESH_INTERVAL),
+        # 2. claimed by another message manager; check again when its full refresh is next due
+        ((False, 1000), False, 1000 + TEST_FULL_REFRESH_INTERVAL),
+        # 3. not claimed and overdue (e.g. the schedule was just created by another manager); check after a sleep
+        ((False, 1001 - 2 * TEST_FULL_REFRESH_INTERVAL), False, 1001 + TEST_SLEEP_TIME),
+        # 4. the schedule could not be read
+        (Exception('connection refused'), False, 1001 + TEST_SLEEP_TIME),
+    )
+    @unpack
+    @patch('scripts.ta_message_manager.ta_message_manager.time')
+    def test_schedule_full_refresh(self, claim_result, exp_scheduled, exp_next_check, mock_time):
+        mock_time.time.return_value = 1001
+        if isinstance(claim_result, Exception):
+            self.mock_schedule.claim_full_refresh.side_effect = claim_result
+        else:
+            self.mock_schedule.claim_full_refresh.return_value = claim_result
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.dispatcher = MagicMock()
+
+        tamm._schedule_full_refresh()
+        self.mock_schedule.claim_full_refresh.assert_called_once_with(TEST_FULL_REFRESH_INTERVAL)
+        if exp_scheduled:
+            tamm.dispatcher.submit.assert_called_once()
+            msg_type, refresh_request = tamm.dispatcher.submit.call_args[0]
+            self.assertEqual(msg_type, mm.REFRESH_MSG)
+            self.assertTrue(refresh_request.is_full)
+        else:
+            tamm.dispatcher.submit.assert_not_called()
+        self.assertEqual(tamm.next_full_refresh_check, exp_next_check)
+
+        # The schedule is not checked again until the next check is due.
+        mock_time.time.return_value = exp_next_check - 1
+        tamm._schedule_full_refresh()
+        self.mock_schedule.claim_full_refresh.assert_called_once_with(TEST_FULL_REFRESH_INTERVAL)
 
     # Test the TreatmentArmsMessageManager _refresh_summary_report method with exception.
     @patch('scripts.ta_message_manager.ta_message_manager.Refresher')
@@ -107,5 +363,170 @@ class TreatmentArmsMessageManagerTestCase(unittest.TestCase):
         self.mock_queue.return_value.send_message.assert_called_with(mm.STOP_MSG)
 
 
+    # Test the parse_message function.
+    @data(
+        (mm.REFRESH_MSG, mm.REFRESH_MSG, {}),
+        (mm.STOP_MSG, mm.STOP_MSG, {}),
+        ('12', '12', {}),
+        ('{"message": "RefreshSummaryReport", "treatmentArmIds": ["EAY131-A"]}', mm.REFRESH_MSG,
+         {"message": "RefreshSummaryReport", "treatmentArmIds": ["EAY131-A"]}),
+        ('{"treatmentArmIds": ["EAY131-A"]}', '{"treatmentArmIds": ["EAY131-A"]}', {}),
+    )
+    @unpack
+    def test_parse_message(self, msg_body, exp_msg, exp_payload):
+        self.assertEqual(mm.parse_message(msg_body), (exp_msg, exp_payload))
+
+    # Test the create_refresh_message function.
+    @data(
+        (None, None, mm.REFRESH_MSG),
+        ([], [], mm.REFRESH_MSG),
+        (['EAY131-A'], None, '{"message": "RefreshSummaryReport", "treatmentArmIds": ["EAY131-A"]}'),
+        (None, ['14442', '14443'], '{"message": "RefreshSummaryReport", "patientSequenceNumbers": ["14442", "14443"]}'),
+    )
+    @unpack
+    def test_create_refresh_message(self, treatment_arm_ids, patient_seq_nums, exp_msg_body):
+        self.assertEqual(mm.create_refresh_message(treatment_arm_ids, patient_seq_nums), exp_msg_body)
+
+
+@ddt
+class TreatmentArmsMessageManagerSqsTestCase(unittest.TestCase):
+    """
+    Tests the TreatmentArmMessageManager's at-least-once processing end to end against an in-process SQS stand-in.
+    """
+    def setUp(self):
+        self.sqs_client = FakeSqsClient()
+        boto3_patcher = patch('accessors.sqs_accessor.boto3')
+        self.addCleanup(boto3_patcher.stop)
+        boto3_patcher.start().client.return_value = self.sqs_client
+
+        for module in ['accessors.sqs_accessor', 'scripts.ta_message_manager.ta_message_manager']:
+            env_patcher = patch(module + '.Environment')
+            self.addCleanup(env_patcher.stop)
+            mock_env = env_patcher.start().return_value
+            mock_env.region = 'us-east-1'
+            mock_env.sqs_endpoint_url = ''
+            mock_env.sqs_queue_name = TEST_QUEUE_NAME
+            mock_env.polling_interval = 1
+            mock_env.full_refresh_interval = TEST_FULL_REFRESH_INTERVAL
+            mock_env.sqs_wait_time_seconds = 1
+            mock_env.sqs_max_messages = 10
+            mock_env.sqs_max_drain_batches = 3
+            mock_env.sqs_visibility_timeout = 1
+            mock_env.sqs_heartbeat_interval = 0.2
+            mock_env.sqs_max_receive_count = 2
+            mock_env.sqs_dead_letter_queue_name = TEST_QUEUE_NAME + '-dlq'
+            mock_env.message_handler_workers = 4
+
+        refresher_patcher = patch('scripts.ta_message_manager.ta_message_manager.Refresher')
+        self.addCleanup(refresher_patcher.stop)
+        self.mock_refresher = refresher_patcher.start()
+        self.mock_refresher.return_value.run.return_value = 0
+
+        # By default another message manager has just started a full refresh, so none is due while the test runs.
+        schedule_patcher = patch('scripts.ta_message_manager.ta_message_manager.RefreshScheduleAccessor')
+        self.addCleanup(schedule_patcher.stop)
+        self.mock_schedule = schedule_patcher.start().return_value
+        self.mock_schedule.claim_full_refresh.side_effect = lambda interval: (False, time.time())
+
+        self.queue_url = self.sqs_client.create_queue(QueueName=TEST_QUEUE_NAME)['QueueUrl']
+        self.dlq_url = self.sqs_client.create_queue(QueueName=TEST_QUEUE_NAME + '-dlq')['QueueUrl']
+
+    def run_manager(self):
+        tamm = mm.TreatmentArmMessageManager()
+        thread = threading.Thread(target=tamm.run, daemon=True)
+        thread.start()
+        return tamm, thread
+
+    def stop_manager(self, thread):
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=mm.STOP_MSG)
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+
+    # Full refreshes claimed from the shared schedule are run without any messages.
+    def test_periodic_full_refresh(self):
+        self.mock_schedule.claim_full_refresh.side_effect = lambda interval: (True, time.time())
+        tamm = mm.TreatmentArmMessageManager()
+        tamm.full_refresh_interval = 0.5
+        thread = threading.Thread(target=tamm.run, daemon=True)
+        thread.start()
+        time.sleep(2.5)
+
+        self.stop_manager(thread)
+        self.assertGreaterEqual(self.mock_refresher.return_value.run.call_count, 2)
+        for args in self.mock_refresher.call_args_list:
+            self.assertEqual(args, ((),))
+
+    # A refresh that outlasts the visibility timeout keeps its message hidden and deletes it when it succeeds.
+    def test_long_refresh_succeeds(self):
+        refreshing = threading.Event()
+        finish = threading.Event()
+
+        def long_refresh():
+            refreshing.set()
+            finish.wait(10)
+        self.mock_refresher.return_value.run.side_effect = long_refresh
+
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=mm.REFRESH_MSG)
+        tamm, thread = self.run_manager()
+        self.assertTrue(refreshing.wait(5))
+
+        # Well past the visibility timeout, the message is still on the queue but has not been received again.
+        for _ in range(3):
+            self.assertEqual(self.sqs_client.receive_message(QueueUrl=self.queue_url), {})
+            time.sleep(0.5)
+        self.assertEqual(self.sqs_client.queue_bodies(self.queue_url), [mm.REFRESH_MSG])
+
+        finish.set()
+        self.stop_manager(thread)
+        self.assertEqual(self.sqs_client.queue_bodies(self.queue_url), [])
+        self.assertEqual(self.mock_refresher.return_value.run.call_count, 1)
+        self.assertEqual(tamm.heartbeat.held_count, 0)
+
+    # Other messages are handled, and deleted, while a refresh is running.
+    def test_status_handled_during_refresh(self):
+        refreshing = threading.Event()
+        finish = threading.Event()
+
+        def long_refresh():
+            refreshing.set()
+            finish.wait(10)
+        self.mock_refresher.return_value.run.side_effect = long_refresh
+
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=mm.REFRESH_MSG)
+        tamm, thread = self.run_manager()
+        self.assertTrue(refreshing.wait(5))
+
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=mm.STATUS_MSG)
+        deadline = time.time() + 5
+        while mm.STATUS_MSG in self.sqs_client.queue_bodies(self.queue_url) and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.sqs_client.queue_bodies(self.queue_url), [mm.REFRESH_MSG])
+
+        finish.set()
+        self.stop_manager(thread)
+        self.assertEqual(self.sqs_client.queue_bodies(self.queue_url), [])
+
+    # A refresh that keeps failing, whether it raises or some of its summary reports could not be refreshed, is
+    # retried until its message has been received too many times and is then moved to the dead-letter queue.
+    @data(
+        Exception("database unavailable"),
+        lambda: 1,
+    )
+    def test_failing_refresh_is_dead_lettered(self, run_side_effect):
+        self.mock_refresher.return_value.run.side_effect = run_side_effect
+
+        self.sqs_client.send_message(QueueUrl=self.queue_url, MessageBody=mm.REFRESH_MSG)
+        tamm, thread = self.run_manager()
+
+        deadline = time.time() + 10
+        while not self.sqs_client.queue_bodies(self.dlq_url) and time.time() < deadline:
+            time.sleep(0.1)
+        self.stop_manager(thread)
+
+        self.assertEqual(self.sqs_client.queue_bodies(self.dlq_url), [mm.REFRESH_MSG])
+        self.assertEqual(self.sqs_client.queue_bodies(self.queue_url), [])
+        self.assertEqual(self.mock_refresher.return_value.run.call_count, 2)  # sqs_max_receive_count
+
+
 if __name__ == '__main__':
     unittest.main()
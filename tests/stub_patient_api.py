@@ -0,0 +1,130 @@
+"""
+A local stand-in for the Patient API endpoints used by the Summary Report Refresher, served over real HTTP on
+127.0.0.1 from a background thread.  Used by the unit tests and the benchmarks so that the PatientAccessor can be
+exercised without a running Patient API.
+
+    with StubPatientApi(patients) as api:
+        accessor_url = api.url   # use as the patient_api_url setting
+
+Each patient is a JSON document in the format returned by PatientAccessor.get_patients_by_treatment_arm_id; it is
+served for the arm in its patientAssignments.treatmentArm.treatmentArmId field.
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+PATIENTS_PATH = '/api/v1/patients'
+BY_ARM_PATH = PATIENTS_PATH + '/by_treatment_arm'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubPatientApi(object):
+    def __init__(self, patients=None, ndjson=True):
+        """
+        :param patients: list of patient JSON documents to serve
+        :param ndjson: if False, the bulk endpoint returns a JSON array instead of newline-delimited JSON
+        """
+        self.ndjson = ndjson
+        self.requests = []        # the path (with query string) of every request received
+        self._failures = []       # status codes to return, in order, before serving normally again
+        self._lock = threading.Lock()
+        self._patients_by_arm = dict()
+        for patient in patients or []:
+            self.add_patient(patient)
+        self._server = None
+        self._thread = None
+
+    def add_patient(self, patient):
+        treatment_arm = patient.get('patientAssignments', {}).get('treatmentArm', {})
+        patient = dict(patient, treatmentArm=treatment_arm)  # the Patient API projects it to the top level
+        self._patients_by_arm.setdefault(treatment_arm.get('treatmentArmId'), []).append(patient)
+
+    def fail_next(self, *status_codes):
+        """
+        Makes the next len(status_codes) requests fail with the given status codes.
+        """
+        with self._lock:
+            self._failures.extend(status_codes)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{port}{path}".format(port=self._server.server_address[1], path=PATIENTS_PATH)
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), self._create_handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def patients_for(self, trtmt_id):
+        """
+        :return: the patients of trtmt_id in Patient API order:  patientSequenceNumber ascending and then
+                 patientAssignments.dateAssigned descending
+        """
+        patients = sorted(self._patients_by_arm.get(trtmt_id, []),
+                          key=lambda p: p.get('patientAssignments', {}).get('dateAssigned', {}).get('$date', 0),
+                          reverse=True)
+        return sorted(patients, key=lambda p: p['patientSequenceNumber'])
+
+    def _next_failure(self, path):
+        with self._lock:
+            self.requests.append(path)
+            return self._failures.pop(0) if self._failures else None
+
+    def _create_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _send_json(self, status, data):
+                self._send(status, 'application/json', json.dumps(data).encode())
+
+            def do_GET(self):
+                failure = stub._next_failure(self.path)
+                if failure:
+                    self._send_json(failure, {'description': 'stubbed failure'})
+                    return
+
+                parsed = urlparse(self.path)
+                if parsed.path.startswith(BY_ARM_PATH + '/'):
+                    self._send_json(200, stub.patients_for(parsed.path[len(BY_ARM_PATH) + 1:]))
+                elif parsed.path == BY_ARM_PATH:
+                    ids = parse_qs(parsed.query).get('treatmentArmIds', [''])[0]
+                    patients = [p for trtmt_id in ids.split(',') if trtmt_id for p in stub.patients_for(trtmt_id)]
+                    if stub.ndjson and NDJSON_CONTENT_TYPE in self.headers.get('Accept', ''):
+                        body = ''.join([json.dumps(p) + '\n' for p in patients]).encode()
+                        self._send(200, NDJSON_CONTENT_TYPE, body)
+                    else:
+                        self._send_json(200, patients)
+                else:
+                    self._send_json(404, {'description': 'Not Found'})
+
+        return Handler
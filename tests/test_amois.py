@@ -2,7 +2,7 @@
 import copy
 import json
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 import flask
@@ -11,6 +11,7 @@ from flask_env import MetaFlaskEnv
 from flask_restful import Api
 from mock import patch
 
+from helpers import shared_cache
 from resources import amois
 
 APP = None
@@ -717,6 +718,42 @@ class VariantRulesMgrCacheTests(unittest.TestCase):
         amois.VariantRulesMgrCache._reload()
         self.assertEqual(amois.VariantRulesMgrCache._variant_rules_mgr, mock_var_rules_mgr.return_value)
         self.assertEqual(amois.VariantRulesMgrCache._load_timestamp, test_date)
+        mock_var_rules_mgr.assert_called_once_with()
+
+    # Test the VariantRulesMgrCache._reload function with the shared cache on.
+    @patch('resources.amois.time')
+    @patch('resources.amois.TreatmentArmsAccessor')
+    @patch('resources.amois.VariantRulesMgr')
+    def test_reload_shared_snapshot(self, mock_var_rules_mgr, mock_ta_accessor, mock_time):
+        """Test that the rules are loaded from the database by the first process and from the snapshot thereafter,
+        and that the rules taken from the snapshot are reloaded _interval seconds after the snapshot was loaded."""
+        test_date = datetime(2015, 7, 31, 11, 31, 16)
+        FakeDateTime.now = classmethod(lambda cls: test_date)
+        # As returned by the accessor, the rules are JSON-compatible.
+        exp_rules = {'non_hotspot_rules': [{'gene': 'EGFR', 'dateArchived': None}],
+                     'cnv_identifier_rules': [{'identifier': 'CNVOSM'}],
+                     'snv_identifier_rules': [{'identifier': 'SNVOSM'}],
+                     'gene_fusion_identifier_rules': [{'identifier': 'GFOSM'}],
+                     'indel_identifier_rules': [{'identifier': 'INDOSM'}]}
+        mock_ta_accessor.return_value.get_ta_non_hotspot_rules.return_value = exp_rules['non_hotspot_rules']
+        mock_ta_accessor.return_value.get_ta_identifier_rules.side_effect = \
+            lambda variant_type: {'copyNumberVariants': exp_rules['cnv_identifier_rules'],
+                                  'singleNucleotideVariants': exp_rules['snv_identifier_rules'],
+                                  'geneFusions': exp_rules['gene_fusion_identifier_rules'],
+                                  'indels': exp_rules['indel_identifier_rules']}[variant_type]
+
+        with patch('helpers.shared_cache.STORE', shared_cache.MemoryStore()):
+            mock_time.time.return_value = 1000.0
+            amois.VariantRulesMgrCache._reload()
+            self.assertEqual(amois.VariantRulesMgrCache._load_timestamp, test_date)
+            mock_time.time.return_value = 1025.0
+            amois.VariantRulesMgrCache._reload()
+            self.assertEqual(amois.VariantRulesMgrCache._load_timestamp, test_date - timedelta(seconds=25))
+
+        self.assertEqual(mock_ta_accessor.call_count, 1)
+        self.assertEqual(mock_var_rules_mgr.call_count, 2)
+        for call in mock_var_rules_mgr.call_args_list:
+            self.assertEqual(call[1], exp_rules)
 
 
 def create_hotspot_variant(identifier):
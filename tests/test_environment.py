@@ -3,6 +3,8 @@
 import io
 import unittest
 
+import yaml
+
 from ddt import ddt, data, unpack
 from mock import patch, MagicMock
 
@@ -10,14 +12,16 @@ from helpers import environment
 
 TEST_YAML_DATA = {
     'the_default_env': {
-        'property1': 'the first default property',
-        'property2': 'the second default property',
-        'property_int': 1234
+        'sqs_queue_name': 'the default queue',
+        'region': 'the default region',
+        'port': 1234,
+        'patient_api_bulk_fetch': False,
     },
     'the_other_env': {
-        'property1': 'the first other property',
-        'property2': 'the second other property',
-        'property_int': 567
+        'sqs_queue_name': 'the other queue',
+        'region': 'the other region',
+        'port': 567,
+        'patient_api_bulk_fetch': False,
     }
 }
 
@@ -28,7 +32,9 @@ DEFAULT_ENV_VARS = {
 OTHER_ENV_VARS = {
     'ENVIRONMENT': 'the_other_env',
     'MONGODB_URI': 'the_mongodb_uri/Match',
-    'PROPERTY1': 'override the first other property'
+    'SQS_QUEUE_NAME': 'override the other queue',
+    'PORT': '8080',
+    'PATIENT_API_BULK_FETCH': 'True',
 }
 
 @ddt
@@ -72,10 +78,14 @@ class EnvironmentTests(unittest.TestCase):
         self.assertEqual(test_env.db_name, 'Match')
         self.assertEqual(test_env.environment, env_vars['ENVIRONMENT'])
 
+        # Settings overridden by environment variables are converted from strings to their types.
         env_type = env_vars['ENVIRONMENT']
-        self.assertEqual(test_env.property1, env_vars.get('property1', TEST_YAML_DATA[env_type]['property1']))
-        self.assertEqual(test_env.property2, TEST_YAML_DATA[env_type]['property2'])
-        self.assertEqual(test_env.property_int, TEST_YAML_DATA[env_type]['property_int'])
+        self.assertEqual(test_env.sqs_queue_name,
+                         env_vars.get('SQS_QUEUE_NAME', TEST_YAML_DATA[env_type]['sqs_queue_name']))
+        self.assertEqual(test_env.region, TEST_YAML_DATA[env_type]['region'])
+        self.assertEqual(test_env.port, int(env_vars.get('PORT', TEST_YAML_DATA[env_type]['port'])))
+        self.assertIsInstance(test_env.port, int)
+        self.assertEqual(test_env.patient_api_bulk_fetch, 'PATIENT_API_BULK_FETCH' in env_vars)
 
         mock_os.stop()
 
@@ -111,6 +121,61 @@ class EnvironmentTests(unittest.TestCase):
         exp_exc_msg = environment.Environment.INVALID_GET_MSG_FMT.format('invalid_get')
         self.assertEqual(str(cm.exception), exp_exc_msg)
 
+    def test_settings_are_read_only(self):
+        test_env = environment.Environment()
+        with self.assertRaises(Exception) as cm:
+            test_env.port = 80
+        self.assertEqual(str(cm.exception), environment.Settings.READ_ONLY_MSG_FMT.format('port'))
+        self.assertEqual(test_env.port, 1234)
+        self.assertFalse(hasattr(test_env, '__dict__'))
+
+    def test_invalid_setting_value(self):
+        patcher = patch.dict('helpers.environment.os.environ', dict(DEFAULT_ENV_VARS, PORT='not a port'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        with self.assertRaises(Exception) as cm:
+            environment.Environment()
+        self.assertIn("Invalid value 'not a port' for setting port", str(cm.exception))
+
+    def test_unknown_setting(self):
+        yaml_data = dict(TEST_YAML_DATA, the_default_env=dict(TEST_YAML_DATA['the_default_env'], sqs_queue_nmae='typo',
+                                                              extra=1))
+        self.mock_yaml.safe_load.return_value = yaml_data
+
+        with self.assertRaises(Exception) as cm:
+            environment.Environment()
+        self.assertEqual(str(cm.exception), environment.Settings.UNKNOWN_SETTINGS_MSG_FMT
+                         .format(env='the_default_env', names='extra, sqs_queue_nmae'))
+
+    def test_setting_missing_from_config_file(self):
+        test_env = environment.Environment()
+        with self.assertRaises(Exception) as cm:
+            test_env.polling_interval  # pylint: disable=pointless-statement
+        self.assertEqual(str(cm.exception), environment.Environment.INVALID_GET_MSG_FMT.format('polling_interval'))
+
+    @data(
+        (True, True),
+        (False, False),
+        ('True', True),
+        ('true', True),
+        ('1', True),
+        ('False', False),
+        ('0', False),
+    )
+    @unpack
+    def test_to_bool(self, value, exp_result):
+        self.assertEqual(environment.to_bool(value), exp_result)
+
+    def test_config_file_settings_are_typed(self):
+        """
+        Every setting in the real configuration file has a type.
+        """
+        with open('config/environment.yml') as yaml_file:
+            config = yaml.safe_load(yaml_file)
+        for env_name, settings in config.items():
+            self.assertEqual(set(settings) - set(environment.Settings.TYPES), set(), env_name)
+
     def test_load_config_file_with_exc(self):
         self.mock_open.side_effect = FileNotFoundError
         with self.assertRaises(FileNotFoundError) as cm:
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the helpers/metrics.py module.
+"""
+
+import unittest
+
+from ddt import ddt, data, unpack
+
+from helpers import metrics
+
+
+@ddt
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter('my_counter', 'counts things')
+        counter.inc()
+        counter.inc(4)
+        self.assertEqual(counter.value, 5)
+        self.assertIs(self.registry.counter('my_counter'), counter)
+        self.assertEqual(self.registry.snapshot(), {'my_counter': {'value': 5}})
+
+    @data(
+        ([], {'count': 0, 'total': 0.0, 'max': 0.0, 'mean': 0.0}),
+        ([0.5, 1.5, 1.0], {'count': 3, 'total': 3.0, 'max': 1.5, 'mean': 1.0}),
+    )
+    @unpack
+    def test_timer(self, observations, exp_snapshot):
+        timer = self.registry.timer('my_timer')
+        for seconds in observations:
+            timer.observe(seconds)
+        self.assertEqual(timer.snapshot(), exp_snapshot)
+
+    def test_timer_context_manager(self):
+        timer = self.registry.timer('my_timer')
+        with self.assertRaises(ValueError):
+            with timer.time():
+                raise ValueError()
+        self.assertEqual(timer.count, 1)
+
+    def test_type_conflict(self):
+        self.registry.counter('my_metric')
+        with self.assertRaises(Exception) as cm:
+            self.registry.timer('my_metric')
+        self.assertEqual(str(cm.exception), "Metric 'my_metric' is already registered as a Counter")
+
+    def test_labels(self):
+        get_counter = self.registry.counter('requests', labels={'method': 'GET'})
+        post_counter = self.registry.counter('requests', labels={'method': 'POST'})
+        self.assertIsNot(get_counter, post_counter)
+        self.assertIs(self.registry.counter('requests', labels={'method': 'GET'}), get_counter)
+        get_counter.inc(2)
+        self.assertEqual(self.registry.snapshot(), {'requests{method="GET"}': {'value': 2},
+                                                    'requests{method="POST"}': {'value': 0}})
+        with self.assertRaises(Exception):
+            self.registry.timer('requests', labels={'method': 'PUT'})
+
+    @data(
+        ('name', None, 'name'),
+        ('name', {'b': '2', 'a': 1}, 'name{a="1",b="2"}'),
+        ('name', {'a': 'say "hi"\\\n'}, 'name{a="say \\"hi\\"\\\\\\n"}'),
+    )
+    @unpack
+    def test_metric_key(self, name, labels, exp_key):
+        self.assertEqual(metrics.metric_key(name, labels), exp_key)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('my_histogram', buckets=[1.0, 0.1])
+        for seconds in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(seconds)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 4)
+        self.assertEqual(snapshot['max'], 3.0)
+        self.assertEqual(snapshot['buckets'], {0.1: 2, 1.0: 3, float('inf'): 4})
+
+    def test_exposition(self):
+        self.registry.counter('my_counter', 'counts things', {'kind': 'a'}).inc(3)
+        self.registry.counter('my_counter', 'counts things', {'kind': 'b'}).inc()
+        self.registry.timer('my_timer').observe(0.5)
+        self.registry.histogram('my_histogram', 'times things', buckets=[0.1]).observe(0.25)
+        self.assertEqual(self.registry.exposition(),
+                         '# HELP my_counter counts things\n'
+                         '# TYPE my_counter counter\n'
+                         'my_counter{kind="a"} 3\n'
+                         'my_counter{kind="b"} 1\n'
+                         '# HELP my_histogram times things\n'
+                         '# TYPE my_histogram histogram\n'
+                         'my_histogram_bucket{le="0.1"} 0\n'
+                         'my_histogram_bucket{le="+Inf"} 1\n'
+                         'my_histogram_count 1\n'
+                         'my_histogram_sum 0.25\n'
+                         '# TYPE my_timer summary\n'
+                         'my_timer_count 1\n'
+                         'my_timer_sum 0.5\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the resources/metrics.py module.
+"""
+
+import unittest
+
+import flask
+from ddt import ddt, data, unpack
+from flask_restful import Api, Resource, abort
+
+from helpers import metrics
+from resources.auth0_resource import AuthenticationError, authenticated_function
+from resources.metrics import instrument, MetricsResource, REQUESTS_METRIC, REQUEST_SECONDS_METRIC
+
+
+class Things(Resource):
+    def get(self):
+        return {'things': []}
+
+    def post(self):
+        return 'bad thing', 400
+
+    def delete(self):
+        raise Exception('Oh no!')
+
+    def put(self):
+        abort(404, message='no such thing')
+
+    def patch(self):
+        raise AuthenticationError('invalid_header', 'Token not found')
+
+    @authenticated_function
+    def options(self):
+        return {}
+
+
+@ddt
+class MetricsResourceTests(unittest.TestCase):
+    def setUp(self):
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
+
+        self.app = flask.Flask(__name__)
+        api = Api(self.app, decorators=[instrument])
+        api.add_resource(Things, '/things')
+        api.add_resource(MetricsResource, '/metrics')
+        self.client = self.app.test_client()
+
+    @data(
+        ('get', '200'),
+        ('post', '400'),
+        ('delete', '500'),
+        ('put', '404'),
+        ('patch', '401'),
+        ('options', '401'),
+    )
+    @unpack
+    def test_instrument(self, method, exp_status):
+        getattr(self.client, method)('/things')
+
+        labels = {'resource': 'Things', 'method': method.upper()}
+        snapshot = metrics.REGISTRY.snapshot()
+        self.assertEqual(snapshot[metrics.metric_key(REQUESTS_METRIC, dict(labels, status=exp_status))],
+                         {'value': 1})
+        self.assertEqual(snapshot[metrics.metric_key(REQUEST_SECONDS_METRIC, labels)]['count'], 1)
+
+    def test_get(self):
+        self.client.get('/things')
+        response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], metrics.EXPOSITION_CONTENT_TYPE)
+        body = response.get_data().decode('utf-8')
+        self.assertIn('# TYPE {} histogram'.format(REQUEST_SECONDS_METRIC), body)
+        self.assertIn('{}{{method="GET",resource="Things",status="200"}} 1\n'.format(REQUESTS_METRIC), body)
+
+
+if __name__ == '__main__':
+    unittest.main()
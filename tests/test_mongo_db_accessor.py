@@ -12,6 +12,7 @@ from ddt import ddt, data, unpack
 from mock import patch
 
 from accessors.mongo_db_accessor import MongoDbAccessor
+from helpers import metrics
 
 DB = 'my_db'
 URI = 'my_uri'
@@ -24,6 +25,8 @@ class MongoDbAccessorTest(unittest.TestCase):
         mongo_db_patcher = patch('accessors.mongo_db_accessor.MongoClient')
         self.addCleanup(mongo_db_patcher.stop)
         self.mock_mongo_client = mongo_db_patcher.start()
+        MongoDbAccessor._drop_clients()
+        self.addCleanup(MongoDbAccessor._drop_clients)
         self.mock_collection = self.mock_mongo_client.return_value[DB][COLL_NAME]
 
         logging_patcher = patch('accessors.mongo_db_accessor.logging')
@@ -50,7 +53,7 @@ class MongoDbAccessorTest(unittest.TestCase):
         self.assertEqual(mongo_db_accessor.database, self.mock_mongo_client.return_value[DB])
         self.assertEqual(mongo_db_accessor.collection, self.mock_collection)
         self.assertEqual(mongo_db_accessor.logger, self.mock_logger)
-        self.mock_mongo_client.assert_called_once_with(URI)
+        self.mock_mongo_client.assert_called_once_with(URI, connect=False)
 
     # Test the MongoDbAccessor.mongo_to_python method
     @data(
@@ -82,9 +85,14 @@ class MongoDbAccessorTest(unittest.TestCase):
 
         exp_result = [MongoDbAccessor.mongo_to_python(doc) for doc in mock_documents]
 
+        metrics.REGISTRY.clear()
+        self.addCleanup(metrics.REGISTRY.clear)
         result = mongo_db_accessor.find(query, projection)
         self.assertEqual(result, exp_result)
         self.mock_collection.find.assert_called_once_with(query, projection)
+        timer_key = metrics.metric_key('mongodb_operation_duration_seconds',
+                                       {'collection': COLL_NAME, 'operation': 'find'})
+        self.assertEqual(metrics.REGISTRY.snapshot()[timer_key]['count'], 1)
 
     # Test the MongoDbAccessor.find_one method
     @data(
@@ -175,6 +183,20 @@ class MongoDbAccessorTest(unittest.TestCase):
         self.assertEqual(result, exp_result)
         self.mock_collection.update_many.assert_called_once_with(query, update)
 
+    # Test the MongoDbAccessor.bulk_write method
+    @data(
+        (True, ),
+        (False, ),
+    )
+    @unpack
+    def test_bulk_write(self, ordered):
+        mongo_db_accessor = MongoDbAccessor(COLL_NAME, self.mock_logger)
+        requests = [{'update': 1}, {'update': 2}]
+
+        result = mongo_db_accessor.bulk_write(requests, ordered)
+        self.assertEqual(result, self.mock_collection.bulk_write.return_value)
+        self.mock_collection.bulk_write.assert_called_once_with(requests, ordered=ordered)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the helpers/profiling.py module.
+"""
+
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+import flask
+from ddt import ddt, data, unpack
+from mock import patch, Mock
+
+from helpers import profiling
+
+TOKEN = 'secret-token'
+
+
+@ddt
+class ProfilingTests(unittest.TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+        self.app = flask.Flask(__name__)
+        self.app.add_url_rule('/things', 'things', lambda: flask.jsonify({'things': [1, 2, 3]}))
+
+    def install(self, token=TOKEN, sample_rate=0.0):
+        self.app.wsgi_app = profiling.ProfilingMiddleware(self.app.wsgi_app, self.profile_dir, token, sample_rate)
+        return self.app.test_client()
+
+    @data(
+        ({'X-Profile': TOKEN}, True),
+        ({'X-Profile': 'wrong-token'}, False),
+        ({}, False),
+    )
+    @unpack
+    def test_header(self, headers, exp_profiled):
+        response = self.install().get('/things', headers=headers)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_data().decode('utf-8')), {'things': [1, 2, 3]})
+        self.assertEqual(profiling.PROFILE_ID_HEADER in response.headers, exp_profiled)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1 if exp_profiled else 0)
+        if exp_profiled:
+            path = os.path.join(self.profile_dir, response.headers[profiling.PROFILE_ID_HEADER] + '.pstats')
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+    @data(
+        ('abc-123', 'abc-123'),
+        ('../../etc/passwd', None),
+    )
+    @unpack
+    def test_request_id(self, request_id, exp_profile_id):
+        response = self.install().get('/things', headers={'X-Profile': TOKEN, 'X-Request-Id': request_id})
+
+        profile_id = response.headers[profiling.PROFILE_ID_HEADER]
+        if exp_profile_id:
+            self.assertEqual(profile_id, exp_profile_id)
+        else:
+            self.assertRegex(profile_id, '^[0-9a-f]{32}$')
+        self.assertEqual(os.listdir(self.profile_dir), [profile_id + '.pstats'])
+
+    @data(
+        (0.5, 0.4, True),
+        (0.5, 0.6, False),
+    )
+    @unpack
+    @patch('helpers.profiling.random')
+    def test_sample_rate(self, sample_rate, random_value, exp_profiled, mock_random):
+        mock_random.random.return_value = random_value
+        response = self.install(token='', sample_rate=sample_rate).get('/things', headers={'X-Profile': ''})
+        self.assertEqual(profiling.PROFILE_ID_HEADER in response.headers, exp_profiled)
+
+    @data(
+        ('', 0.0, False),
+        (TOKEN, 0.0, True),
+        ('', 0.01, True),
+    )
+    @unpack
+    def test_install(self, token, sample_rate, exp_installed):
+        wsgi_app = self.app.wsgi_app
+        env = Mock(profile_token=token, profile_sample_rate=sample_rate, profile_dir=self.profile_dir)
+
+        self.assertEqual(profiling.install(self.app, env), exp_installed)
+        if exp_installed:
+            self.assertIsInstance(self.app.wsgi_app, profiling.ProfilingMiddleware)
+        else:
+            self.assertEqual(self.app.wsgi_app, wsgi_app)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the accessors/refresh_schedule_accessor.py module.
+"""
+
+import unittest
+
+from ddt import ddt, data, unpack
+from mock import patch, Mock
+from pymongo.errors import DuplicateKeyError
+
+from accessors.mongo_db_accessor import MongoDbAccessor
+from accessors.refresh_schedule_accessor import RefreshScheduleAccessor
+
+DB = 'my_db'
+URI = 'my_uri'
+COLL_NAME = 'refreshSchedule'
+INTERVAL = 3600
+NOW = 10000.0
+
+
+@ddt
+class RefreshScheduleAccessorTests(unittest.TestCase):
+    def setUp(self):
+        mongo_db_patcher = patch('accessors.mongo_db_accessor.MongoClient')
+        self.addCleanup(mongo_db_patcher.stop)
+        self.mock_mongo_client = mongo_db_patcher.start()
+        MongoDbAccessor._drop_clients()
+        self.addCleanup(MongoDbAccessor._drop_clients)
+        self.mock_collection = self.mock_mongo_client.return_value[DB][COLL_NAME]
+
+        logging_patcher = patch('accessors.refresh_schedule_accessor.logging')
+        self.addCleanup(logging_patcher.stop)
+        self.mock_logger = logging_patcher.start().getLogger()
+
+        env_patcher = patch('accessors.mongo_db_accessor.Environment')
+        self.addCleanup(env_patcher.stop)
+        self.mock_env = env_patcher.start().return_value
+        self.mock_env.mongodb_uri = URI
+        self.mock_env.db_name = DB
+
+        time_patcher = patch('accessors.refresh_schedule_accessor.time')
+        self.addCleanup(time_patcher.stop)
+        time_patcher.start().time.return_value = NOW
+
+    # Test the RefreshScheduleAccessor.claim_full_refresh method.
+    @data(
+        # 1. the last full refresh started long enough ago
+        (Mock(modified_count=1, upserted_id=None), None, (True, NOW)),
+        # 2. no full refresh has ever been run
+        (Mock(modified_count=0, upserted_id=RefreshScheduleAccessor.FULL_REFRESH_ID), None, (True, NOW)),
+        # 3. the last full refresh started too recently (the upsert fails on the existing _id)
+        (DuplicateKeyError('E11000 duplicate key error'), {'lastStarted': NOW - 60}, (False, NOW - 60)),
+        # 4. another message manager claimed it first
+        (Mock(modified_count=0, upserted_id=None), {'lastStarted': NOW}, (False, NOW)),
+        # 5. the schedule document has gone away meanwhile
+        (Mock(modified_count=0, upserted_id=None), None, (False, None)),
+    )
+    @unpack
+    def test_claim_full_refresh(self, update_result, schedule, exp_result):
+        if isinstance(update_result, Exception):
+            self.mock_collection.update_one.side_effect = update_result
+        else:
+            self.mock_collection.update_one.return_value = update_result
+        self.mock_collection.find_one.return_value = schedule
+
+        self.assertEqual(RefreshScheduleAccessor().claim_full_refresh(INTERVAL), exp_result)
+        self.mock_collection.update_one.assert_called_once_with(
+            {'_id': RefreshScheduleAccessor.FULL_REFRESH_ID,
+             '$or': [{'lastStarted': None}, {'lastStarted': {'$lte': NOW - INTERVAL}}]},
+            {'$set': {'lastStarted': NOW}}, upsert=True)
+        if exp_result[0]:
+            self.mock_collection.find_one.assert_not_called()
+            self.mock_logger.info.assert_called_with("Claimed the full refresh of the summary reports")
+        else:
+            self.mock_collection.find_one.assert_called_once_with({'_id': RefreshScheduleAccessor.FULL_REFRESH_ID},
+                                                                  {'lastStarted': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
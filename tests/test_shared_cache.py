@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the helpers/shared_cache.py module.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from ddt import ddt, data, unpack
+from mock import patch, Mock
+
+from helpers import shared_cache
+
+VALUE = {'treatmentArmId': 'A', 'version': '2016-11-11', 'variants': [{'gene': 'EGFR', 'inclusion': True}]}
+
+
+@ddt
+class StoreTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def create_store(self, store_type):
+        return shared_cache.MemoryStore() if store_type == 'memory' else shared_cache.FileStore(self.directory)
+
+    @data('memory', 'file')
+    def test_get_and_set(self, store_type):
+        store = self.create_store(store_type)
+        self.assertIsNone(store.get('key'))
+
+        store.set('key', VALUE)
+        self.assertEqual(store.get('key'), VALUE)
+        self.assertIsNot(store.get('key'), store.get('key'))
+
+        store.set('key', 'replaced')
+        self.assertEqual(store.get('key'), 'replaced')
+
+        store.delete('key')
+        store.delete('key')
+        self.assertIsNone(store.get('key'))
+
+    @data(
+        ('memory', 30, 29.9, VALUE),
+        ('memory', 30, 30.0, None),
+        ('memory', None, 100000.0, VALUE),
+        ('file', 30, 29.9, VALUE),
+        ('file', 30, 30.0, None),
+        ('file', None, 100000.0, VALUE),
+    )
+    @unpack
+    @patch('helpers.shared_cache.time')
+    def test_ttl(self, store_type, ttl, age, exp_value, mock_time):
+        store = self.create_store(store_type)
+        mock_time.time.return_value = 1000.0
+        store.set('key', VALUE, ttl)
+        mock_time.time.return_value = 1000.0 + age
+        self.assertEqual(store.get('key'), exp_value)
+
+    def test_file_store_shared(self):
+        shared_cache.FileStore(self.directory).set('key', VALUE)
+        self.assertEqual(shared_cache.FileStore(self.directory).get('key'), VALUE)
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith('.tmp')], [])
+
+    @data(
+        (None, None),
+        (30, 30),
+        (0.5, 1),
+    )
+    @unpack
+    def test_redis_store(self, ttl, exp_ex):
+        client = Mock()
+        store = shared_cache.RedisStore(client)
+
+        store.set('key', VALUE, ttl)
+        client.set.assert_called_once_with(shared_cache.KEY_PREFIX + 'key', shared_cache.encode(VALUE), ex=exp_ex)
+
+        client.get.return_value = client.set.call_args[0][1]
+        self.assertEqual(store.get('key'), VALUE)
+        client.get.return_value = None
+        self.assertIsNone(store.get('key'))
+
+        store.delete('key')
+        client.delete.assert_called_once_with(shared_cache.KEY_PREFIX + 'key')
+
+    @patch.dict('sys.modules', {'redis': None})
+    def test_redis_store_without_redis(self):
+        with self.assertRaises(Exception) as cm:
+            shared_cache.RedisStore.from_url('redis://localhost:6379/0')
+        self.assertEqual(str(cm.exception), "The redis package is required for shared_cache 'redis'")
+
+
+@ddt
+class ModuleTests(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('helpers.shared_cache.STORE', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @data(
+        ('', type(None)),
+        ('file', shared_cache.FileStore),
+        ('redis', shared_cache.RedisStore),
+    )
+    @unpack
+    @patch('helpers.shared_cache.RedisStore.from_url')
+    def test_configure(self, setting, exp_type, mock_from_url):
+        mock_from_url.side_effect = lambda url: shared_cache.RedisStore(Mock())
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        env = Mock(shared_cache=setting, shared_cache_dir=directory, shared_cache_url='redis://localhost:6379/0')
+
+        store = shared_cache.configure(env)
+        self.assertIsInstance(store, exp_type)
+        self.assertIs(shared_cache.STORE, store)
+        self.assertEqual(shared_cache.enabled(), store is not None)
+        if setting == 'redis':
+            mock_from_url.assert_called_once_with('redis://localhost:6379/0')
+
+    def test_configure_once(self):
+        store = shared_cache.MemoryStore()
+        with patch('helpers.shared_cache.STORE', store):
+            self.assertIs(shared_cache.configure(Mock(shared_cache='file')), store)
+
+    def test_configure_unknown(self):
+        with self.assertRaises(Exception) as cm:
+            shared_cache.configure(Mock(shared_cache='memcached'))
+        self.assertEqual(str(cm.exception), "Unknown shared_cache 'memcached'; expected 'file' or 'redis'")
+        self.assertIsNone(shared_cache.STORE)
+
+    def test_disabled(self):
+        self.assertFalse(shared_cache.enabled())
+        shared_cache.set_value('key', VALUE)
+        self.assertIsNone(shared_cache.get_value('key'))
+
+    def test_get_and_set_value(self):
+        with patch('helpers.shared_cache.STORE', shared_cache.MemoryStore()):
+            self.assertIsNone(shared_cache.get_value('key'))
+            shared_cache.set_value('key', VALUE)
+            self.assertEqual(shared_cache.get_value('key'), VALUE)
+
+    def test_store_errors(self):
+        store = Mock()
+        store.get.side_effect = store.set.side_effect = OSError('connection refused')
+        with patch('helpers.shared_cache.STORE', store):
+            shared_cache.set_value('key', VALUE, 30)
+            self.assertIsNone(shared_cache.get_value('key'))
+        store.set.assert_called_once_with('key', VALUE, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
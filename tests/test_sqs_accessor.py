@@ -43,14 +43,65 @@ class SqsAccessorTests(unittest.TestCase):
         # self.sqs_accessor = SqsAccessor(TA_QUEUE_NAME)
 
     def test_constuctor(self):
-        pass
-        # sqs_accessor = SqsAccessor(TA_QUEUE_NAME)
-        # self.mock_boto3.client.assert_called_once_with('sqs', region_name='us-east-1')
-        # self.sqs_client.create_queue.assert_called_once_with(QueueName=TA_QUEUE_NAME)
-        # self.assertEqual(sqs_accessor.queue_name, TA_QUEUE_NAME)
-        # self.assertEqual(sqs_accessor.queue_url, TA_QUEUE_URL)
-        # self.assertEqual(sqs_accessor.sqs_client, self.sqs_client)
+        with patch('accessors.sqs_accessor.boto3') as mock_boto3:
+            sqs_client = mock_boto3.client.return_value
+            sqs_client.create_queue.return_value = {'QueueUrl': TA_QUEUE_URL}
+            self.mock_env.sqs_endpoint_url = None
 
+            sqs_accessor = SqsAccessor(TA_QUEUE_NAME)
+            self.assertEqual(sqs_accessor.queue_name, TA_QUEUE_NAME)
+            mock_boto3.client.assert_not_called()
+
+            self.assertEqual(sqs_accessor.queue_url, TA_QUEUE_URL)
+            self.assertEqual(sqs_accessor.queue_url, TA_QUEUE_URL)
+            self.assertEqual(sqs_accessor.sqs_client, sqs_client)
+            mock_boto3.client.assert_called_once_with('sqs', region_name='us-east-1', endpoint_url=None)
+            sqs_client.create_queue.assert_called_once_with(QueueName=TA_QUEUE_NAME)
+
+    def create_sqs_accessor(self):
+        sqs_accessor = SqsAccessor(TA_QUEUE_NAME)
+        sqs_accessor.sqs_client = MagicMock(name='client')
+        sqs_accessor.queue_url = TA_QUEUE_URL
+        return sqs_accessor
+
+    # Test the SqsAccessor.receive_messages method.
+    @data(
+        ({'Messages': [{'Body': 'msg1'}, {'Body': 'msg2'}]}, 10, 20, 10, 20, [{'Body': 'msg1'}, {'Body': 'msg2'}]),
+        ({}, 25, 60, 10, 20, []),
+        ({'Messages': []}, '3', '0', 3, 0, []),
+    )
+    @unpack
+    def test_receive_messages(self, response, max_message_cnt, wait_time, exp_max_cnt, exp_wait_time, exp_messages):
+        sqs_accessor = self.create_sqs_accessor()
+        sqs_accessor.sqs_client.receive_message.return_value = response
+
+        messages = sqs_accessor.receive_messages(['SentTimestamp'], max_message_cnt, wait_time)
+        self.assertEqual(messages, exp_messages)
+        sqs_accessor.sqs_client.receive_message.assert_called_once_with(QueueUrl=TA_QUEUE_URL,
+                                                                        AttributeNames=['SentTimestamp'],
+                                                                        MaxNumberOfMessages=exp_max_cnt,
+                                                                        WaitTimeSeconds=exp_wait_time)
+
+    # Test the SqsAccessor.delete_messages method.
+    @data(
+        (0, [], [], []),
+        (3, [3], [[]], []),
+        (25, [10, 10, 5], [[], [{'Id': '4', 'Code': 'ReceiptHandleIsInvalid', 'SenderFault': True}], []],
+         [(14, 'ReceiptHandleIsInvalid')]),
+    )
+    @unpack
+    def test_delete_messages(self, message_cnt, exp_batch_sizes, failed_by_batch, exp_failures):
+        sqs_accessor = self.create_sqs_accessor()
+        sqs_accessor.sqs_client.delete_message_batch.side_effect = [{'Failed': failed} for failed in failed_by_batch]
+        messages = [{'MessageId': str(i), 'ReceiptHandle': 'rh{}'.format(i)} for i in range(message_cnt)]
+
+        failures = sqs_accessor.delete_messages(messages)
+        self.assertEqual(failures, [(messages[i], reason) for i, reason in exp_failures])
+
+        calls = sqs_accessor.sqs_client.delete_message_batch.call_args_list
+        self.assertEqual([len(c[1]['Entries']) for c in calls], exp_batch_sizes)
+        self.assertEqual([e['ReceiptHandle'] for c in calls for e in c[1]['Entries']],
+                         [m['ReceiptHandle'] for m in messages])
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the helpers/tracing.py module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ddt import ddt, data, unpack
+from mock import patch, Mock
+
+from helpers import tracing
+
+
+class ListExporter(object):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+    def shutdown(self):
+        pass
+
+
+@ddt
+class TracingTests(unittest.TestCase):
+    def setUp(self):
+        self.exporter = ListExporter()
+        self.tracer = tracing.Tracer(self.exporter)
+
+    def test_noop_when_off(self):
+        tracer = tracing.Tracer()
+        with tracer.start_span('op', {'a': 1}) as span:
+            self.assertIs(span, tracing.NOOP_SPAN)
+            span.set_attribute('b', 2)
+            self.assertIsNone(tracer.current_span())
+
+    def test_parent_and_child(self):
+        with self.tracer.start_span('parent', {'a': 1}) as parent:
+            with self.tracer.start_span('child') as child:
+                self.assertIs(self.tracer.current_span(), child)
+                child.set_attribute('b', 2)
+            self.assertIs(self.tracer.current_span(), parent)
+        self.assertIsNone(self.tracer.current_span())
+
+        self.assertEqual([s.name for s in self.exporter.spans], ['child', 'parent'])
+        self.assertEqual(child.trace_id, parent.trace_id)
+        self.assertEqual(child.parent_id, parent.span_id)
+        self.assertIsNone(parent.parent_id)
+        self.assertEqual(parent.attributes, {'a': 1})
+        self.assertEqual(child.attributes, {'b': 2})
+        self.assertGreaterEqual(parent.duration, child.duration)
+
+    def test_parent_on_another_thread(self):
+        with self.tracer.start_span('parent') as parent:
+            def work():
+                with self.tracer.start_span('worker', parent=parent):
+                    pass
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        worker = self.exporter.spans[0]
+        self.assertEqual((worker.name, worker.trace_id, worker.parent_id), ('worker', parent.trace_id, parent.span_id))
+
+    def test_exception(self):
+        with self.assertRaises(ValueError):
+            with self.tracer.start_span('op'):
+                raise ValueError('Oh no!')
+
+        span = self.exporter.spans[0]
+        self.assertEqual(span.status, 'ERROR')
+        self.assertEqual(span.attributes, {'exception.type': 'ValueError', 'exception.message': 'Oh no!'})
+
+    def test_file_exporter(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'traces.jsonl')
+        exporter = tracing.FileExporter(path)
+        self.addCleanup(exporter.shutdown)
+        tracer = tracing.Tracer(exporter)
+
+        with tracer.start_span('parent'):
+            with tracer.start_span('child', {'a': 1}):
+                pass
+
+        with open(path) as trace_file:
+            spans = [json.loads(line) for line in trace_file]
+        self.assertEqual([s['name'] for s in spans], ['child', 'parent'])
+        self.assertEqual(spans[0]['parentSpanId'], spans[1]['spanId'])
+        self.assertEqual(spans[0]['attributes'], {'a': 1})
+        self.assertEqual(spans[0]['status'], 'OK')
+
+    def test_file_exporter_shutdown(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'traces.jsonl')
+        exporter = tracing.FileExporter(path)
+        tracer = tracing.Tracer(exporter)
+
+        with tracer.start_span('before'):
+            pass
+        exporter.shutdown()
+        with tracer.start_span('after'):
+            pass
+
+        with open(path) as trace_file:
+            self.assertEqual([json.loads(line)['name'] for line in trace_file], ['before'])
+
+    def test_otlp_encode(self):
+        with self.tracer.start_span('op', {'flag': True, 'cnt': 3, 'secs': 0.5, 'name': 'x'}):
+            pass
+        span = self.exporter.spans[0]
+
+        body = tracing.OtlpExporter.encode([span])
+        otlp_span = body['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+        self.assertEqual(otlp_span['traceId'], span.trace_id)
+        self.assertEqual(otlp_span['parentSpanId'], '')
+        self.assertEqual(otlp_span['attributes'], [{'key': 'cnt', 'value': {'intValue': '3'}},
+                                                   {'key': 'flag', 'value': {'boolValue': True}},
+                                                   {'key': 'name', 'value': {'stringValue': 'x'}},
+                                                   {'key': 'secs', 'value': {'doubleValue': 0.5}}])
+        self.assertEqual(otlp_span['status'], {'code': 1})
+        self.assertGreaterEqual(int(otlp_span['endTimeUnixNano']), int(otlp_span['startTimeUnixNano']))
+
+    @patch('helpers.tracing.requests')
+    def test_otlp_exporter(self, mock_requests):
+        mock_requests.post.return_value.status_code = 200
+        exporter = tracing.OtlpExporter('http://collector:4318/', batch_size=2, flush_interval=60)
+        tracer = tracing.Tracer(exporter)
+        for name in ['a', 'b', 'c']:
+            with tracer.start_span(name):
+                pass
+        exporter.shutdown()
+
+        batches = [[s['name'] for s in c[1]['json']['resourceSpans'][0]['scopeSpans'][0]['spans']]
+                   for c in mock_requests.post.call_args_list]
+        self.assertEqual(batches, [['a', 'b'], ['c']])
+        self.assertEqual(mock_requests.post.call_args[0][0], 'http://collector:4318/v1/traces')
+
+    @data(
+        ('', type(None)),
+        ('file', tracing.FileExporter),
+        ('otlp', tracing.OtlpExporter),
+    )
+    @unpack
+    def test_configure(self, exporter_name, exp_exporter_class):
+        self.addCleanup(tracing.shutdown)
+        env = Mock(trace_exporter=exporter_name, trace_file='/tmp/traces.jsonl',
+                   trace_otlp_endpoint='http://localhost:4318')
+        self.assertIsInstance(tracing.configure(env), exp_exporter_class)
+        self.assertIsInstance(tracing.TRACER.exporter, exp_exporter_class)
+
+    def test_configure_invalid(self):
+        with self.assertRaises(Exception) as cm:
+            tracing.configure(Mock(trace_exporter='zipkin'))
+        self.assertEqual(str(cm.exception), "Unknown trace_exporter 'zipkin'; expected 'file' or 'otlp'")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,7 @@ import flask
 from ddt import ddt, data, unpack
 from mock import patch
 
+from accessors.treatment_arm_cache import TreatmentArmCache
 from resources import treatment_arm
 
 
@@ -73,7 +74,7 @@ ALL_ARMS = ACTIVE_ARMS + ARCHIVED_ARMS
 NO_ARMS = []
 
 # PROJECTIONS - for checking that the correct projection is passed to TreatmentArmsAccessor.find()
-DEFAULT_PROJECTION = None
+DEFAULT_PROJECTION = {'summaryReportFingerprint': 0}
 ID_PROJECTION = {'_id': 1}
 NAME_PROJECTION = {'name': 1, '_id': 0}
 NAME_AND_ID_PROJECTION = {'name': 1, '_id': 1}
@@ -153,6 +154,13 @@ class TestTreatmentArmsById(unittest.TestCase):
     NO_EXIST_ALL_QRY = {"treatmentArmId": 'NO_EXIST'}
     NO_EXIST_ACTIVE_QRY = {"treatmentArmId": 'NO_EXIST', 'dateArchived': {"$eq": None}}
 
+    def setUp(self):
+        # Each test case gets an empty cache.
+        self.cache = TreatmentArmCache(100, 60)
+        instance_patcher = patch('resources.treatment_arm.TreatmentArmCache.instance', return_value=self.cache)
+        instance_patcher.start()
+        self.addCleanup(instance_patcher.stop)
+
     @data(
         (100, 'EAY131-M', ALL_ARMS, '', EAY131M_ALL_ARMS, EAY131M_ALL_QRY, DEFAULT_PROJECTION),
         (101, 'EAY131-M', ACTIVE_ARMS, '', EAY131M_ACTIVE_ARMS, EAY131M_ALL_QRY, DEFAULT_PROJECTION),
@@ -231,6 +239,61 @@ class TestTreatmentArmsById(unittest.TestCase):
             # Test that reformat_status_log was called on every treatment arm returned from the treatment arm accessor.
             self.assertEqual(mock_reformat_status_log.call_count, len(instance.find.return_value))
 
+    @data(
+        ('', '', True),
+        ('?active=1', '?active=1', True),
+        ('?active=1', '', False),
+        ('?projection=name', '?projection=name', True),
+        ('?projection=name', '?projection=name,_id', False),
+    )
+    @unpack
+    @patch('resources.treatment_arm.TreatmentArmsAccessor')
+    def test_get_cached(self, first_request, second_request, exp_cached, mock_ta_accessor):
+        instance = mock_ta_accessor.return_value
+        instance.find.return_value = [dict(arm) for arm in self.EAY131M_ALL_ARMS]
+
+        app = flask.Flask(__name__)
+        with app.test_request_context(first_request):
+            first_result = treatment_arm.TreatmentArmsById().get('EAY131-M')
+        with app.test_request_context(second_request):
+            second_result = treatment_arm.TreatmentArmsById().get('EAY131-M')
+
+        self.assertEqual(instance.find.call_count, 1 if exp_cached else 2)
+        self.assertEqual(second_result, first_result)
+        self.assertIsNot(second_result, first_result)
+
+    @patch('resources.treatment_arm.TreatmentArmsAccessor')
+    def test_get_cached_copies(self, mock_ta_accessor):
+        """Modifying the result of one request must not change the results of the requests after it."""
+        instance = mock_ta_accessor.return_value
+        instance.find.return_value = [dict(arm) for arm in self.EAY131M_ALL_ARMS]
+
+        app = flask.Flask(__name__)
+        with app.test_request_context(''):
+            first_result = treatment_arm.TreatmentArmsById().get('EAY131-M')
+            first_result[0]['name'] = 'modified'
+            first_result.pop()
+            second_result = treatment_arm.TreatmentArmsById().get('EAY131-M')
+            second_result[0]['name'] = 'modified again'
+            third_result = treatment_arm.TreatmentArmsById().get('EAY131-M')
+
+        self.assertEqual(instance.find.call_count, 1)
+        self.assertEqual(len(third_result), len(self.EAY131M_ALL_ARMS))
+        self.assertNotIn(third_result[0]['name'], ['modified', 'modified again'])
+
+    @patch('resources.treatment_arm.TreatmentArmsAccessor')
+    def test_get_invalidated(self, mock_ta_accessor):
+        instance = mock_ta_accessor.return_value
+        instance.find.return_value = [dict(arm) for arm in self.EAY131M_ALL_ARMS]
+
+        app = flask.Flask(__name__)
+        with app.test_request_context(''):
+            treatment_arm.TreatmentArmsById().get('EAY131-M')
+            self.cache.invalidate('EAY131-M')
+            treatment_arm.TreatmentArmsById().get('EAY131-M')
+
+        self.assertEqual(instance.find.call_count, 2)
+
     @staticmethod
     def _sort(result):
         return sorted(result, key=str)
@@ -8,7 +8,10 @@ import unittest
 from bson import ObjectId
 from ddt import ddt, data, unpack
 from mock import patch, Mock
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
+from accessors.mongo_db_accessor import MongoDbAccessor
 from accessors.treatment_arm_accessor import TreatmentArmsAccessor
 
 DB = 'my_db'
@@ -28,6 +31,8 @@ class TreatmentArmAccessorTests(unittest.TestCase):
         mongo_db_patcher = patch('accessors.mongo_db_accessor.MongoClient')
         self.addCleanup(mongo_db_patcher.stop)
         self.mock_mongo_client = mongo_db_patcher.start()
+        MongoDbAccessor._drop_clients()
+        self.addCleanup(MongoDbAccessor._drop_clients)
         self.mock_collection = self.mock_mongo_client.return_value[DB][COLL_NAME]
 
         logging_patcher = patch('accessors.treatment_arm_accessor.logging')
@@ -54,7 +59,7 @@ class TreatmentArmAccessorTests(unittest.TestCase):
         self.assertEqual(treatment_arms_accessor.database, self.mock_mongo_client.return_value[DB])
         self.assertEqual(treatment_arms_accessor.collection, self.mock_collection)
         self.assertEqual(treatment_arms_accessor.logger, self.mock_logger)
-        self.mock_mongo_client.assert_called_once_with(URI)
+        self.mock_mongo_client.assert_called_once_with(URI, connect=False)
 
     # Test the TreatmentArmsAccessor.get_ta_non_hotspot_rules method
     @data(
@@ -142,23 +147,95 @@ class TreatmentArmAccessorTests(unittest.TestCase):
         self.mock_collection.find.assert_called_once_with(TreatmentArmsAccessor.SUMMARY_REPORT_REFRESH_QUERY,
                                                           TreatmentArmsAccessor.SUMMARY_REPORT_REFRESH_PROJECTION)
 
+    # Test the TreatmentArmsAccessor.get_arms_for_summary_report_refresh method for specific arms
+    def test_get_arms_for_summary_report_refresh_by_id(self):
+        self.mock_collection.find.return_value = [{'doc_num': 4}]
+
+        result = TreatmentArmsAccessor().get_arms_for_summary_report_refresh(['EAY131-A', 'EAY131-B'])
+        self.assertEqual(result, [{'doc_num': 4}])
+        self.mock_collection.find.assert_called_once_with({'dateArchived': None,
+                                                           'treatmentArmId': {'$in': ['EAY131-A', 'EAY131-B']}},
+                                                          TreatmentArmsAccessor.SUMMARY_REPORT_REFRESH_PROJECTION)
+
+    # Test the TreatmentArmsAccessor.get_arm_ids_for_patients method
+    def test_get_arm_ids_for_patients(self):
+        self.mock_collection.find.return_value = [{'treatmentArmId': 'EAY131-B'}, {'treatmentArmId': 'EAY131-A'},
+                                                  {'treatmentArmId': 'EAY131-B'}]
+
+        result = TreatmentArmsAccessor().get_arm_ids_for_patients(['14442', '14443'])
+        self.assertEqual(result, ['EAY131-A', 'EAY131-B'])
+        self.mock_collection.find.assert_called_once_with(
+            {'dateArchived': None, 'summaryReport.assignmentRecords.patientSequenceNumber': {'$in': ['14442', '14443']}},
+            {'treatmentArmId': 1, '_id': 0})
+
     # Test the TreatmentArmsAccessor.update_summary_report method
     @data(
-        ({'$oid': '598386900e04839ba1fabcfa'}, 1, True),
-        ({'$oid': '598386900e04839ba1fabcfa'}, 0, False),
+        ({'$oid': '598386900e04839ba1fabcfa'}, 1, None, True),
+        ({'$oid': '598386900e04839ba1fabcfa'}, 0, None, False),
+        ({'$oid': '598386900e04839ba1fabcfa'}, 1, 'abc123', True),
     )
     @unpack
-    def test_update_summary_report(self, ta_id, mocked_match_count, exp_result):
+    def test_update_summary_report(self, ta_id, mocked_match_count, fingerprint, exp_result):
         mocked_update_result = Mock()
         mocked_update_result.matched_count = mocked_match_count
         self.mock_collection.update_one.return_value = mocked_update_result
 
         summary_report_json = {"sum1": 23, "sum2": 7}
+        if fingerprint is not None:
+            exp_update = {'$set': {'summaryReport': summary_report_json, 'summaryReportFingerprint': fingerprint}}
+        else:
+            # A stale fingerprint must not be left behind, or the next refresh could skip a changed summary report.
+            exp_update = {'$set': {'summaryReport': summary_report_json}, '$unset': {'summaryReportFingerprint': ''}}
 
-        result = TreatmentArmsAccessor().update_summary_report(ta_id, summary_report_json)
+        result = TreatmentArmsAccessor().update_summary_report(ta_id, summary_report_json, fingerprint)
         self.assertEqual(result, exp_result)
         self.mock_collection.update_one.assert_called_once_with({'_id': ObjectId(ta_id['$oid'])},
-                                                                {'$set': {'summaryReport': summary_report_json}})
+                                                                exp_update)
+
+    # Test the TreatmentArmsAccessor.update_summary_reports method
+    @data(
+        # 1. nothing to update
+        ([], None, None, None, []),
+        # 2. all matched
+        (['598386900e04839ba1fabcf1', '598386900e04839ba1fabcf2'], 2, None, None, [True, True]),
+        # 3. the second arm no longer exists
+        (['598386900e04839ba1fabcf1', '598386900e04839ba1fabcf2'], 1, None,
+         [{'_id': ObjectId('598386900e04839ba1fabcf1')}], [True, False]),
+        # 4. a write error on the first of three updates
+        (['598386900e04839ba1fabcf1', '598386900e04839ba1fabcf2', '598386900e04839ba1fabcf3'], None,
+         {'nMatched': 2, 'writeErrors': [{'index': 0, 'errmsg': 'too large'}], 'writeConcernErrors': []},
+         None, [False, True, True]),
+        # 5. a write concern error
+        (['598386900e04839ba1fabcf1'], None,
+         {'nMatched': 1, 'writeErrors': [], 'writeConcernErrors': [{'errmsg': 'waiting for replication timed out'}]},
+         None, [False]),
+    )
+    @unpack
+    def test_update_summary_reports(self, oids, matched_count, bulk_write_error, found_docs, exp_results):
+        if bulk_write_error:
+            self.mock_collection.bulk_write.side_effect = BulkWriteError(bulk_write_error)
+        else:
+            self.mock_collection.bulk_write.return_value.matched_count = matched_count
+        self.mock_collection.find.return_value = found_docs
+
+        updates = [({'$oid': oid}, {'sum': i}, 'fp{}'.format(i)) for i, oid in enumerate(oids)]
+        results = TreatmentArmsAccessor().update_summary_reports(updates)
+        self.assertEqual(results, exp_results)
+
+        if oids:
+            exp_operations = [UpdateOne({'_id': ObjectId(oid)},
+                                        {'$set': {'summaryReport': {'sum': i}, 'summaryReportFingerprint': 'fp' + str(i)}})
+                              for i, oid in enumerate(oids)]
+            self.mock_collection.bulk_write.assert_called_once_with(exp_operations, ordered=False)
+        else:
+            self.mock_collection.bulk_write.assert_not_called()
+
+        if found_docs is None:
+            self.mock_collection.find.assert_not_called()
+        else:
+            self.mock_collection.find.assert_called_once_with({'_id': {'$in': [ObjectId(oid) for oid in oids]}},
+                                                              {'_id': 1})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+A unit test script for the accessors/treatment_arm_cache.py module.
+"""
+
+import unittest
+
+from ddt import ddt, data, unpack
+from mock import patch, Mock
+
+from accessors import treatment_arm_cache
+from accessors.treatment_arm_cache import TreatmentArmCache, ArmChangeListener
+from helpers import shared_cache
+
+
+def loader(result):
+    return Mock(return_value=result)
+
+
+@ddt
+class TreatmentArmCacheTests(unittest.TestCase):
+    def setUp(self):
+        TreatmentArmCache._drop()
+        self.addCleanup(TreatmentArmCache._drop)
+
+    def test_get(self):
+        cache = TreatmentArmCache(10, 60)
+        load = loader(['arm A'])
+
+        self.assertEqual(cache.get('A', None, load), ['arm A'])
+        self.assertEqual(cache.get('A', None, load), ['arm A'])
+        self.assertEqual(load.call_count, 1)
+
+        self.assertEqual(cache.get('A', 'other shape', loader(['arm A, other shape'])), ['arm A, other shape'])
+        self.assertEqual(len(cache), 2)
+
+    def test_get_copies(self):
+        cache = TreatmentArmCache(10, 60)
+        cache.get('A', None, loader([{'treatmentArmId': 'A'}]))[0]['treatmentArmId'] = 'modified'
+
+        first, second = cache.get('A', None, loader(None)), cache.get('A', None, loader(None))
+        self.assertEqual(first, [{'treatmentArmId': 'A'}])
+        self.assertIsNot(first, second)
+        self.assertIsNot(first[0], second[0])
+
+    def test_disabled(self):
+        cache = TreatmentArmCache(0, 60)
+        load = loader(['arm A'])
+
+        cache.get('A', None, load)
+        cache.get('A', None, load)
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = TreatmentArmCache(2, 60)
+        cache.get('A', None, loader('A'))
+        cache.get('B', None, loader('B'))
+        cache.get('A', None, loader('A'))  # B is now the least recently used
+        cache.get('C', None, loader('C'))
+
+        load_a, load_b = loader('A'), loader('B')
+        cache.get('A', None, load_a)
+        cache.get('B', None, load_b)
+        self.assertEqual((load_a.call_count, load_b.call_count), (0, 1))
+
+    @data(
+        (60, 59.9, 1),
+        (60, 60.0, 2),
+        (0, 100000.0, 1),
+    )
+    @unpack
+    @patch('accessors.treatment_arm_cache.time')
+    def test_ttl(self, ttl, age, exp_load_cnt, mock_time):
+        cache = TreatmentArmCache(10, ttl)
+        load = loader('A')
+        mock_time.monotonic.return_value = 1000.0
+        cache.get('A', None, load)
+        mock_time.monotonic.return_value = 1000.0 + age
+        cache.get('A', None, load)
+        self.assertEqual(load.call_count, exp_load_cnt)
+
+    def test_invalidate(self):
+        cache = TreatmentArmCache(10, 60)
+        cache.get('A', None, loader('A'))
+        cache.get('A', 'projection', loader('A'))
+        cache.get('B', None, loader('B'))
+
+        cache.invalidate('A')
+        self.assertEqual(len(cache), 1)
+
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    @data('invalidate', 'clear')
+    def test_invalidated_while_loading(self, method):
+        cache = TreatmentArmCache(10, 60)
+
+        def load():
+            getattr(cache, method)(*(['A'] if method == 'invalidate' else []))
+            return 'stale A'
+
+        self.assertEqual(cache.get('A', None, load), 'stale A')
+        self.assertEqual(len(cache), 0)
+
+    def test_instance(self):
+        with patch('accessors.treatment_arm_cache.Environment', return_value=Mock(arm_cache_size=5, arm_cache_ttl=9)):
+            cache = TreatmentArmCache.instance()
+        self.assertIs(TreatmentArmCache.instance(), cache)
+        self.assertEqual((cache.max_size, cache.ttl), (5, 9))
+
+    def test_class_methods_without_instance(self):
+        TreatmentArmCache.invalidate_arms(['A'])
+        TreatmentArmCache.observe_state_tokens([{'treatmentArmId': 'A', 'stateToken': 'x'}])
+        self.assertIsNone(TreatmentArmCache._instance)
+
+    def test_invalidate_arms(self):
+        cache = TreatmentArmCache._instance = TreatmentArmCache(10, 60)
+        for arm_id in ['A', 'B', 'C']:
+            cache.get(arm_id, None, loader(arm_id))
+
+        TreatmentArmCache.invalidate_arms(['A', 'C'])
+        self.assertEqual([key[0] for key in cache._entries], ['B'])
+
+    def test_observe_state_tokens(self):
+        cache = TreatmentArmCache._instance = TreatmentArmCache(10, 60)
+        arms = [{'treatmentArmId': 'A', 'stateToken': {'$uuid': '1'}},
+                {'treatmentArmId': 'B', 'stateToken': {'$uuid': '2'}}]
+
+        def cached_arm_ids():
+            for arm_id in ['A', 'B']:
+                cache.get(arm_id, None, loader(arm_id))
+            TreatmentArmCache.observe_state_tokens(arms)
+            return sorted([key[0] for key in cache._entries])
+
+        # The arms loaded before their stateTokens were first observed may be out of date.
+        self.assertEqual(cached_arm_ids(), [])
+        self.assertEqual(cached_arm_ids(), ['A', 'B'])
+        arms[1] = {'treatmentArmId': 'B', 'stateToken': {'$uuid': '3'}}
+        self.assertEqual(cached_arm_ids(), ['A'])
+        arms.append({'treatmentArmId': 'A', 'stateToken': {'$uuid': '4'}})  # a new active version of A
+        self.assertEqual(cached_arm_ids(), ['B'])
+
+
+class SharedTreatmentArmCacheTests(unittest.TestCase):
+    """Tests the caches of two processes that share a cache."""
+    def setUp(self):
+        TreatmentArmCache._drop()
+        self.addCleanup(TreatmentArmCache._drop)
+        patcher = patch('helpers.shared_cache.STORE', shared_cache.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_shared(self):
+        cache_1, cache_2 = TreatmentArmCache(10, 60), TreatmentArmCache(10, 60)
+        load_1, load_2 = loader([{'treatmentArmId': 'A'}]), loader(['not loaded'])
+
+        self.assertEqual(cache_1.get('A', (True, ()), load_1), [{'treatmentArmId': 'A'}])
+        self.assertEqual(cache_2.get('A', (True, ()), load_2), [{'treatmentArmId': 'A'}])
+        self.assertEqual(cache_2.get('A', (False, ()), loader(['other shape'])), ['other shape'])
+        self.assertEqual((load_1.call_count, load_2.call_count), (1, 0))
+
+    def test_invalidate_shared(self):
+        cache_1, cache_2 = TreatmentArmCache(10, 60), TreatmentArmCache(10, 60)
+        cache_1.get('A', None, loader('old A'))
+        cache_2.get('A', None, loader('old A'))
+        cache_2.get('B', None, loader('B'))
+
+        cache_1.invalidate('A')
+        self.assertEqual(cache_2.get('A', None, loader('new A')), 'new A')
+        self.assertEqual(cache_1.get('A', None, loader('not loaded')), 'new A')
+        self.assertEqual(cache_2.get('B', None, loader('not loaded')), 'B')
+
+    def test_invalidate_arms_without_instance(self):
+        cache = TreatmentArmCache(10, 60)
+        cache.get('A', None, loader('old A'))
+
+        with patch('accessors.treatment_arm_cache.Environment', return_value=Mock(arm_cache_size=5, arm_cache_ttl=9)):
+            TreatmentArmCache.invalidate_arms(['A'])
+        self.assertIsNotNone(TreatmentArmCache._instance)
+        self.assertEqual(cache.get('A', None, loader('new A')), 'new A')
+
+
+@ddt
+class ArmChangeListenerTests(unittest.TestCase):
+    @data(
+        ({'operationType': 'update', 'fullDocument': {'treatmentArmId': 'A'}}, ['B']),
+        ({'operationType': 'insert', 'fullDocument': {'treatmentArmId': 'B'}}, ['A']),
+        ({'operationType': 'delete'}, []),
+        ({'operationType': 'update', 'fullDocument': None}, []),
+    )
+    @unpack
+    def test_handle_change(self, change, exp_cached_arm_ids):
+        cache = TreatmentArmCache(10, 60)
+        for arm_id in ['A', 'B']:
+            cache.get(arm_id, None, loader(arm_id))
+
+        ArmChangeListener(cache, Mock()).handle_change(change)
+        self.assertEqual(sorted([key[0] for key in cache._entries]), exp_cached_arm_ids)
+
+    def test_listen(self):
+        cache = TreatmentArmCache(10, 60)
+        cache.get('A', None, loader('A'))
+        cache.get('B', None, loader('B'))
+        collection = Mock()
+        collection.watch.return_value.__enter__ = Mock(
+            return_value=iter([{'operationType': 'update', 'fullDocument': {'treatmentArmId': 'A'}}]))
+        collection.watch.return_value.__exit__ = Mock(return_value=False)
+
+        cache_clear = Mock(wraps=cache.clear)
+        with patch.object(cache, 'clear', cache_clear):
+            ArmChangeListener(cache, collection)._listen()
+
+        collection.watch.assert_called_once_with(ArmChangeListener.PIPELINE, full_document='updateLookup')
+        cache_clear.assert_called_once_with()
+
+    @data(
+        (False, 256, False),
+        (True, 0, False),
+        (True, 256, True),
+    )
+    @unpack
+    @patch('accessors.treatment_arm_cache.TreatmentArmsAccessor')
+    @patch('accessors.treatment_arm_cache.ArmChangeListener')
+    def test_start_change_listener(self, change_stream, cache_size, exp_started, mock_listener, mock_ta_accessor):
+        TreatmentArmCache._instance = TreatmentArmCache(cache_size, 60)
+        self.addCleanup(TreatmentArmCache._drop)
+        env = Mock(arm_cache_change_stream=change_stream, arm_cache_size=cache_size)
+
+        listener = treatment_arm_cache.start_change_listener(env)
+        if exp_started:
+            mock_listener.assert_called_once_with(TreatmentArmCache._instance, mock_ta_accessor.return_value.collection)
+            self.assertIs(listener, mock_listener.return_value.start.return_value)
+        else:
+            self.assertIsNone(listener)
+            mock_listener.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()